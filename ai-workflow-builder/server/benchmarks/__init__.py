@@ -0,0 +1 @@
+"""In-process benchmarks for the API; see benchmarks/run.py"""
@@ -0,0 +1,206 @@
+"""Local stand-ins for the OpenAI, Gemini, SerpAPI and embedding backends.
+
+They mimic just enough of each client for main.py and simulate provider
+latency (time to first token plus a fixed token rate) so benchmarks
+measure this server rather than the network.
+"""
+import asyncio
+import hashlib
+import re
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+_WORDS = re.compile(r"\w+")
+_FILLER = "the pump valve pressure sensor reading stays within the expected range for this unit".split()
+
+
+def fake_text(tokens: int, seed: str = "") -> str:
+    """Deterministic filler text of roughly the given number of tokens"""
+    offset = int(hashlib.sha256(seed.encode("utf-8")).hexdigest(), 16) % len(_FILLER)
+    return " ".join(_FILLER[(offset + i) % len(_FILLER)] for i in range(max(1, tokens)))
+
+
+class LatencyModel:
+    """Simulated provider timing: first_token_ms, then tokens_per_second"""
+
+    def __init__(self, first_token_ms: float = 200.0, tokens_per_second: float = 200.0, completion_tokens: int = 100):
+        self.first_token_ms = first_token_ms
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+
+    def tokens_for(self, max_tokens: Optional[int]) -> int:
+        return max(1, min(self.completion_tokens, max_tokens or self.completion_tokens))
+
+    def token_delay(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def completion_seconds(self, tokens: int) -> float:
+        return self.first_token_ms / 1000 + tokens * self.token_delay()
+
+
+def _prompt_tokens(*texts: str) -> int:
+    return sum(len(_WORDS.findall(text or "")) for text in texts)
+
+
+class _Usage(SimpleNamespace):
+    def dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+    model_dump = dict
+
+
+class _FakeChatCompletions:
+    def __init__(self, latency: LatencyModel):
+        self.latency = latency
+        self.calls = 0
+
+    async def create(self, model: str, messages: List[Dict[str, str]], max_tokens: Optional[int] = None, stream: bool = False, **kwargs):
+        self.calls += 1
+        prompt = " ".join(message["content"] for message in messages)
+        tokens = self.latency.tokens_for(max_tokens)
+        text = fake_text(tokens, prompt)
+        usage = _Usage(prompt_tokens=_prompt_tokens(prompt), completion_tokens=tokens, total_tokens=_prompt_tokens(prompt) + tokens)
+        if stream:
+            return self._stream(text, usage)
+        await asyncio.sleep(self.latency.completion_seconds(tokens))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=usage)
+
+    async def _stream(self, text: str, usage: _Usage):
+        await asyncio.sleep(self.latency.first_token_ms / 1000)
+        for word in text.split(" "):
+            await asyncio.sleep(self.latency.token_delay())
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))], usage=None)
+        yield SimpleNamespace(choices=[], usage=usage)
+
+
+class _FakeOpenAIEmbeddings:
+    def __init__(self, model: "FakeEmbeddingModel", latency_ms: float):
+        self.model = model
+        self.latency_ms = latency_ms
+
+    async def create(self, input: List[str], model: str):
+        await asyncio.sleep(self.latency_ms / 1000)
+        vectors = self.model.encode(input)
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=vector.tolist()) for i, vector in enumerate(vectors)])
+
+
+class FakeOpenAI:
+    """AsyncOpenAI stand-in: chat.completions.create (plain and streamed) and embeddings.create"""
+
+    def __init__(self, latency: Optional[LatencyModel] = None, embedding_latency_ms: float = 50.0):
+        completions = _FakeChatCompletions(latency or LatencyModel())
+        self.chat = SimpleNamespace(completions=completions)
+        self.embeddings = _FakeOpenAIEmbeddings(FakeEmbeddingModel(dim=1536, ms_per_text=0), embedding_latency_ms)
+
+
+class _FakeGeminiModel:
+    def __init__(self, name: str, latency: LatencyModel, counter: List[int]):
+        self.name = name
+        self.latency = latency
+        self._counter = counter
+
+    def _response(self, text: str, prompt_tokens: int, completion_tokens: int):
+        usage = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=completion_tokens,
+            total_token_count=prompt_tokens + completion_tokens
+        )
+        return SimpleNamespace(text=text, parts=[text] if text else [], usage_metadata=usage)
+
+    async def generate_content_async(self, prompt: str, generation_config: Optional[Dict[str, Any]] = None, stream: bool = False):
+        self._counter[0] += 1
+        tokens = self.latency.tokens_for((generation_config or {}).get("max_output_tokens"))
+        text = fake_text(tokens, prompt)
+        if stream:
+            return self._stream(text, _prompt_tokens(prompt))
+        await asyncio.sleep(self.latency.completion_seconds(tokens))
+        return self._response(text, _prompt_tokens(prompt), tokens)
+
+    async def _stream(self, text: str, prompt_tokens: int):
+        await asyncio.sleep(self.latency.first_token_ms / 1000)
+        words = text.split(" ")
+        for produced, word in enumerate(words, start=1):
+            await asyncio.sleep(self.latency.token_delay())
+            yield self._response(word + " ", prompt_tokens, produced)
+
+
+class FakeGemini:
+    """google.generativeai module stand-in exposing GenerativeModel"""
+
+    def __init__(self, latency: Optional[LatencyModel] = None):
+        self.latency = latency or LatencyModel()
+        self._calls = [0]
+
+    def GenerativeModel(self, name: str) -> _FakeGeminiModel:
+        return _FakeGeminiModel(name, self.latency, self._calls)
+
+    @property
+    def calls(self) -> int:
+        return self._calls[0]
+
+
+class FakeSerpApi:
+    """SerpApiClient stand-in returning canned organic results"""
+
+    def __init__(self, latency_ms: float = 300.0, results: int = 5):
+        self.latency_ms = latency_ms
+        self.results = results
+        self.calls = 0
+
+    async def search(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        self.calls += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+        query = params.get("q", "")
+        return {
+            "organic_results": [
+                {
+                    "position": i + 1,
+                    "title": f"Result {i + 1} for {query}",
+                    "link": f"https://example.com/{i + 1}",
+                    "snippet": fake_text(30, f"{query}-{i}")
+                }
+                for i in range(min(self.results, params.get("num", self.results)))
+            ]
+        }
+
+
+class FakeEmbeddingModel:
+    """Deterministic sentence-transformer stand-in.
+
+    Each text maps to a normalized bag of hashed words, so texts sharing
+    words are close and search results are meaningful. ms_per_text of CPU
+    time is spent per text to approximate a real model's cost.
+    """
+
+    tokenizer = None
+
+    def __init__(self, dim: int = 384, ms_per_text: float = 0.5, max_seq_length: int = 256):
+        self.dim = dim
+        self.ms_per_text = ms_per_text
+        self.max_seq_length = max_seq_length
+        self.calls = 0
+        self.texts = 0
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in _WORDS.findall(text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        self.calls += 1
+        self.texts += len(texts)
+        if self.ms_per_text:
+            # Busy-wait so the simulated cost holds the worker like real inference
+            deadline = time.perf_counter() + len(texts) * self.ms_per_text / 1000
+            while time.perf_counter() < deadline:
+                pass
+        return np.stack([self._vector(text) for text in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
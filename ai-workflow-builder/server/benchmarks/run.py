@@ -0,0 +1,359 @@
+"""Benchmark the API in-process with stubbed providers.
+
+Run from the server directory:
+
+    python -m benchmarks.run --requests 200 --concurrency 16 --output results.json
+    python -m benchmarks.run --scenarios workflow_fan_in search_hybrid --compare results.json
+
+Each scenario sends requests through httpx's ASGI transport with a fixed
+number of concurrent clients and reports throughput, latency percentiles
+and peak RSS. With --compare the run is checked against an earlier
+results file and exits non-zero when p95 latency or throughput regress
+by more than --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from benchmarks.fakes import FakeEmbeddingModel, FakeGemini, FakeOpenAI, FakeSerpApi, LatencyModel, fake_text
+from benchmarks.workflows import deep_workflow, fan_in_workflow, linear_workflow
+
+_TOPICS = ["pump", "valve", "pressure", "sensor", "firmware", "warranty", "calibration", "alarm", "filter", "motor"]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), int(round(q / 100 * len(sorted_values) + 0.5))))
+    return sorted_values[rank - 1]
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size in bytes, where /proc is available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def max_rss() -> Optional[int]:
+    """Peak resident set size of the process so far in bytes"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RssSampler:
+    """Tracks peak RSS while a scenario runs by polling in a background thread"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.start_rss = current_rss()
+        self.peak = self.start_rss or 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            rss = current_rss()
+            if rss is not None:
+                self.peak = max(self.peak, rss)
+
+    def __enter__(self) -> "RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        rss = current_rss()
+        if rss is not None:
+            self.peak = max(self.peak, rss)
+        elif not self.peak:
+            # No /proc: fall back to the process-wide high-water mark
+            self.peak = max_rss() or 0
+        return False
+
+
+class Scenario:
+    """One endpoint under load: send(client, i) issues the i-th request"""
+
+    def __init__(self, name: str, send: Callable[[Any, int], Awaitable[Any]], needs_corpus: bool = False):
+        self.name = name
+        self.send = send
+        self.needs_corpus = needs_corpus
+
+
+def make_documents(count: int, prefix: str, words: int = 200) -> List[Dict[str, Any]]:
+    return [
+        {
+            "filename": f"{prefix}-{i}.txt",
+            "content": f"{_TOPICS[i % len(_TOPICS)]} manual section {i}. " + fake_text(words, f"{prefix}-{i}"),
+            "metadata": {"topic": _TOPICS[i % len(_TOPICS)], "bench": True}
+        }
+        for i in range(count)
+    ]
+
+
+def make_pdf(pages: int, words_per_page: int = 400) -> bytes:
+    import fitz  # PyMuPDF
+
+    document = fitz.open()
+    for page_number in range(pages):
+        page = document.new_page()
+        page.insert_textbox(page.rect + (36, 36, -36, -36), fake_text(words_per_page, f"page-{page_number}"), fontsize=8)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def query_for(i: int) -> str:
+    return f"what does {_TOPICS[i % len(_TOPICS)]} alarm {i % 97} mean"
+
+
+def build_scenarios(args: argparse.Namespace) -> Dict[str, Scenario]:
+    workflows = {
+        "workflow_linear": linear_workflow(),
+        "workflow_fan_in": fan_in_workflow(args.fan_in),
+        "workflow_deep": deep_workflow(args.depth)
+    }
+    pdf = make_pdf(args.pdf_pages)
+
+    def workflow_sender(workflow: Dict[str, Any]):
+        async def send(client, i):
+            return await client.post("/execute-workflow/", json={"workflow": workflow, "query": query_for(i)})
+        return send
+
+    async def ingest(client, i):
+        return await client.post("/process-documents/", json=make_documents(args.docs_per_request, f"ingest-{i}"))
+
+    async def extract(client, i):
+        return await client.post("/extract-text/", files={"file": (f"bench-{i}.pdf", pdf, "application/pdf")})
+
+    def search_sender(mode: str):
+        async def send(client, i):
+            return await client.post("/search-documents/", params={"query": query_for(i), "mode": mode, "n_results": 5})
+        return send
+
+    async def web_search(client, i):
+        return await client.post("/web-search/", params={"query": query_for(i)})
+
+    scenarios = [
+        Scenario("process_documents", ingest),
+        Scenario("extract_text", extract),
+        Scenario("search_vector", search_sender("vector"), needs_corpus=True),
+        Scenario("search_hybrid", search_sender("hybrid"), needs_corpus=True),
+        Scenario("web_search", web_search)
+    ]
+    scenarios += [Scenario(name, workflow_sender(workflow), needs_corpus=True) for name, workflow in workflows.items()]
+    return {scenario.name: scenario for scenario in scenarios}
+
+
+async def load_corpus(client, count: int, batch_size: int = 50):
+    for start in range(0, count, batch_size):
+        batch = make_documents(min(batch_size, count - start), "corpus")
+        for offset, document in enumerate(batch):
+            document["filename"] = f"corpus-{start + offset}.txt"
+        response = await client.post("/process-documents/", json=batch)
+        response.raise_for_status()
+
+
+async def run_scenario(client, scenario: Scenario, requests: int, concurrency: int, warmup: int) -> Dict[str, Any]:
+    for i in range(warmup):
+        await scenario.send(client, -1 - i)
+
+    latencies: List[float] = []
+    status_codes: Dict[str, int] = {}
+    errors: List[str] = []
+    next_request = 0
+
+    async def worker():
+        nonlocal next_request
+        while next_request < requests:
+            i = next_request
+            next_request += 1
+            started = time.perf_counter()
+            try:
+                response = await scenario.send(client, i)
+                code = str(response.status_code)
+                if response.status_code >= 400 and len(errors) < 5:
+                    errors.append(response.text[:200])
+            except Exception as e:
+                code = type(e).__name__
+                if len(errors) < 5:
+                    errors.append(str(e)[:200])
+            latencies.append(time.perf_counter() - started)
+            status_codes[code] = status_codes.get(code, 0) + 1
+
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    failed = sum(count for code, count in status_codes.items() if not code.isdigit() or int(code) >= 400)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "failed": failed,
+        "status_codes": status_codes,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(requests / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(1000 * sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            "p50": round(1000 * percentile(latencies, 50), 3),
+            "p95": round(1000 * percentile(latencies, 95), 3),
+            "p99": round(1000 * percentile(latencies, 99), 3),
+            "max": round(1000 * latencies[-1], 3) if latencies else 0.0
+        },
+        "rss_start_mb": round((rss.start_rss or 0) / 2 ** 20, 1),
+        "rss_peak_mb": round(rss.peak / 2 ** 20, 1)
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Scenarios whose p95 latency rose or throughput fell by more than tolerance"""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        p95, previous_p95 = current["latency_ms"]["p95"], previous["latency_ms"]["p95"]
+        rps, previous_rps = current["throughput_rps"], previous["throughput_rps"]
+        if previous_p95 and p95 > previous_p95 * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous_p95:.1f}ms -> {p95:.1f}ms")
+        if previous_rps and rps < previous_rps * (1 - tolerance):
+            regressions.append(f"{name}: throughput {previous_rps:.1f}/s -> {rps:.1f}/s")
+    return regressions
+
+
+def configure_environment(workdir: str):
+    """Point storage at a scratch directory before main is imported"""
+    os.environ.setdefault("CHROMA_PATH", os.path.join(workdir, "chroma"))
+    os.environ.setdefault("JOB_DB_PATH", os.path.join(workdir, "jobs.db"))
+    os.environ.setdefault("WORKFLOW_REGISTRY_PATH", os.path.join(workdir, "workflows.db"))
+    os.environ.setdefault("TRACE_LOG_PATH", "")
+    os.environ.setdefault("WARMUP_RESOURCES", "")
+    os.environ.setdefault("SERPAPI_API_KEY", "benchmark")
+    # Provider quotas would throttle the fakes; set these explicitly to benchmark the limits themselves
+    for provider in ("OPENAI", "GEMINI", "SERPAPI"):
+        os.environ.setdefault(f"{provider}_REQUESTS_PER_MINUTE", "0")
+        os.environ.setdefault(f"{provider}_TOKENS_PER_MINUTE", "0")
+
+
+def install_fakes(main: Any, args: argparse.Namespace):
+    latency = LatencyModel(args.llm_first_token_ms, args.llm_tokens_per_second, args.llm_completion_tokens)
+    main.openai_resource.set(FakeOpenAI(latency))
+    main.gemini_resource.set(FakeGemini(latency))
+    main.serpapi_resource.set(FakeSerpApi(args.search_latency_ms))
+    main.embedding_resource.set(FakeEmbeddingModel(ms_per_text=args.embed_ms_per_text))
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+    import main
+    from executors import executor_metrics
+    from providers import provider_stats
+
+    install_fakes(main, args)
+    scenarios = build_scenarios(args)
+    unknown = [name for name in args.scenarios if name not in scenarios]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)}; choose from {', '.join(scenarios)}")
+    selected = [scenarios[name] for name in (args.scenarios or scenarios)]
+
+    results: Dict[str, Any] = {
+        "started_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "scenarios": {}
+    }
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        if any(scenario.needs_corpus for scenario in selected):
+            print(f"Loading {args.corpus_docs} corpus documents...")
+            await load_corpus(client, args.corpus_docs)
+        for scenario in selected:
+            stats = await run_scenario(client, scenario, args.requests, args.concurrency, args.warmup)
+            results["scenarios"][scenario.name] = stats
+            latency = stats["latency_ms"]
+            print(
+                f"{scenario.name:20s} {stats['throughput_rps']:9.1f} req/s  "
+                f"p50={latency['p50']:8.1f}ms p95={latency['p95']:8.1f}ms p99={latency['p99']:8.1f}ms  "
+                f"rss={stats['rss_peak_mb']:.0f}MB  failed={stats['failed']}"
+            )
+            if stats["errors"]:
+                print(f"  first error: {stats['errors'][0]}")
+    results["executors"] = executor_metrics()
+    results["providers"] = provider_stats()
+    results["peak_rss_mb"] = round((max_rss() or 0) / 2 ** 20, 1)
+    return results
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", nargs="*", default=[], help="Scenarios to run (default: all)")
+    parser.add_argument("--requests", type=int, default=100, help="Measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests before each scenario")
+    parser.add_argument("--corpus-docs", type=int, default=200, help="Documents ingested before search and workflow scenarios")
+    parser.add_argument("--docs-per-request", type=int, default=10, help="Documents per /process-documents/ request")
+    parser.add_argument("--pdf-pages", type=int, default=20, help="Pages in the /extract-text/ upload")
+    parser.add_argument("--fan-in", type=int, default=8, help="knowledgeBase nodes in the fan-in workflow")
+    parser.add_argument("--depth", type=int, default=8, help="llmEngine nodes in the deep workflow")
+    parser.add_argument("--llm-first-token-ms", type=float, default=200.0)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=500.0)
+    parser.add_argument("--llm-completion-tokens", type=int, default=100)
+    parser.add_argument("--search-latency-ms", type=float, default=300.0, help="Simulated SerpAPI latency")
+    parser.add_argument("--embed-ms-per-text", type=float, default=0.5, help="Simulated embedding cost per text")
+    parser.add_argument("--workdir", help="Directory for the scratch Chroma store and job database")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Earlier results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression for --compare")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="workflow-bench-")
+    configure_environment(workdir)
+
+    results = asyncio.run(run(args))
+
+    from executors import shutdown_executors
+    shutdown_executors(wait=False)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output} (peak RSS {results['peak_rss_mb']}MB)")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""Synthetic workflow graphs in the frontend's React Flow format"""
+from typing import Any, Dict, List, Optional
+
+
+def _node(node_id: str, node_type: str, config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    return {"id": node_id, "type": node_type, "position": {"x": 0, "y": 0}, "data": {"config": config or {}}}
+
+
+def _edge(source: str, target: str, target_handle: Optional[str] = None) -> Dict[str, Any]:
+    edge = {"id": f"{source}-{target}", "source": source, "target": target}
+    if target_handle:
+        edge["targetHandle"] = target_handle
+    return edge
+
+
+def linear_workflow(model: str = "gpt-4o-mini", n_results: int = 3) -> Dict[str, Any]:
+    """userQuery -> knowledgeBase -> llmEngine -> output, the default app layout"""
+    return {
+        "id": "bench-linear",
+        "nodes": [
+            _node("query", "userQuery"),
+            _node("kb", "knowledgeBase", {"nResults": n_results}),
+            _node("llm", "llmEngine", {"model": model}),
+            _node("output", "output")
+        ],
+        "edges": [
+            _edge("query", "kb"),
+            _edge("query", "llm"),
+            _edge("kb", "llm"),
+            _edge("llm", "output")
+        ]
+    }
+
+
+def fan_in_workflow(width: int = 8, model: str = "gpt-4o-mini", retrieval_modes: Optional[List[str]] = None) -> Dict[str, Any]:
+    """width knowledgeBase nodes searched in parallel and merged into one llmEngine"""
+    modes = retrieval_modes or ["vector", "keyword", "hybrid"]
+    nodes = [_node("query", "userQuery")]
+    edges = [_edge("query", "llm")]
+    for i in range(width):
+        nodes.append(_node(f"kb{i}", "knowledgeBase", {"nResults": 2, "retrievalMode": modes[i % len(modes)]}))
+        edges.append(_edge("query", f"kb{i}"))
+        edges.append(_edge(f"kb{i}", "llm", "context"))
+    nodes.append(_node("llm", "llmEngine", {"model": model}))
+    nodes.append(_node("output", "output"))
+    edges.append(_edge("llm", "output"))
+    return {"id": f"bench-fan-in-{width}", "nodes": nodes, "edges": edges}
+
+
+def deep_workflow(depth: int = 8, models: Optional[List[str]] = None) -> Dict[str, Any]:
+    """A chain of depth llmEngine nodes, each refining the previous answer"""
+    models = models or ["gpt-4o-mini", "gemini-1.5-flash"]
+    nodes = [_node("query", "userQuery")]
+    edges = []
+    previous = "query"
+    for i in range(depth):
+        nodes.append(_node(f"llm{i}", "llmEngine", {"model": models[i % len(models)], "maxTokens": 200}))
+        edges.append(_edge("query", f"llm{i}", "query"))
+        if previous != "query":
+            edges.append(_edge(previous, f"llm{i}", "context"))
+        previous = f"llm{i}"
+    nodes.append(_node("output", "output"))
+    edges.append(_edge(previous, "output"))
+    return {"id": f"bench-deep-{depth}", "nodes": nodes, "edges": edges}
+
+
+WORKFLOWS = {
+    "linear": linear_workflow,
+    "fan_in": fan_in_workflow,
+    "deep": deep_workflow
+}
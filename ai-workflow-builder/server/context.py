@@ -0,0 +1,226 @@
+"""Token-budgeted context assembly for llmEngine prompts.
+
+Context chunks from the connected nodes are merged by rank, exact and
+near-duplicate chunks are dropped, and the best chunks are kept until
+the token budget is spent. The budget comes from the model's context
+window (MODEL_LIMITS) minus the rest of the prompt and the completion,
+capped by LLM_CONTEXT_MAX_TOKENS.
+"""
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from embeddings import encode_texts, text_hash
+from retrieval import reciprocal_rank_fusion
+
+LLM_CONTEXT_MAX_TOKENS = int(os.getenv("LLM_CONTEXT_MAX_TOKENS", "3000"))
+LLM_DEFAULT_MAX_TOKENS = int(os.getenv("LLM_DEFAULT_MAX_TOKENS", "1000"))
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.95"))
+# "auto" uses tiktoken when it is installed, "approx" always uses the regex estimate
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "auto")
+# Tokens for the prompt template and chat message framing around the context
+PROMPT_OVERHEAD_TOKENS = 16
+
+# Model name prefix -> (context window, max completion tokens, tiktoken encoding)
+MODEL_LIMITS: Dict[str, Tuple[int, int, Optional[str]]] = {
+    "gpt-3.5-turbo": (16385, 4096, "cl100k_base"),
+    "gpt-4": (8192, 4096, "cl100k_base"),
+    "gpt-4-turbo": (128000, 4096, "cl100k_base"),
+    "gpt-4o": (128000, 16384, "o200k_base"),
+    "gpt-4.1": (1047576, 32768, "o200k_base"),
+    "gemini-pro": (32760, 8192, None),
+    "gemini-1.0-pro": (32760, 8192, None),
+    "gemini-1.5-flash": (1048576, 8192, None),
+    "gemini-1.5-pro": (2097152, 8192, None),
+    "gemini-2.0-flash": (1048576, 8192, None)
+}
+DEFAULT_MODEL_LIMITS = (8192, 2048, None)
+# Extra or corrected entries, e.g. {"gpt-4o-2024-08-06": [128000, 16384]}
+for _name, _limits in json.loads(os.getenv("MODEL_CONTEXT_WINDOWS", "{}")).items():
+    MODEL_LIMITS[_name] = (int(_limits[0]), int(_limits[1]), _limits[2] if len(_limits) > 2 else None)
+
+
+def model_limits(model: str) -> Tuple[int, int, Optional[str]]:
+    """(context window, max completion tokens, encoding) of the longest matching prefix"""
+    matches = [name for name in MODEL_LIMITS if model.startswith(name)]
+    return MODEL_LIMITS[max(matches, key=len)] if matches else DEFAULT_MODEL_LIMITS
+
+
+class ApproxTokenizer:
+    """Regex estimate that slightly over-counts BPE tokens for English text"""
+
+    _PIECES = re.compile(r"\w+|[^\w\s]")
+
+    def _spans(self, text: str) -> List[Tuple[int, int, int]]:
+        # Words up to 8 characters count as one token, longer ones as several
+        return [
+            (match.start(), match.end(), 1 + (match.end() - match.start() - 1) // 8)
+            for match in self._PIECES.finditer(text)
+        ]
+
+    def count(self, text: str) -> int:
+        return sum(tokens for _, _, tokens in self._spans(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        used, cut = 0, 0
+        for _, end, tokens in self._spans(text):
+            if used + tokens > max_tokens:
+                return text[:cut]
+            used += tokens
+            cut = end
+        return text
+
+
+class TiktokenTokenizer:
+    def __init__(self, encoding: Any):
+        self.encoding = encoding
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        tokens = self.encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else self.encoding.decode(tokens[:max_tokens])
+
+
+_approx_tokenizer = ApproxTokenizer()
+_tokenizers: Dict[str, Any] = {}
+
+
+def get_tokenizer(model: str):
+    """tiktoken for models with a known encoding when available, otherwise the regex estimate"""
+    encoding_name = model_limits(model)[2]
+    if CONTEXT_TOKENIZER == "approx" or encoding_name is None:
+        return _approx_tokenizer
+    if encoding_name not in _tokenizers:
+        try:
+            import tiktoken
+            _tokenizers[encoding_name] = TiktokenTokenizer(tiktoken.get_encoding(encoding_name))
+        except Exception as e:
+            print(f"Warning: tiktoken encoding {encoding_name} not available, estimating token counts: {e}")
+            _tokenizers[encoding_name] = _approx_tokenizer
+    return _tokenizers[encoding_name]
+
+
+def count_tokens(text: str, model: str) -> int:
+    return get_tokenizer(model).count(text or "")
+
+
+class RetrievedContext(str):
+    """A knowledgeBase node's text output that also keeps its ranked hits"""
+
+    def __new__(cls, text: str, hits: List[Dict[str, Any]]):
+        value = super().__new__(cls, text)
+        value.hits = hits
+        return value
+
+
+def _ranked_chunks(contexts: List[str]) -> List[Dict[str, Any]]:
+    """Chunks from every context input, merged by reciprocal rank fusion"""
+    chunks: Dict[str, Dict[str, Any]] = {}
+    rankings = []
+    for position, context in enumerate(contexts):
+        hits = getattr(context, "hits", None)
+        if hits is None:
+            hits = [{"id": f"input-{position}", "document": str(context)}] if context else []
+        ranking = []
+        for hit in hits:
+            chunk_id = hit.get("id") or f"input-{position}-{len(ranking)}"
+            chunks.setdefault(chunk_id, {"id": chunk_id, "text": hit["document"] or ""})
+            ranking.append(chunk_id)
+        rankings.append(ranking)
+    return [chunks[chunk_id] for chunk_id, _ in reciprocal_rank_fusion(rankings)]
+
+
+async def _drop_duplicates(
+    chunks: List[Dict[str, Any]],
+    embedding_model: Any,
+    embedding_model_name: Optional[str],
+    threshold: float
+) -> List[Dict[str, Any]]:
+    """Drop chunks whose text, or embedding above threshold cosine similarity, matches a better-ranked chunk"""
+    seen, unique = set(), []
+    for chunk in chunks:
+        key = text_hash(chunk["text"])
+        if chunk["text"].strip() and key not in seen:
+            seen.add(key)
+            unique.append(chunk)
+    if embedding_model is None or threshold >= 1 or len(unique) < 2:
+        return unique
+
+    # Chunk embeddings are usually cache hits from ingestion
+    vectors = await encode_texts(embedding_model, [chunk["text"] for chunk in unique], embedding_model_name)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    kept: List[int] = []
+    for index in range(len(unique)):
+        if not kept or float(np.max(vectors[kept] @ vectors[index])) < threshold:
+            kept.append(index)
+    return [unique[index] for index in kept]
+
+
+async def assemble_context(
+    model: str,
+    question: str,
+    contexts: List[str],
+    system_prompt: str = "",
+    max_tokens: Optional[int] = None,
+    max_context_tokens: Optional[int] = None,
+    embedding_model: Any = None,
+    embedding_model_name: Optional[str] = None,
+    dedup_threshold: Optional[float] = None
+) -> Dict[str, Any]:
+    """Fit the context inputs into the model's prompt budget.
+
+    Returns the context text and the max_tokens to request, which is the
+    requested completion size (LLM_DEFAULT_MAX_TOKENS when not given)
+    limited to what the model allows and what is left of its window.
+    max_context_tokens caps the context (LLM_CONTEXT_MAX_TOKENS by
+    default, 0 for no cap beyond the window).
+    """
+    tokenizer = get_tokenizer(model)
+    window, max_output, _ = model_limits(model)
+    requested = min(max_tokens or LLM_DEFAULT_MAX_TOKENS, max_output)
+    overhead = tokenizer.count(system_prompt or "") + tokenizer.count(question or "") + PROMPT_OVERHEAD_TOKENS
+    if overhead >= window:
+        raise ValueError(f"Prompt of about {overhead} tokens exceeds the {window} token context window of {model}")
+
+    cap = LLM_CONTEXT_MAX_TOKENS if max_context_tokens is None else max_context_tokens
+    budget = max(0, window - overhead - requested)
+    if cap:
+        budget = min(budget, cap)
+
+    chunks = _ranked_chunks(contexts)
+    unique = await _drop_duplicates(
+        chunks,
+        embedding_model,
+        embedding_model_name,
+        CONTEXT_DEDUP_THRESHOLD if dedup_threshold is None else dedup_threshold
+    )
+
+    # Best-ranked first; skip chunks that do not fit so shorter ones can use the rest
+    kept, used, truncated = [], 0, False
+    for chunk in unique:
+        # One extra token for the separator between chunks
+        tokens = tokenizer.count(chunk["text"]) + 1
+        if used + tokens <= budget:
+            kept.append(chunk["text"])
+            used += tokens
+        elif not kept and budget > 1:
+            kept.append(tokenizer.truncate(chunk["text"], budget - 1))
+            used = budget
+            truncated = True
+
+    return {
+        "context": "\n\n".join(kept),
+        "max_tokens": max(1, min(requested, window - overhead - used)),
+        "context_tokens": used,
+        "prompt_tokens": overhead + used,
+        "chunks": len(kept),
+        "duplicates": len(chunks) - len(unique),
+        "dropped": len(unique) - len(kept),
+        "truncated": truncated
+    }
@@ -0,0 +1,142 @@
+"""Standalone embedding service shared by several API workers.
+
+Run one instance with
+
+    uvicorn embedding_service:app --port 8001
+
+and start the API workers with EMBEDDING_SERVICE_URL=http://localhost:8001
+so they all use this process's single copy of the model instead of
+loading their own.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List
+
+import numpy as np
+from fastapi import FastAPI, HTTPException, Response
+from pydantic import BaseModel
+
+from executors import embedding_executor
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+SHAPE_HEADER = "X-Embedding-Shape"
+
+model = None
+
+
+class EncodeRequest(BaseModel):
+    texts: List[str]
+    batch_size: int = 32
+
+
+class TokenizeRequest(BaseModel):
+    texts: List[str]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global model
+    from sentence_transformers import SentenceTransformer
+    model = await asyncio.to_thread(SentenceTransformer, EMBEDDING_MODEL_NAME)
+    yield
+
+
+app = FastAPI(title="AI Workflow Builder Embedding Service", version="1.0.0", lifespan=lifespan)
+
+
+@app.get("/info")
+def info():
+    if model is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    return {
+        "model": EMBEDDING_MODEL_NAME,
+        "max_seq_length": model.max_seq_length,
+        "dimensions": model.get_sentence_embedding_dimension(),
+        # Whether /tokenize can return token offsets for chunking
+        "offsets": bool(getattr(model.tokenizer, "is_fast", False))
+    }
+
+
+@app.post("/tokenize")
+async def tokenize(request: TokenizeRequest):
+    """Character offsets of each text's tokens, without special tokens"""
+    if model is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    if not getattr(model.tokenizer, "is_fast", False):
+        raise HTTPException(status_code=501, detail="Model tokenizer does not provide offsets")
+    encoding = await embedding_executor.run(
+        model.tokenizer,
+        request.texts,
+        add_special_tokens=False,
+        return_offsets_mapping=True,
+        verbose=False
+    )
+    return {"offsets": encoding["offset_mapping"]}
+
+
+@app.post("/encode")
+async def encode(request: EncodeRequest):
+    """Encode texts and return a raw float32 matrix; the shape is in X-Embedding-Shape"""
+    if model is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    vectors = await embedding_executor.run(
+        model.encode,
+        request.texts,
+        batch_size=request.batch_size,
+        convert_to_numpy=True,
+        show_progress_bar=False
+    )
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(request.texts), -1)
+    return Response(
+        content=vectors.tobytes(),
+        media_type="application/octet-stream",
+        headers={SHAPE_HEADER: f"{vectors.shape[0]},{vectors.shape[1]}"}
+    )
+
+
+class RemoteTokenizer:
+    """Fast-tokenizer stand-in that asks the service for token offsets"""
+
+    is_fast = True
+
+    def __init__(self, client: Any):
+        self._client = client
+
+    def __call__(self, text: str, **kwargs) -> Dict[str, Any]:
+        response = self._client.post("/tokenize", json={"texts": [text]})
+        response.raise_for_status()
+        return {"offset_mapping": [tuple(span) for span in response.json()["offsets"][0]]}
+
+
+class RemoteEmbeddingModel:
+    """Client with the SentenceTransformer.encode interface that calls the shared service.
+
+    The service's /info is fetched on construction, so create it where
+    blocking is fine (the embeddings resource loader runs in a worker
+    thread); an unreachable service fails the load instead of a request.
+    """
+
+    def __init__(self, url: str, timeout: float = 60.0):
+        import httpx
+        self._client = httpx.Client(base_url=url, timeout=timeout)
+        response = self._client.get("/info")
+        response.raise_for_status()
+        self.info = response.json()
+        self.max_seq_length = self.info["max_seq_length"]
+        # Chunking falls back to word boundaries when the service has no offsets
+        self.tokenizer = RemoteTokenizer(self._client) if self.info.get("offsets") else None
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        # One request per batch so a large ingest does not hit the client timeout
+        batches = []
+        for first in range(0, len(texts), max(1, batch_size)):
+            batch = texts[first:first + max(1, batch_size)]
+            response = self._client.post("/encode", json={"texts": batch, "batch_size": batch_size})
+            response.raise_for_status()
+            rows, dimensions = (int(value) for value in response.headers[SHAPE_HEADER].split(","))
+            batches.append(np.frombuffer(response.content, dtype=np.float32).reshape(rows, dimensions))
+        vectors = np.concatenate(batches) if batches else np.zeros((0, self.info["dimensions"]), dtype=np.float32)
+        return vectors[0] if single else vectors
@@ -0,0 +1,459 @@
+"""Embedding generation with a content-addressed cache.
+
+Every embedding path goes through encode_texts (sentence-transformers) or
+embed_openai so that repeated text is only ever encoded once per model.
+Vectors are cached in an in-memory LRU and, when EMBEDDING_CACHE_DIR is
+set, in a memory-mapped float32 store that survives restarts. Small
+concurrent sentence-transformer requests are micro-batched into a single
+encode() call.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from caching import LRUCache
+from executors import embedding_executor, blocking_io_executor
+from providers import estimate_tokens, openai_provider
+from tracing import annotate, record_cache, span
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "86400"))
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR")
+EMBEDDING_CACHE_DISK_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_DISK_MAX_ENTRIES", "500000"))
+EMBEDDING_BATCH_MAX_ITEMS = int(os.getenv("EMBEDDING_BATCH_MAX_ITEMS", "64"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class DiskEmbeddingStore:
+    """Append-only float32 matrix per model, memory-mapped for reads.
+
+    <model>.f32 holds one row per vector, <model>.idx holds one
+    "hash row" line per vector and <model>.json records the dimension.
+    Several processes may share the directory: writers hold an exclusive
+    lock on <model>.lock and number new rows from the size of the .f32
+    file, and readers pick up rows other processes appended. Once more
+    than max_entries vectors are stored the newest half is kept.
+    """
+
+    def __init__(self, directory: str, model_name: str, max_entries: int = EMBEDDING_CACHE_DISK_MAX_ENTRIES):
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, f"{safe_name}.f32")
+        self._index_path = os.path.join(directory, f"{safe_name}.idx")
+        self._meta_path = os.path.join(directory, f"{safe_name}.json")
+        self._lock_path = os.path.join(directory, f"{safe_name}.lock")
+        self.max_entries = max(2, max_entries)
+        self._lock = threading.Lock()
+        self._index: Dict[str, int] = {}
+        self._index_offset = 0
+        self._index_lines = 0
+        self._index_inode: Optional[int] = None
+        self._matrix: Optional[np.memmap] = None
+        self.dim: Optional[int] = None
+        self.compactions = 0
+        with self._lock, self._file_lock(shared=True):
+            self._reload()
+
+    @contextmanager
+    def _file_lock(self, shared: bool = False, blocking: bool = True):
+        """flock on the lock file; a no-op where fcntl is unavailable (single process only).
+
+        Non-blocking acquisition raises BlockingIOError while another
+        process holds the lock.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, "a") as f:
+            fcntl.flock(f, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _reload(self):
+        self._index = {}
+        self._index_offset = 0
+        self._index_lines = 0
+        self._index_inode = None
+        self._matrix = None
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                self.dim = json.load(f)["dim"]
+        self._read_index()
+
+    def _read_index(self):
+        """Read index lines appended since the last read and remap the vectors"""
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, "rb") as f:
+            self._index_inode = os.fstat(f.fileno()).st_ino
+            f.seek(self._index_offset)
+            data = f.read()
+        # A line without its newline is still being written
+        complete = data[:data.rfind(b"\n") + 1]
+        self._index_offset += len(complete)
+        for line in complete.decode("utf-8").splitlines():
+            parts = line.split()
+            if parts:
+                # Files written before rows were recorded have one key per line
+                row = int(parts[1]) if len(parts) > 1 else self._index_lines
+                # The first row written for a key is the one other processes use
+                self._index.setdefault(parts[0], row)
+            self._index_lines += 1
+        self._remap()
+
+    def _remap(self):
+        size = os.path.getsize(self._vectors_path) if self.dim and os.path.exists(self._vectors_path) else 0
+        rows = size // (4 * self.dim) if self.dim else 0
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim)) if rows else None
+
+    def _changed(self) -> bool:
+        try:
+            stat = os.stat(self._index_path)
+        except FileNotFoundError:
+            return self._index_inode is not None
+        return stat.st_ino != self._index_inode or stat.st_size > self._index_offset
+
+    def _refresh(self):
+        """Catch up with rows appended or a compaction done by another process"""
+        if not self._changed():
+            return
+        try:
+            inode = os.stat(self._index_path).st_ino
+        except FileNotFoundError:
+            inode = None
+        if inode != self._index_inode:
+            self._reload()
+        else:
+            self._read_index()
+
+    def _row(self, key: str) -> Optional[np.ndarray]:
+        row = self._index.get(key)
+        if row is None or self._matrix is None or row >= self._matrix.shape[0]:
+            return None
+        return np.array(self._matrix[row])
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """Vectors for keys (None for misses); blocking, so call it through blocking_io_executor"""
+        with self._lock:
+            vectors = [self._row(key) for key in keys]
+            if any(vector is None for vector in vectors) and self._changed():
+                # Another process may have appended the missing rows
+                with self._file_lock(shared=True):
+                    self._refresh()
+                vectors = [self._row(key) if vector is None else vector for key, vector in zip(keys, vectors)]
+        return vectors
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        return self.get_many([key])[0]
+
+    def put_many(self, items: List[Tuple[str, np.ndarray]]):
+        with self._lock, self._file_lock():
+            self._refresh()
+            fresh: Dict[str, np.ndarray] = {}
+            for key, vector in items:
+                if key not in self._index:
+                    fresh.setdefault(key, vector)
+            if not fresh:
+                return
+            if self.dim is None:
+                self.dim = int(next(iter(fresh.values())).shape[-1])
+                with open(self._meta_path, "w") as f:
+                    json.dump({"dim": self.dim}, f)
+
+            # Number rows from the file itself, dropping a partial row left by a crashed writer
+            row_bytes = 4 * self.dim
+            size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+            start = size // row_bytes
+            if size % row_bytes:
+                os.truncate(self._vectors_path, start * row_bytes)
+
+            # Vectors first so an index entry never points past the end of the file
+            rows = np.stack(list(fresh.values())).astype(np.float32)
+            with open(self._vectors_path, "ab") as f:
+                f.write(rows.tobytes())
+            with open(self._index_path, "a") as f:
+                f.write("".join(f"{key} {start + offset}\n" for offset, key in enumerate(fresh)))
+            self._read_index()
+
+            if len(self._index) > self.max_entries:
+                self._compact()
+
+    def _compact(self):
+        """Rewrite the store with the newest max_entries // 2 vectors (exclusive lock held)"""
+        keep = sorted(self._index.items(), key=lambda item: item[1])[-(self.max_entries // 2):]
+        vectors_tmp = f"{self._vectors_path}.{os.getpid()}.tmp"
+        index_tmp = f"{self._index_path}.{os.getpid()}.tmp"
+        with open(vectors_tmp, "wb") as f:
+            for first in range(0, len(keep), 10000):
+                rows = [row for _, row in keep[first:first + 10000]]
+                f.write(np.asarray(self._matrix[rows], dtype=np.float32).tobytes())
+        with open(index_tmp, "w") as f:
+            f.write("".join(f"{key} {row}\n" for row, (key, _) in enumerate(keep)))
+        os.replace(vectors_tmp, self._vectors_path)
+        os.replace(index_tmp, self._index_path)
+        self.compactions += 1
+        self._reload()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+class EmbeddingCache:
+    """Memory tier in front of an optional per-model disk tier"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float, directory: Optional[str] = None):
+        self.memory = LRUCache(max_entries, ttl_seconds)
+        self.directory = directory
+        self._disk: Dict[str, DiskEmbeddingStore] = {}
+        self._disk_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def disk_store(self, model_name: str) -> Optional[DiskEmbeddingStore]:
+        """The model's disk tier, opened on first use; blocking, as opening reads the whole index"""
+        if not self.directory:
+            return None
+        with self._disk_lock:
+            if model_name not in self._disk:
+                try:
+                    self._disk[model_name] = DiskEmbeddingStore(self.directory, model_name)
+                except Exception as e:
+                    print(f"Warning: Embedding disk cache not available: {e}")
+                    self.directory = None
+                    return None
+            return self._disk[model_name]
+
+    def _disk_get_many(self, model_name: str, keys: List[str]) -> List[Optional[np.ndarray]]:
+        disk = self.disk_store(model_name)
+        return disk.get_many(keys) if disk is not None else [None] * len(keys)
+
+    def _disk_put_many(self, model_name: str, items: List[Tuple[str, np.ndarray]]):
+        disk = self.disk_store(model_name)
+        if disk is not None:
+            disk.put_many(items)
+
+    async def get_many(self, model_name: str, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached vectors for keys; only the memory tier is checked on the event loop"""
+        vectors = [self.memory.get((model_name, key)) for key in keys]
+        self.memory_hits += sum(vector is not None for vector in vectors)
+        missing = [key for key, vector in zip(keys, vectors) if vector is None]
+        if missing and self.directory:
+            found = dict(zip(missing, await blocking_io_executor.run(self._disk_get_many, model_name, missing)))
+            for key, vector in found.items():
+                if vector is not None:
+                    self.disk_hits += 1
+                    self.memory.put((model_name, key), vector)
+            vectors = [found.get(key) if vector is None else vector for key, vector in zip(keys, vectors)]
+        self.misses += sum(vector is None for vector in vectors)
+        return vectors
+
+    async def put_many(self, model_name: str, items: List[Tuple[str, np.ndarray]]):
+        for key, vector in items:
+            self.memory.put((model_name, key), vector)
+        if self.directory and items:
+            await blocking_io_executor.run(self._disk_put_many, model_name, items)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self.memory),
+            "disk_entries": sum(len(store) for store in self._disk.values()),
+            "disk_enabled": bool(self.directory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.memory.evictions,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+        }
+
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL, EMBEDDING_CACHE_DIR)
+
+
+class EmbeddingBatcher:
+    """Gathers concurrent encode requests for one model into vectorized batches.
+
+    A batch is sent when max_items texts are waiting or max_wait_ms after
+    the first one arrived, whichever comes first. A text that is already
+    waiting or being encoded is not queued again; its callers share the
+    same future.
+    """
+
+    def __init__(self, model: Any, max_items: int = EMBEDDING_BATCH_MAX_ITEMS, max_wait_ms: float = EMBEDDING_BATCH_WAIT_MS):
+        self.model = model
+        self.max_items = max(1, max_items)
+        self.max_wait_ms = max_wait_ms
+        self._pending: List[Tuple[str, str]] = []
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.items = 0
+        self.coalesced = 0
+
+    async def encode(self, keys: List[str], texts: List[str]) -> List[np.ndarray]:
+        loop = asyncio.get_running_loop()
+        futures = []
+        for key, text in zip(keys, texts):
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._inflight[key] = loop.create_future()
+                self._pending.append((key, text))
+            else:
+                self.coalesced += 1
+            futures.append(future)
+
+        while len(self._pending) >= self.max_items:
+            self._flush()
+        if self._pending and self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+
+        # Shielded so one caller giving up does not cancel a vector others are waiting on
+        return list(await asyncio.gather(*(asyncio.shield(future) for future in futures)))
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.max_items], self._pending[self.max_items:]
+        if batch:
+            # The loop only holds weak references to tasks, so keep one until the batch is done
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait_ms / 1000, self._flush)
+
+    async def _run(self, batch: List[Tuple[str, str]]):
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            vectors = await embedding_executor.run(
+                self.model.encode,
+                [text for _, text in batch],
+                batch_size=len(batch),
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+            vectors = np.asarray(vectors, dtype=np.float32)
+        except Exception as e:
+            for key, _ in batch:
+                future = self._inflight.pop(key)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (key, _), vector in zip(batch, vectors):
+            future = self._inflight.pop(key)
+            if not future.done():
+                future.set_result(vector)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "coalesced": self.coalesced,
+            "average_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "pending": len(self._pending)
+        }
+
+
+_batchers: Dict[str, EmbeddingBatcher] = {}
+
+
+def get_batcher(model: Any, model_name: str) -> EmbeddingBatcher:
+    batcher = _batchers.get(model_name)
+    if batcher is None or batcher.model is not model:
+        batcher = _batchers[model_name] = EmbeddingBatcher(model)
+    return batcher
+
+
+async def _cached_embed(model_name: str, texts: List[str], encode) -> np.ndarray:
+    """Look texts up in the cache and call encode(keys, texts) for the misses"""
+    keys = [text_hash(text) for text in texts]
+    vectors = await embedding_cache.get_many(model_name, keys)
+
+    # Encode each distinct missing text once
+    missing: Dict[str, str] = {}
+    for key, text, vector in zip(keys, texts, vectors):
+        if vector is None and key not in missing:
+            missing[key] = text
+
+    hits = sum(vector is not None for vector in vectors)
+    record_cache("embedding", hits, len(texts) - hits)
+    annotate(texts=len(texts), cache_hits=hits, encoded=len(missing))
+
+    if missing:
+        encoded = np.asarray(await encode(list(missing.keys()), list(missing.values())), dtype=np.float32)
+        fresh = dict(zip(missing.keys(), encoded))
+        await embedding_cache.put_many(model_name, list(fresh.items()))
+        vectors = [fresh[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+
+    if not vectors:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack(vectors)
+
+
+async def encode_texts(model: Any, texts: List[str], model_name: str, **encode_kwargs) -> np.ndarray:
+    """Sentence-transformer embeddings for texts, one row per input.
+
+    Small requests go through the model's micro-batcher; bulk requests
+    (ingestion) and calls with custom encode() options run directly.
+    """
+    async def encode(keys: List[str], batch: List[str]):
+        if not encode_kwargs and len(batch) < EMBEDDING_BATCH_MAX_ITEMS:
+            return await get_batcher(model, model_name).encode(keys, batch)
+        return await embedding_executor.run(
+            model.encode, batch, convert_to_numpy=True, show_progress_bar=False, **encode_kwargs
+        )
+    with span("embedding.encode", model=model_name):
+        return await _cached_embed(model_name, texts, encode)
+
+
+async def embed_openai(client: Any, texts: List[str], model_name: str = "text-embedding-ada-002") -> np.ndarray:
+    """OpenAI embeddings for texts, one row per input"""
+    async def encode(keys: List[str], batch: List[str]):
+        # Through the provider layer for its rate limits, timeout and retries (the client has max_retries=0)
+        response = await openai_provider.call(
+            client.embeddings.create,
+            tokens=sum(estimate_tokens(text) for text in batch),
+            hedge=True,
+            input=batch,
+            model=model_name
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    with span("embedding.openai", model=model_name):
+        return await _cached_embed(f"openai/{model_name}", texts, encode)
+
+
+def embedding_cache_stats() -> Dict[str, Any]:
+    return embedding_cache.stats()
+
+
+def embedding_batcher_stats() -> Dict[str, Any]:
+    return {model_name: batcher.stats() for model_name, batcher in _batchers.items()}
@@ -0,0 +1,157 @@
+"""Bounded executor pools for running blocking work off the event loop"""
+import asyncio
+import functools
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from tracing import record_queue_wait
+
+
+def _timed_call(fn: Callable, args: tuple, kwargs: Dict[str, Any]) -> tuple:
+    """Run fn in the worker and report when it actually started"""
+    started_at = time.time()
+    return started_at, fn(*args, **kwargs)
+
+
+class BoundedExecutor:
+    """Thread or process pool with a cap on in-flight calls and queue metrics.
+
+    At most max_workers calls run at once and at most max_queue more wait
+    inside the pool; further callers wait on the event loop without holding
+    a worker or a queue slot.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, use_processes: bool = False):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.use_processes = use_processes
+        self._executor: Optional[Executor] = None
+        self._slots = asyncio.Semaphore(self.max_workers + self.max_queue)
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self.peak_in_flight = 0
+        self.peak_waiting = 0
+        self.total_queue_wait = 0.0
+        self.total_run_time = 0.0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_processes:
+                # spawn, not fork: the server process already runs threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=f"{self.name}-pool"
+                )
+        return self._executor
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) in the pool and await its result"""
+        submitted_at = time.time()
+        self.submitted += 1
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            loop = asyncio.get_running_loop()
+            call = functools.partial(_timed_call, fn, args, kwargs)
+            started_at, result = await loop.run_in_executor(self._get_executor(), call)
+            finished_at = time.time()
+            queue_wait = max(0.0, started_at - submitted_at)
+            self.total_queue_wait += queue_wait
+            record_queue_wait(self.name, queue_wait)
+            self.total_run_time += max(0.0, finished_at - started_at)
+            self.completed += 1
+            return result
+        except BaseException:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Snapshot of pool size, queue depth and timings"""
+        return {
+            "kind": "process" if self.use_processes else "thread",
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "peak_in_flight": self.peak_in_flight,
+            "peak_waiting": self.peak_waiting,
+            "avg_queue_wait_ms": round(1000 * self.total_queue_wait / self.completed, 3) if self.completed else 0.0,
+            "avg_run_ms": round(1000 * self.total_run_time / self.completed, 3) if self.completed else 0.0
+        }
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+# CPU-bound sentence-transformer encoding. torch releases the GIL inside
+# its kernels, so a small thread pool shares the single loaded model.
+embedding_executor = BoundedExecutor(
+    "embedding",
+    int(os.getenv("EMBEDDING_POOL_SIZE", "2")),
+    int(os.getenv("EMBEDDING_QUEUE_SIZE", "256"))
+)
+
+# ChromaDB reads and writes
+vectorstore_executor = BoundedExecutor(
+    "vectorstore",
+    int(os.getenv("VECTORSTORE_POOL_SIZE", "4")),
+    int(os.getenv("VECTORSTORE_QUEUE_SIZE", "256"))
+)
+
+# Blocking network SDKs without an async client (SerpAPI)
+blocking_io_executor = BoundedExecutor(
+    "blocking-io",
+    int(os.getenv("BLOCKING_IO_POOL_SIZE", "16")),
+    int(os.getenv("BLOCKING_IO_QUEUE_SIZE", "512"))
+)
+
+# PDF page extraction. PyMuPDF holds the GIL while parsing, so pages are
+# extracted in worker processes.
+pdf_executor = BoundedExecutor(
+    "pdf",
+    int(os.getenv("PDF_POOL_SIZE", str(min(4, os.cpu_count() or 1)))),
+    int(os.getenv("PDF_QUEUE_SIZE", "64")),
+    use_processes=True
+)
+
+EXECUTORS = {
+    executor.name: executor
+    for executor in (embedding_executor, vectorstore_executor, blocking_io_executor, pdf_executor)
+}
+
+
+def executor_metrics() -> Dict[str, Dict[str, Any]]:
+    return {name: executor.metrics() for name, executor in EXECUTORS.items()}
+
+
+def shutdown_executors(wait: bool = True):
+    for executor in EXECUTORS.values():
+        executor.shutdown(wait=wait)
@@ -0,0 +1,221 @@
+"""Chunked, batched document ingestion into the vector store"""
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from embeddings import encode_texts
+from executors import embedding_executor, vectorstore_executor
+
+CHUNK_TOKENS = int(os.getenv("INGEST_CHUNK_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("INGEST_CHUNK_OVERLAP_TOKENS", "40"))
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "64"))
+UPSERT_BATCH_SIZE = int(os.getenv("INGEST_UPSERT_BATCH_SIZE", "2000"))
+
+_WORD_PATTERN = re.compile(r"\S+")
+
+
+def token_spans(text: str, tokenizer: Any = None) -> List[Tuple[int, int]]:
+    """Character spans of each token in text.
+
+    Uses the model's fast tokenizer offsets when available, otherwise falls
+    back to whitespace-separated words.
+    """
+    if tokenizer is not None and getattr(tokenizer, "is_fast", False):
+        encoding = tokenizer(
+            text,
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            verbose=False
+        )
+        return [(start, end) for start, end in encoding["offset_mapping"] if end > start]
+    return [match.span() for match in _WORD_PATTERN.finditer(text)]
+
+
+def chunk_text(
+    text: str,
+    tokenizer: Any = None,
+    chunk_tokens: int = CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS
+) -> List[Dict[str, Any]]:
+    """Split text into windows of chunk_tokens tokens overlapping by overlap_tokens"""
+    spans = token_spans(text, tokenizer)
+    if not spans:
+        return []
+
+    chunk_tokens = max(1, chunk_tokens)
+    step = max(1, chunk_tokens - max(0, overlap_tokens))
+    chunks = []
+    for first in range(0, len(spans), step):
+        window = spans[first:first + chunk_tokens]
+        start_char, end_char = window[0][0], window[-1][1]
+        chunks.append({
+            "text": text[start_char:end_char],
+            "start_char": start_char,
+            "end_char": end_char
+        })
+        if first + chunk_tokens >= len(spans):
+            break
+    return chunks
+
+
+def chunk_id(filename: str, index: int) -> str:
+    """Stable id so re-ingesting a document overwrites its previous chunks"""
+    return f"{filename}::chunk-{index:05d}"
+
+
+def _chunk_documents(documents: List[Any], tokenizer: Any, chunk_tokens: int, overlap_tokens: int) -> List[Dict[str, Any]]:
+    prepared = []
+    for doc in documents:
+        chunks = chunk_text(doc.content, tokenizer, chunk_tokens, overlap_tokens)
+        for index, chunk in enumerate(chunks):
+            metadata = dict(doc.metadata or {})
+            metadata.update({
+                "source": doc.filename,
+                "chunk_index": index,
+                "chunk_count": len(chunks),
+                "start_char": chunk["start_char"],
+                "end_char": chunk["end_char"]
+            })
+            prepared.append({
+                "id": chunk_id(doc.filename, index),
+                "filename": doc.filename,
+                "text": chunk["text"],
+                "metadata": metadata
+            })
+    return prepared
+
+
+async def ingest_documents(
+    documents: List[Any],
+    embedding_model: Any,
+    model_name: str,
+    collection: Any,
+    chunk_tokens: Optional[int] = None,
+    overlap_tokens: Optional[int] = None,
+    batch_size: int = EMBED_BATCH_SIZE,
+    upsert_batch_size: int = UPSERT_BATCH_SIZE,
+    keyword_index: Any = None,
+    skip_existing: bool = False
+) -> Dict[str, Any]:
+    """Chunk, embed and upsert documents in one bulk pass.
+
+    Every chunk from every document not already in the embedding cache is
+    encoded in a single batched encode() call and written with as few upserts as the batch limit allows.
+    When keyword_index is given it is updated with the same chunks.
+    With skip_existing, chunks already stored with the same text and
+    metadata are not encoded or written again, so an interrupted ingestion
+    can be resumed cheaply.
+    A filename repeated within documents keeps only its last upload.
+    """
+    timings = {}
+    started = time.perf_counter()
+
+    # Chunk ids come from the filename, so duplicates would collide in one upsert
+    documents = list({doc.filename: doc for doc in documents}.values())
+
+    # Keep chunks inside the model's window (minus [CLS]/[SEP])
+    max_tokens = getattr(embedding_model, "max_seq_length", None)
+    chunk_tokens = chunk_tokens or CHUNK_TOKENS
+    if max_tokens:
+        chunk_tokens = min(chunk_tokens, max_tokens - 2)
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    if overlap_tokens >= chunk_tokens:
+        overlap_tokens = chunk_tokens // 5
+
+    # Stage 1: token-aware chunking
+    stage_start = time.perf_counter()
+    tokenizer = getattr(embedding_model, "tokenizer", None)
+    chunks = await embedding_executor.run(
+        _chunk_documents, documents, tokenizer, chunk_tokens, overlap_tokens
+    )
+    timings["chunking_ms"] = round(1000 * (time.perf_counter() - stage_start), 3)
+
+    upsert_batch_size = max(1, upsert_batch_size)
+    max_batch_size = getattr(getattr(collection, "_client", None), "max_batch_size", None)
+    if isinstance(max_batch_size, int) and max_batch_size > 0:
+        upsert_batch_size = min(upsert_batch_size, max_batch_size)
+
+    to_store = chunks
+    if skip_existing and chunks:
+        stage_start = time.perf_counter()
+        stored = {}
+        for first in range(0, len(chunks), upsert_batch_size):
+            existing = await vectorstore_executor.run(
+                collection.get,
+                ids=[chunk["id"] for chunk in chunks[first:first + upsert_batch_size]],
+                include=["documents", "metadatas"]
+            )
+            stored.update(zip(existing["ids"], zip(existing["documents"], existing["metadatas"])))
+        to_store = [chunk for chunk in chunks if stored.get(chunk["id"]) != (chunk["text"], chunk["metadata"])]
+        timings["resume_check_ms"] = round(1000 * (time.perf_counter() - stage_start), 3)
+
+    # Stage 2: batched encoding across all documents
+    stage_start = time.perf_counter()
+    embeddings = []
+    if to_store:
+        embeddings = await encode_texts(
+            embedding_model,
+            [chunk["text"] for chunk in to_store],
+            model_name,
+            batch_size=batch_size
+        )
+    timings["encoding_ms"] = round(1000 * (time.perf_counter() - stage_start), 3)
+
+    # Stage 3: bulk upsert, then drop chunks left over from a longer previous version
+    stage_start = time.perf_counter()
+    for first in range(0, len(to_store), upsert_batch_size):
+        batch = to_store[first:first + upsert_batch_size]
+        await vectorstore_executor.run(
+            collection.upsert,
+            ids=[chunk["id"] for chunk in batch],
+            embeddings=embeddings[first:first + upsert_batch_size].tolist(),
+            documents=[chunk["text"] for chunk in batch],
+            metadatas=[chunk["metadata"] for chunk in batch]
+        )
+
+    chunk_counts = {}
+    for chunk in chunks:
+        chunk_counts[chunk["filename"]] = chunk_counts.get(chunk["filename"], 0) + 1
+    stale = [
+        {"$and": [
+            {"source": doc.filename},
+            {"chunk_index": {"$gte": chunk_counts.get(doc.filename, 0)}}
+        ]}
+        for doc in documents
+    ]
+    if stale:
+        await vectorstore_executor.run(
+            collection.delete,
+            where=stale[0] if len(stale) == 1 else {"$or": stale}
+        )
+
+    if keyword_index is not None:
+        await vectorstore_executor.run(
+            keyword_index.upsert,
+            [chunk["id"] for chunk in chunks],
+            [chunk["text"] for chunk in chunks],
+            [chunk["metadata"] for chunk in chunks]
+        )
+        await vectorstore_executor.run(
+            keyword_index.delete_stale,
+            {doc.filename: chunk_counts.get(doc.filename, 0) for doc in documents}
+        )
+    timings["storing_ms"] = round(1000 * (time.perf_counter() - stage_start), 3)
+    timings["total_ms"] = round(1000 * (time.perf_counter() - started), 3)
+
+    embedding_size = int(embeddings.shape[1]) if len(to_store) else 0
+    return {
+        "documents": [
+            {
+                "filename": doc.filename,
+                "status": "processed" if chunk_counts.get(doc.filename) else "empty",
+                "chunks": chunk_counts.get(doc.filename, 0),
+                "embedding_size": embedding_size if chunk_counts.get(doc.filename) else 0
+            }
+            for doc in documents
+        ],
+        "total_chunks": len(chunks),
+        "skipped_chunks": len(chunks) - len(to_store),
+        "timings": timings
+    }
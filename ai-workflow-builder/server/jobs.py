@@ -0,0 +1,416 @@
+"""SQLite-backed background job queue with an asyncio worker pool.
+
+Jobs survive restarts: a worker keeps a heartbeat on each job it runs,
+and a "running" job whose heartbeat goes stale (the process died) is
+claimed again by the next free worker. Several server processes can
+share one database file.
+"""
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from executors import blocking_io_executor
+from retry import backoff_delay, is_retryable
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "./jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "300"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "60"))
+
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        status TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        result TEXT,
+        error TEXT,
+        progress REAL NOT NULL DEFAULT 0,
+        message TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,
+        created_at REAL NOT NULL,
+        run_after REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        heartbeat_at REAL
+    )""",
+    "CREATE INDEX IF NOT EXISTS jobs_status_run_after ON jobs (status, run_after)"
+]
+
+# Columns returned by the API; the payload can be large and stays internal
+_PUBLIC_COLUMNS = (
+    "id", "kind", "status", "progress", "message", "attempts", "max_attempts",
+    "cancel_requested", "error", "result", "created_at", "started_at", "finished_at"
+)
+
+
+class JobStore:
+    """Synchronous SQLite access; call it through blocking_io_executor"""
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        for statement in _SCHEMA:
+            self._conn.execute(statement)
+
+    @staticmethod
+    def _decode(row: Optional[sqlite3.Row], with_payload: bool = False) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = {column: row[column] for column in _PUBLIC_COLUMNS}
+        job["result"] = json.loads(row["result"]) if row["result"] is not None else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        if with_payload:
+            job["payload"] = json.loads(row["payload"])
+        return job
+
+    def create(self, kind: str, payload: Dict[str, Any], max_attempts: int) -> Dict[str, Any]:
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, max_attempts, created_at, run_after) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), max_attempts, now, now)
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str, with_payload: bool = False) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._decode(row, with_payload)
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        query = "SELECT * FROM jobs"
+        params: Tuple = ()
+        if status:
+            query += " WHERE status = ?"
+            params = (status,)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(query, params + (limit,)).fetchall()
+        return [self._decode(row) for row in rows]
+
+    def claim(self, worker: str, stale_seconds: float) -> Optional[Dict[str, Any]]:
+        """Atomically take the oldest runnable job: queued and due, or running with a stale heartbeat"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE cancel_requested = 0 AND ("
+                    "(status = 'queued' AND run_after <= ?) OR "
+                    "(status = 'running' AND heartbeat_at < ?)"
+                    ") ORDER BY created_at LIMIT 1",
+                    (now, now - stale_seconds)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+                        "started_at = COALESCE(started_at, ?), heartbeat_at = ? WHERE id = ?",
+                        (worker, now, now, row["id"])
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"], with_payload=True) if row is not None else None
+
+    def update(self, job_id: str, **fields):
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], default=str)
+        if fields.get("status") in TERMINAL_STATUSES:
+            fields.setdefault("finished_at", time.time())
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def heartbeat(self, job_ids: List[str]) -> List[str]:
+        """Refresh the heartbeat of running jobs and return those with a cancel request"""
+        if not job_ids:
+            return []
+        placeholders = ", ".join("?" for _ in job_ids)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET heartbeat_at = ? WHERE id IN ({placeholders})",
+                (time.time(), *job_ids)
+            )
+            rows = self._conn.execute(
+                f"SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({placeholders})",
+                job_ids
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def request_cancel(self, job_id: str, stale_seconds: float):
+        """Flag a job for cancellation; jobs nobody is running are cancelled right away"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status NOT IN ('succeeded', 'failed', 'cancelled')",
+                (job_id,)
+            )
+            self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND "
+                "(status = 'queued' OR (status = 'running' AND heartbeat_at < ?))",
+                (now, job_id, now - stale_seconds)
+            )
+
+
+class JobContext:
+    """Handed to a job handler: its payload plus progress and event reporting"""
+
+    def __init__(self, queue: "JobQueue", job: Dict[str, Any]):
+        self._queue = queue
+        self.id = job["id"]
+        self.kind = job["kind"]
+        self.payload = job["payload"]
+        self.attempt = job["attempts"]
+
+    async def progress(self, fraction: float, message: Optional[str] = None, **data):
+        """Record progress (0-1) in the store and notify event subscribers"""
+        fraction = max(0.0, min(1.0, fraction))
+        await blocking_io_executor.run(
+            self._queue.store.update, self.id, progress=fraction, message=message, heartbeat_at=time.time()
+        )
+        self._queue.publish(self.id, "progress", {"progress": fraction, "message": message, **data})
+
+    def event(self, event: str, data: Dict[str, Any]):
+        """Send an event to subscribers without persisting it (e.g. LLM tokens)"""
+        self._queue.publish(self.id, event, data)
+
+
+JobHandler = Callable[[JobContext], Awaitable[Any]]
+
+
+class JobQueue:
+    """Worker pool running registered handlers for jobs stored in SQLite.
+
+    Handlers that raise a transient error (see retry.is_retryable) are
+    re-queued with exponential backoff until max_attempts is reached.
+    """
+
+    def __init__(self, path: str = JOB_DB_PATH, workers: int = JOB_WORKERS):
+        self.path = path
+        # 0 workers: this process only submits jobs, another one runs them
+        self.workers = max(0, workers)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._store: Optional[JobStore] = None
+        self._handlers: Dict[str, JobHandler] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.cancelled = 0
+
+    @property
+    def store(self) -> JobStore:
+        # Opened on first use so importing the server does not touch the disk
+        if self._store is None:
+            self._store = JobStore(self.path)
+        return self._store
+
+    def register(self, kind: str, handler: JobHandler):
+        self._handlers[kind] = handler
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        await blocking_io_executor.run(lambda: self.store)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self):
+        """Stop the workers; jobs they were running go back to the queue"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind: str, payload: Dict[str, Any], max_attempts: Optional[int] = None) -> Dict[str, Any]:
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind {kind}")
+        job = await blocking_io_executor.run(self.store.create, kind, payload, max_attempts or JOB_MAX_ATTEMPTS)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await blocking_io_executor.run(self.store.get, job_id)
+
+    async def list(self, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        return await blocking_io_executor.run(self.store.list, status, limit)
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        await blocking_io_executor.run(self.store.request_cancel, job_id, JOB_STALE_SECONDS)
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        job = await self.get(job_id)
+        if job is not None and job["status"] == "cancelled":
+            self.publish(job_id, "status", self._status_event(job))
+        return job
+
+    def publish(self, job_id: str, event: str, data: Dict[str, Any]):
+        for subscriber in self._subscribers.get(job_id, []):
+            subscriber.put_nowait((event, data))
+
+    async def events(self, job_id: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Yield (event, data) for a job until it reaches a terminal status.
+
+        Events come straight from this process's workers; status changes
+        made by other processes are picked up by polling the store.
+        """
+        subscriber: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(subscriber)
+        try:
+            job = await self.get(job_id)
+            if job is None:
+                return
+            last = self._status_event(job)
+            yield "status", last
+            while last["status"] not in TERMINAL_STATUSES:
+                try:
+                    event, data = await asyncio.wait_for(subscriber.get(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    job = await self.get(job_id)
+                    current = self._status_event(job)
+                    if (current["status"], current["progress"]) != (last["status"], last["progress"]):
+                        last = current
+                        yield "status", current
+                    continue
+                yield event, data
+                if event == "status":
+                    last = data
+                elif event == "progress":
+                    last = {**last, "progress": data["progress"]}
+        finally:
+            subscribers = self._subscribers.get(job_id, [])
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+            if not subscribers:
+                self._subscribers.pop(job_id, None)
+
+    @staticmethod
+    def _status_event(job: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "status": job["status"],
+            "progress": job["progress"],
+            "attempts": job["attempts"],
+            "error": job["error"],
+            "result": job["result"]
+        }
+
+    async def _worker(self):
+        while True:
+            job = await blocking_io_executor.run(self.store.claim, self.worker_id, JOB_STALE_SECONDS)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                cancelled = await blocking_io_executor.run(self.store.heartbeat, list(self._running))
+            except Exception as e:
+                print(f"Warning: Job heartbeat failed: {e}")
+                continue
+            # Cancel requests made through another process
+            for job_id in cancelled:
+                task = self._running.get(job_id)
+                if task is not None:
+                    task.cancel()
+
+    async def _finish(self, job_id: str, **fields):
+        await blocking_io_executor.run(self.store.update, job_id, **fields)
+        job = await self.get(job_id)
+        self.publish(job_id, "status", self._status_event(job))
+
+    async def _run(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        handler = self._handlers.get(job["kind"])
+        if handler is None:
+            self.failed += 1
+            await self._finish(job_id, status="failed", error=f"No handler for job kind {job['kind']}")
+            return
+        if job["attempts"] > job["max_attempts"]:
+            self.failed += 1
+            await self._finish(job_id, status="failed", error=job["error"] or "Too many attempts")
+            return
+
+        self.publish(job_id, "status", self._status_event(job))
+        task = asyncio.ensure_future(handler(JobContext(self, job)))
+        self._running[job_id] = task
+        try:
+            await asyncio.wait([task])
+        except asyncio.CancelledError:
+            # Server shutting down: hand the job back so it resumes on restart
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            self.store.update(job_id, status="queued", worker=None, run_after=time.time())
+            raise
+        finally:
+            self._running.pop(job_id, None)
+
+        if task.cancelled():
+            self.cancelled += 1
+            await self._finish(job_id, status="cancelled")
+            return
+        error = task.exception()
+        if error is None:
+            self.succeeded += 1
+            await self._finish(job_id, status="succeeded", progress=1.0, result=task.result(), error=None)
+        elif is_retryable(error) and job["attempts"] < job["max_attempts"]:
+            self.retried += 1
+            delay = backoff_delay(job["attempts"], JOB_RETRY_BASE_SECONDS, JOB_RETRY_MAX_SECONDS)
+            await self._finish(
+                job_id,
+                status="queued",
+                worker=None,
+                error=f"Attempt {job['attempts']} failed, retrying in {delay:.1f}s: {error}",
+                run_after=time.time() + delay
+            )
+        else:
+            self.failed += 1
+            await self._finish(job_id, status="failed", error=str(error))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": len(self._running),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retried": self.retried,
+            "cancelled": self.cancelled
+        }
+
+
+job_queue = JobQueue()
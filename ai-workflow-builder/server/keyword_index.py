@@ -0,0 +1,244 @@
+"""Persistent BM25 keyword index kept alongside each Chroma collection"""
+import heapq
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Keeps identifiers such as "ERR-404", "v2.1" or "part_no_17" together as one term
+_TERM_PATTERN = re.compile(r"\w+(?:[-./:]\w+)*")
+_SUBTERM_PATTERN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms; compound identifiers also contribute their parts"""
+    terms = []
+    for match in _TERM_PATTERN.finditer(text.lower()):
+        term = match.group()
+        terms.append(term)
+        parts = _SUBTERM_PATTERN.findall(term)
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS docs (
+        id TEXT PRIMARY KEY,
+        source TEXT,
+        chunk_index INTEGER,
+        terms TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS docs_source ON docs (source, chunk_index)",
+    # Every upsert or delete appends the changed ids so other processes can catch up
+    "CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, doc_id TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+)
+# Change log entries kept for processes that have not caught up yet
+CHANGE_LOG_KEEP = 100000
+
+
+class BM25Index:
+    """Incrementally updated inverted index with Okapi BM25 scoring.
+
+    Postings are held in memory for scoring; with a path, every change is
+    also written to a SQLite database as it happens, and other processes
+    using the same file apply those changes before their next search.
+    Each entry keeps the chunk's source and chunk_index so stale chunks of
+    a re-ingested document can be dropped the same way they are in Chroma.
+    """
+
+    def __init__(self, path: Optional[str] = None, k1: float = BM25_K1, b: float = BM25_B):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_length = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._seq = 0
+        self._data_version: Optional[int] = None
+        self._backfilled = False
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            for statement in _SCHEMA:
+                self._conn.execute(statement)
+            with self._lock:
+                self._load()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def _load(self):
+        self._docs, self._postings, self._total_length = {}, {}, 0
+        self._conn.execute("BEGIN")
+        try:
+            self._seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+            for doc_id, source, chunk_index, terms in self._conn.execute("SELECT id, source, chunk_index, terms FROM docs"):
+                self._add(doc_id, json.loads(terms), source, chunk_index)
+        finally:
+            self._conn.execute("COMMIT")
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _apply_changes(self):
+        """Apply changes other processes committed since the last sync (lock held)"""
+        if self._conn is None:
+            return
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version and not self._conn.in_transaction:
+            return
+        oldest = self._conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+        if oldest is not None and oldest > self._seq + 1:
+            # The log was pruned past this process's position
+            self._load()
+            return
+        changed = self._conn.execute("SELECT seq, doc_id FROM changes WHERE seq > ? ORDER BY seq", (self._seq,)).fetchall()
+        for doc_id in {doc_id for _, doc_id in changed}:
+            row = self._conn.execute("SELECT source, chunk_index, terms FROM docs WHERE id = ?", (doc_id,)).fetchone()
+            self._remove(doc_id)
+            if row is not None:
+                self._add(doc_id, json.loads(row[2]), row[0], row[1])
+        if changed:
+            self._seq = changed[-1][0]
+        self._data_version = data_version
+
+    def _write(self, upserts: List[Tuple[str, Dict[str, int], Optional[str], Optional[int]]], deletes: List[str]):
+        """Apply changes to memory and, with a database, persist them in one transaction"""
+        if self._conn is None:
+            for doc_id in deletes:
+                self._remove(doc_id)
+            for doc_id, terms, source, chunk_index in upserts:
+                self._remove(doc_id)
+                self._add(doc_id, terms, source, chunk_index)
+            return
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._apply_changes()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO docs (id, source, chunk_index, terms) VALUES (?, ?, ?, ?)",
+                [(doc_id, source, chunk_index, json.dumps(terms)) for doc_id, terms, source, chunk_index in upserts]
+            )
+            self._conn.executemany("DELETE FROM docs WHERE id = ?", [(doc_id,) for doc_id in deletes])
+            self._conn.executemany(
+                "INSERT INTO changes (doc_id) VALUES (?)",
+                [(doc_id,) for doc_id, _, _, _ in upserts] + [(doc_id,) for doc_id in deletes]
+            )
+            self._seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+            self._conn.execute("DELETE FROM changes WHERE seq <= ?", (self._seq - CHANGE_LOG_KEEP,))
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        for doc_id in deletes:
+            self._remove(doc_id)
+        for doc_id, terms, source, chunk_index in upserts:
+            self._remove(doc_id)
+            self._add(doc_id, terms, source, chunk_index)
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _add(self, doc_id: str, terms: Dict[str, int], source: Optional[str], chunk_index: Optional[int]):
+        length = sum(terms.values())
+        self._docs[doc_id] = {"terms": terms, "length": length, "source": source, "chunk_index": chunk_index}
+        self._total_length += length
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = frequency
+
+    def _remove(self, doc_id: str):
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        self._total_length -= doc["length"]
+        for term in doc["terms"]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def upsert(self, ids: List[str], texts: List[str], metadatas: Optional[List[Dict[str, Any]]] = None):
+        metadatas = metadatas or [{}] * len(ids)
+        upserts = [
+            (
+                doc_id,
+                dict(Counter(tokenize(text or ""))),
+                (metadata or {}).get("source"),
+                (metadata or {}).get("chunk_index")
+            )
+            for doc_id, text, metadata in zip(ids, texts, metadatas)
+        ]
+        with self._lock:
+            self._write(upserts, [])
+
+    def delete_stale(self, chunk_counts: Dict[str, int]):
+        """Drop chunks of each source whose chunk_index is past its new chunk count"""
+        with self._lock:
+            if self._conn is not None:
+                stale = [
+                    doc_id
+                    for source, count in chunk_counts.items()
+                    for (doc_id,) in self._conn.execute(
+                        "SELECT id FROM docs WHERE source = ? AND COALESCE(chunk_index, 0) >= ?", (source, count)
+                    )
+                ]
+            else:
+                stale = [
+                    doc_id for doc_id, doc in self._docs.items()
+                    if doc["source"] in chunk_counts
+                    and (doc["chunk_index"] or 0) >= chunk_counts[doc["source"]]
+                ]
+            if stale:
+                self._write([], stale)
+
+    @property
+    def backfilled(self) -> bool:
+        """Whether the index has been filled from its Chroma collection once"""
+        if self._backfilled or self._conn is None:
+            return self._backfilled
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'backfilled'").fetchone()
+        # The marker is never cleared, so stop asking once it is set
+        self._backfilled = row is not None
+        return self._backfilled
+
+    def mark_backfilled(self):
+        if self._conn is None:
+            return
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('backfilled', '1')")
+        self._backfilled = True
+
+    def search(self, query: str, n_results: int) -> List[Tuple[str, float]]:
+        """Top n_results (id, score) pairs for query, best first"""
+        query_terms = set(tokenize(query))
+        with self._lock:
+            self._apply_changes()
+            total = len(self._docs)
+            if not total or not query_terms:
+                return []
+            average_length = self._total_length / total
+            scores: Dict[str, float] = {}
+            for term in query_terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._docs[doc_id]["length"] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
+
+    def stats(self) -> Dict[str, Any]:
+        return {"documents": len(self._docs), "terms": len(self._postings)}
@@ -1,35 +1,59 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-import fitz  # PyMuPDF
+from typing import List, Dict, Any, Mapping, Optional, Tuple, AsyncIterator, Awaitable, Callable
 import os
 import json
 import asyncio
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 
-# Import required libraries for AI functionality
-try:
-    import openai
-    from openai import OpenAI
-    import chromadb
-    from chromadb.config import Settings
-    import google.generativeai as genai
-    from serpapi import GoogleSearch
-    import numpy as np
-    from sentence_transformers import SentenceTransformer
-except ImportError as e:
-    print(f"Warning: Some AI libraries not installed: {e}")
-
-app = FastAPI(title="AI Workflow Builder API", version="1.0.0")
-
-FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[FRONTEND_URL],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+from executors import blocking_io_executor, executor_metrics, shutdown_executors
+from context import RetrievedContext, assemble_context
+from embeddings import encode_texts, embed_openai, embedding_batcher_stats, embedding_cache, embedding_cache_stats
+from ingestion import ingest_documents
+from pdf_extract import UploadTooLarge, spool_upload, iter_upload_pages
+from jobs import JobContext, job_queue
+from resources import LazyResource, is_ready, warm_up
+from providers import (
+    SerpApiClient,
+    close_providers,
+    estimate_tokens,
+    gemini_model,
+    gemini_provider,
+    openai_provider,
+    provider_stats,
+    serpapi_provider
+)
+from tracing import (
+    annotate,
+    payload_size,
+    record_cache,
+    record_tokens,
+    render_gauge,
+    render_metrics,
+    span,
+    start_trace
+)
+from retrieval import RERANK_MODEL, RETRIEVAL_MODES, retrieve, start_keyword_backfill
+from response_cache import (
+    RESPONSE_CACHE_SEMANTIC,
+    RESPONSE_CACHE_THRESHOLD,
+    response_cache,
+    response_cache_stats,
+    response_key,
+    semantic_scope,
+    should_cache
+)
+from vector_store import CHROMA_PATH, DEFAULT_COLLECTION, VectorStore
+from workflow_plan import (
+    get_cached_plan,
+    get_plan,
+    load_registered_workflow,
+    plan_cache_stats,
+    save_registered_workflow
 )
 
 # Pydantic models
@@ -49,6 +73,17 @@ class WorkflowEdge(BaseModel):
 class WorkflowRequest(BaseModel):
     workflow: Dict[str, Any]
     query: str
+    trace: bool = False
+
+class WorkflowQuery(BaseModel):
+    query: str
+    trace: bool = False
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    n_results: int = 5
+    collection: Optional[str] = None
+    where: Optional[Dict[str, Any]] = None
 
 class DocumentUpload(BaseModel):
     filename: str
@@ -59,32 +94,95 @@ class DocumentUpload(BaseModel):
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 SERPAPI_API_KEY = os.getenv("SERPAPI_API_KEY")
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# When set, embeddings come from a shared embedding_service.py process
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL")
+# Resources loaded in the background at startup; /ready waits for them
+WARMUP_RESOURCES = [name.strip() for name in os.getenv("WARMUP_RESOURCES", "embeddings,chromadb").split(",") if name.strip()]
 
-# Initialize clients
-openai_client = None
-if OPENAI_API_KEY:
-    openai_client = OpenAI(api_key=OPENAI_API_KEY)
+# Clients and models are loaded on first use (or by the startup warm-up)
+# so importing this module stays fast
+def _load_openai():
+    if not OPENAI_API_KEY:
+        return None
+    from openai import AsyncOpenAI
+    # Retries are done by the provider layer so they respect its rate limits
+    return AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        http_client=openai_provider.http_client(),
+        timeout=openai_provider.timeout,
+        max_retries=0
+    )
 
-if GEMINI_API_KEY:
+def _load_gemini():
+    if not GEMINI_API_KEY:
+        return None
+    import google.generativeai as genai
     genai.configure(api_key=GEMINI_API_KEY)
+    return genai
+
+def _load_serpapi():
+    if not SERPAPI_API_KEY:
+        return None
+    return SerpApiClient(SERPAPI_API_KEY)
+
+def _load_vector_store():
+    store = VectorStore(CHROMA_PATH)
+    store.get_collection(DEFAULT_COLLECTION)
+    return store
+
+def _load_embedding_model():
+    # Open the disk cache tier with the model so the first lookup does not parse its index
+    embedding_cache.disk_store(EMBEDDING_MODEL_NAME)
+    if EMBEDDING_SERVICE_URL:
+        from embedding_service import RemoteEmbeddingModel
+        return RemoteEmbeddingModel(EMBEDDING_SERVICE_URL)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+RESOURCES = {
+    resource.name: resource
+    for resource in (
+        LazyResource("openai", _load_openai),
+        LazyResource("gemini", _load_gemini),
+        LazyResource("serpapi", _load_serpapi),
+        LazyResource("chromadb", _load_vector_store),
+        LazyResource("embeddings", _load_embedding_model)
+    )
+}
+openai_resource = RESOURCES["openai"]
+gemini_resource = RESOURCES["gemini"]
+serpapi_resource = RESOURCES["serpapi"]
+vector_store_resource = RESOURCES["chromadb"]
+embedding_resource = RESOURCES["embeddings"]
+
+async def _warm_up():
+    await warm_up(RESOURCES[name] for name in WARMUP_RESOURCES if name in RESOURCES)
+    # Fill the default collection's keyword index before hybrid searches need it
+    if "chromadb" in WARMUP_RESOURCES and vector_store_resource.available:
+        vector_store = vector_store_resource.get()
+        start_keyword_backfill(vector_store, vector_store.get_collection(DEFAULT_COLLECTION))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmup_task = asyncio.create_task(_warm_up())
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    warmup_task.cancel()
+    await close_providers()
+    shutdown_executors(wait=False)
 
-# Initialize ChromaDB
-chroma_client = None
-try:
-    chroma_client = chromadb.Client(Settings(
-        chroma_db_impl="duckdb+parquet",
-        persist_directory="./chroma_db"
-    ))
-    collection = chroma_client.get_or_create_collection("documents")
-except Exception as e:
-    print(f"Warning: ChromaDB not available: {e}")
-
-# Initialize sentence transformer for embeddings
-embedding_model = None
-try:
-    embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-except Exception as e:
-    print(f"Warning: Sentence transformers not available: {e}")
+app = FastAPI(title="AI Workflow Builder API", version="1.0.0", lifespan=lifespan)
+
+FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[FRONTEND_URL],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
 
 @app.get("/")
 def read_root():
@@ -96,6 +194,8 @@ def read_root():
 
 @app.get("/health")
 def health_check():
+    """Liveness: answers immediately and never waits for models to load"""
+    vector_store = vector_store_resource.get() if vector_store_resource.available else None
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
@@ -103,99 +203,261 @@ def health_check():
             "openai": OPENAI_API_KEY is not None,
             "gemini": GEMINI_API_KEY is not None,
             "serpapi": SERPAPI_API_KEY is not None,
-            "chromadb": chroma_client is not None,
-            "embeddings": embedding_model is not None
-        }
+            "chromadb": vector_store_resource.available,
+            "embeddings": embedding_resource.available
+        },
+        "resources": {name: resource.status() for name, resource in RESOURCES.items()},
+        "executors": executor_metrics(),
+        "providers": provider_stats(),
+        "embedding_cache": embedding_cache_stats(),
+        "embedding_batching": embedding_batcher_stats(),
+        "response_cache": response_cache_stats(),
+        "workflow_plans": plan_cache_stats(),
+        "jobs": job_queue.stats(),
+        "vector_store": vector_store.stats() if vector_store else None
     }
 
+@app.get("/ready")
+def readiness_check():
+    """Readiness: 200 once the startup warm-up has finished, 503 while it is loading or if a resource failed"""
+    warmup = [RESOURCES[name] for name in WARMUP_RESOURCES if name in RESOURCES]
+    body = {
+        "ready": is_ready(warmup),
+        "resources": {resource.name: resource.status() for resource in warmup}
+    }
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics: span latency histograms, token and cache counters, pool gauges"""
+    pools = executor_metrics()
+    extra = []
+    for name, help_text in (
+        ("in_flight", "Calls running in each executor pool"),
+        ("waiting", "Calls waiting for a slot in each executor pool")
+    ):
+        extra.extend(render_gauge(
+            f"executor_{name}",
+            help_text,
+            (({"pool": pool}, values[name]) for pool, values in pools.items())
+        ))
+    providers = provider_stats()
+    for name, help_text in (
+        ("in_flight", "Calls in progress to each external provider"),
+        ("waiting", "Calls waiting for a provider's rate limit or concurrency slot")
+    ):
+        extra.extend(render_gauge(
+            f"provider_{name}",
+            help_text,
+            (({"provider": provider}, values[name]) for provider, values in providers.items())
+        ))
+    extra.extend(render_gauge("jobs_running", "Background jobs running in this process", [({}, job_queue.stats()["running"])]))
+    return PlainTextResponse(render_metrics(extra), media_type="text/plain; version=0.0.4")
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.post("/extract-text/")
-async def extract_text(file: UploadFile = File(...)):
-    """Extract text from uploaded documents"""
+async def extract_text(
+    file: UploadFile = File(...),
+    response_format: str = "json",
+    start_page: Optional[int] = None,
+    end_page: Optional[int] = None
+):
+    """Extract text from uploaded documents
+
+    With response_format "ndjson" or "sse" each page is sent as soon as it
+    has been extracted instead of returning the whole text at the end.
+    """
+    filename = file.filename.lower()
+    if response_format not in ("json", "ndjson", "sse"):
+        raise HTTPException(status_code=400, detail=f"Unsupported response format: {response_format}")
+    if not filename.endswith(('.pdf', '.txt')):
+        raise HTTPException(status_code=400, detail="Unsupported file type")
+    
     try:
-        contents = await file.read()
+        path = await spool_upload(file, suffix=os.path.splitext(filename)[1])
+        pages = iter_upload_pages(path, filename.endswith('.pdf'), start_page, end_page)
         
-        if file.filename.lower().endswith('.pdf'):
-            pdf = fitz.open(stream=contents, filetype="pdf")
-            text = ""
-            for page in pdf:
-                text += page.get_text()
-            pdf.close()
-        elif file.filename.lower().endswith('.txt'):
-            text = contents.decode('utf-8')
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported file type")
+        # Fetch the first page up front so a bad file or page range is still a 4xx/5xx
+        first_page = await pages.__anext__()
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+    
+    if response_format == "json":
+        try:
+            parts = [first_page[1]]
+            async for _, page_text in pages:
+                parts.append(page_text)
+            text = "".join(parts)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
         
         return {
             "filename": file.filename,
             "text": text,
             "length": len(text)
         }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+    
+    async def stream_pages():
+        page_count = 0
+        length = 0
+        try:
+            number, page_text = first_page
+            while True:
+                page_count += 1
+                length += len(page_text)
+                record = {"page": number, "text": page_text}
+                yield sse_event("page", record) if response_format == "sse" else json.dumps(record) + "\n"
+                try:
+                    number, page_text = await pages.__anext__()
+                except StopAsyncIteration:
+                    break
+            summary = {"done": True, "filename": file.filename, "pages": page_count, "length": length}
+        except Exception as e:
+            summary = {"done": True, "error": f"Error processing file: {str(e)}"}
+        finally:
+            await pages.aclose()
+        yield sse_event("done", summary) if response_format == "sse" else json.dumps(summary) + "\n"
+    
+    media_type = "text/event-stream" if response_format == "sse" else "application/x-ndjson"
+    return StreamingResponse(stream_pages(), media_type=media_type)
 
 @app.post("/process-documents/")
-async def process_documents(documents: List[DocumentUpload]):
-    """Process documents and store embeddings"""
-    if not chroma_client or not embedding_model:
+async def process_documents(
+    documents: List[DocumentUpload],
+    chunk_tokens: Optional[int] = None,
+    chunk_overlap: Optional[int] = None,
+    collection: Optional[str] = None,
+    hnsw_m: Optional[int] = None,
+    hnsw_ef_construction: Optional[int] = None,
+    hnsw_ef_search: Optional[int] = None
+):
+    """Chunk documents, embed them in batches and store the chunks
+
+    collection selects a per-workflow collection; the HNSW parameters are
+    applied when that collection is first created.
+    """
+    vector_store = await vector_store_resource.aget()
+    embedding_model = await embedding_resource.aget()
+    if not vector_store or not embedding_model:
         raise HTTPException(status_code=500, detail="Vector store or embedding model not available")
     
     try:
-        processed_docs = []
-        
-        for doc in documents:
-            # Generate embeddings
-            embeddings = embedding_model.encode(doc.content)
-            
-            # Store in ChromaDB
-            collection.add(
-                embeddings=[embeddings.tolist()],
-                documents=[doc.content],
-                metadatas=[doc.metadata],
-                ids=[doc.filename]
-            )
-            
-            processed_docs.append({
-                "filename": doc.filename,
-                "status": "processed",
-                "embedding_size": len(embeddings)
-            })
+        hnsw_config = {
+            key: value for key, value in (
+                ("hnswM", hnsw_m),
+                ("hnswEfConstruction", hnsw_ef_construction),
+                ("hnswEfSearch", hnsw_ef_search)
+            ) if value is not None
+        }
+        result = await ingest_documents(
+            documents,
+            embedding_model,
+            EMBEDDING_MODEL_NAME,
+            vector_store.get_collection(collection, hnsw_config),
+            chunk_tokens=chunk_tokens,
+            overlap_tokens=chunk_overlap,
+            keyword_index=vector_store.get_keyword_index(collection)
+        )
         
         return {
-            "message": f"Processed {len(processed_docs)} documents",
-            "documents": processed_docs
+            "message": f"Processed {len(result['documents'])} documents into {result['total_chunks']} chunks",
+            "documents": result["documents"],
+            "timings": result["timings"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing documents: {str(e)}")
 
+def _search_results(results: Dict[str, Any], index: int = 0) -> List[Dict[str, Any]]:
+    return [
+        {
+            "document": doc,
+            "metadata": meta,
+            "distance": dist
+        }
+        for doc, meta, dist in zip(
+            results['documents'][index],
+            results['metadatas'][index],
+            results['distances'][index]
+        )
+    ]
+
 @app.post("/search-documents/")
-async def search_documents(query: str, n_results: int = 5):
-    """Search documents using vector similarity"""
-    if not chroma_client or not embedding_model:
+async def search_documents(
+    query: str,
+    n_results: int = 5,
+    collection: Optional[str] = None,
+    where: Optional[str] = None,
+    mode: str = "vector",
+    rerank: bool = False,
+    context_tokens: Optional[int] = None
+):
+    """Search documents using vector similarity, BM25 keywords or both
+
+    where is an optional JSON-encoded Chroma metadata filter. mode=hybrid
+    fuses vector and keyword rankings; rerank=true re-scores the candidates
+    with a cross-encoder.
+    """
+    vector_store = await vector_store_resource.aget()
+    embedding_model = await embedding_resource.aget()
+    if not vector_store or not embedding_model:
         raise HTTPException(status_code=500, detail="Vector store or embedding model not available")
     
     try:
-        # Generate query embedding
-        query_embedding = embedding_model.encode(query)
-        
-        # Search in ChromaDB
-        results = collection.query(
-            query_embeddings=[query_embedding.tolist()],
-            n_results=n_results
+        where_filter = json.loads(where) if where else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="where must be a JSON object")
+    if mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(RETRIEVAL_MODES)}")
+    
+    try:
+        hits = await retrieve(
+            vector_store,
+            vector_store.get_collection(collection),
+            embedding_model,
+            EMBEDDING_MODEL_NAME,
+            query,
+            n_results,
+            where=where_filter,
+            mode=mode,
+            rerank_model=RERANK_MODEL if rerank else None,
+            context_tokens=context_tokens
         )
         
         return {
             "query": query,
+            "results": hits
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching documents: {str(e)}")
+
+@app.post("/search-documents/batch")
+async def search_documents_batch(request: BatchSearchRequest):
+    """Search several queries with one batched encode and one Chroma query"""
+    vector_store = await vector_store_resource.aget()
+    embedding_model = await embedding_resource.aget()
+    if not vector_store or not embedding_model:
+        raise HTTPException(status_code=500, detail="Vector store or embedding model not available")
+    
+    try:
+        query_embeddings = await encode_texts(embedding_model, request.queries, EMBEDDING_MODEL_NAME)
+        results = await vector_store.query_many(
+            vector_store.get_collection(request.collection),
+            query_embeddings.tolist(),
+            request.n_results,
+            request.where
+        )
+        
+        return {
             "results": [
-                {
-                    "document": doc,
-                    "metadata": meta,
-                    "distance": dist
-                }
-                for doc, meta, dist in zip(
-                    results['documents'][0],
-                    results['metadatas'][0],
-                    results['distances'][0]
-                )
+                {"query": query, "results": _search_results(results, index)}
+                for index, query in enumerate(request.queries)
             ]
         }
     except Exception as e:
@@ -205,18 +467,17 @@ async def search_documents(query: str, n_results: int = 5):
 async def generate_embeddings(text: str, model: str = "openai"):
     """Generate embeddings for text"""
     try:
+        openai_client = await openai_resource.aget() if model == "openai" else None
+        embedding_model = await embedding_resource.aget() if model == "sentence-transformers" else None
         if model == "openai" and openai_client:
-            response = openai_client.embeddings.create(
-                input=text,
-                model="text-embedding-ada-002"
-            )
+            embedding = (await embed_openai(openai_client, [text], "text-embedding-ada-002"))[0]
             return {
                 "model": "openai",
-                "embedding": response.data[0].embedding,
-                "dimensions": len(response.data[0].embedding)
+                "embedding": embedding.tolist(),
+                "dimensions": len(embedding)
             }
         elif model == "sentence-transformers" and embedding_model:
-            embedding = embedding_model.encode(text)
+            embedding = (await encode_texts(embedding_model, [text], EMBEDDING_MODEL_NAME))[0]
             return {
                 "model": "sentence-transformers",
                 "embedding": embedding.tolist(),
@@ -227,62 +488,281 @@ async def generate_embeddings(text: str, model: str = "openai"):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating embeddings: {str(e)}")
 
-@app.post("/call-llm/")
-async def call_llm(
+DEFAULT_SYSTEM_PROMPT = "You are a helpful AI assistant."
+
+class LLMNotAvailable(Exception):
+    pass
+
+def build_prompt(question: str, context: Optional[str] = None) -> str:
+    """Prepend retrieved context to the question when there is any"""
+    if context:
+        return f"Context: {context}\n\nQuestion: {question}\n\nAnswer:"
+    return question
+
+async def check_llm_available(model: str):
+    """Return the loaded client for model, raising LLMNotAvailable if there is none"""
+    client = None
+    if model.startswith("gpt"):
+        client = await openai_resource.aget()
+    elif model.startswith("gemini"):
+        client = await gemini_resource.aget()
+    if client is None:
+        raise LLMNotAvailable(f"Model {model} not available")
+    return client
+
+def _gemini_usage(response) -> Dict[str, int]:
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return {}
+    return {
+        "prompt_tokens": usage.prompt_token_count,
+        "completion_tokens": usage.candidates_token_count,
+        "total_tokens": usage.total_token_count
+    }
+
+async def complete_llm(
+    model: str,
     prompt: str,
-    model: str = "gpt-3.5-turbo",
+    system_prompt: str = DEFAULT_SYSTEM_PROMPT,
     temperature: float = 0.7,
-    max_tokens: int = 1000,
-    context: Optional[str] = None
-):
-    """Call LLM with prompt and optional context"""
-    try:
-        # Prepare the full prompt with context if provided
-        full_prompt = prompt
-        if context:
-            full_prompt = f"Context: {context}\n\nQuestion: {prompt}\n\nAnswer:"
-        
-        if model.startswith("gpt") and openai_client:
-            response = openai_client.chat.completions.create(
+    max_tokens: int = 1000
+) -> Dict[str, Any]:
+    """Run a chat completion and return the full response text and usage"""
+    client = await check_llm_available(model)
+    
+    with span("llm.completion", model=model, prompt_bytes=payload_size(prompt)) as llm_span:
+        tokens = estimate_tokens(system_prompt) + estimate_tokens(prompt) + max_tokens
+        if model.startswith("gpt"):
+            response = await openai_provider.call(
+                client.chat.completions.create,
+                tokens=tokens,
+                hedge=True,
                 model=model,
                 messages=[
-                    {"role": "system", "content": "You are a helpful AI assistant."},
-                    {"role": "user", "content": full_prompt}
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
                 ],
                 temperature=temperature,
                 max_tokens=max_tokens
             )
-            return {
-                "model": model,
+            result = {
                 "response": response.choices[0].message.content,
                 "usage": response.usage.dict()
             }
-        elif model.startswith("gemini") and GEMINI_API_KEY:
-            gemini_model = genai.GenerativeModel(model)
-            response = gemini_model.generate_content(full_prompt)
-            return {
-                "model": model,
+        else:
+            response = await gemini_provider.call(
+                gemini_model(client, model).generate_content_async,
+                prompt,
+                tokens=tokens,
+                hedge=True,
+                generation_config={"temperature": temperature, "max_output_tokens": max_tokens}
+            )
+            result = {
                 "response": response.text,
-                "usage": {"total_tokens": len(full_prompt.split())}
+                "usage": _gemini_usage(response) or {"total_tokens": len(prompt.split())}
             }
+        llm_span.set(response_bytes=payload_size(result["response"]))
+        record_tokens(model, result["usage"])
+        return result
+
+async def stream_llm(
+    model: str,
+    prompt: str,
+    system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+    temperature: float = 0.7,
+    max_tokens: int = 1000,
+    usage: Optional[Dict[str, Any]] = None
+) -> AsyncIterator[str]:
+    """Yield completion text as the provider produces it.
+
+    Token usage reported at the end of the stream is copied into usage.
+    Opening the stream is retried on transient errors; once text has been
+    yielded a failure is raised to the caller.
+    """
+    client = await check_llm_available(model)
+    usage = {} if usage is None else usage
+    
+    with span("llm.stream", model=model, prompt_bytes=payload_size(prompt)) as llm_span:
+        started = time.perf_counter()
+        response_bytes = 0
+        tokens = estimate_tokens(system_prompt) + estimate_tokens(prompt) + max_tokens
+        if model.startswith("gpt"):
+            stream = openai_provider.stream(
+                client.chat.completions.create,
+                tokens=tokens,
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            async for chunk in stream:
+                if chunk.usage:
+                    usage.update(chunk.usage.dict())
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not response_bytes:
+                        llm_span.set(first_token_ms=round(1000 * (time.perf_counter() - started), 3))
+                    response_bytes += payload_size(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
         else:
-            raise HTTPException(status_code=400, detail=f"Model {model} not available")
+            stream = gemini_provider.stream(
+                gemini_model(client, model).generate_content_async,
+                prompt,
+                tokens=tokens,
+                generation_config={"temperature": temperature, "max_output_tokens": max_tokens},
+                stream=True
+            )
+            async for chunk in stream:
+                if chunk.parts:
+                    if not response_bytes:
+                        llm_span.set(first_token_ms=round(1000 * (time.perf_counter() - started), 3))
+                    response_bytes += payload_size(chunk.text)
+                    yield chunk.text
+                usage.update(_gemini_usage(chunk))
+        llm_span.set(response_bytes=response_bytes)
+        record_tokens(model, usage)
+
+async def lookup_response(
+    model: str,
+    prompt: str,
+    system_prompt: str,
+    temperature: float,
+    max_tokens: int,
+    question: str,
+    context: Optional[str] = None,
+    cache: Optional[bool] = None,
+    semantic: Optional[bool] = None,
+    threshold: Optional[float] = None
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Check the response cache for an LLM call.
+
+    Returns (cached result, None) on a hit. On a miss returns (None, entry)
+    where entry is passed to store_response once the call completes, or
+    (None, None) when the call is not cacheable.
+    """
+    if not should_cache(temperature, cache):
+        return None, None
+    
+    entry = {"key": response_key(model, system_prompt, prompt, temperature, max_tokens)}
+    use_semantic = RESPONSE_CACHE_SEMANTIC if semantic is None else semantic
+    embedding_model = await embedding_resource.aget() if use_semantic else None
+    if use_semantic and embedding_model:
+        entry["scope"] = semantic_scope(model, system_prompt, temperature, max_tokens, context)
+        entry["vector"] = (await encode_texts(embedding_model, [question], EMBEDDING_MODEL_NAME))[0]
+    
+    value, kind = response_cache.lookup(
+        entry["key"],
+        entry.get("scope"),
+        entry.get("vector"),
+        RESPONSE_CACHE_THRESHOLD if threshold is None else threshold
+    )
+    record_cache("response", int(value is not None), int(value is None))
+    annotate(cache=kind or "miss")
+    if value is not None:
+        return {**value, "cached": kind}, None
+    return None, entry
+
+def store_response(entry: Optional[Dict[str, Any]], result: Dict[str, Any]):
+    if entry is not None:
+        response_cache.store(
+            entry["key"],
+            {"response": result["response"], "usage": result["usage"]},
+            entry.get("scope"),
+            entry.get("vector")
+        )
+
+@app.post("/call-llm/")
+async def call_llm(
+    prompt: str,
+    model: str = "gpt-3.5-turbo",
+    temperature: float = 0.7,
+    max_tokens: int = 1000,
+    context: Optional[str] = None,
+    stream: bool = False,
+    cache: Optional[bool] = None
+):
+    """Call LLM with prompt and optional context
+
+    With stream=true the completion is sent as Server-Sent Events: one
+    "token" event per chunk, then a "done" event with the usage.
+    Responses are cached for temperature 0 unless cache=false.
+    """
+    try:
+        # Prepare the full prompt with context if provided
+        full_prompt = build_prompt(prompt, context)
+        await check_llm_available(model)
+        
+        cached, cache_entry = await lookup_response(
+            model, full_prompt, DEFAULT_SYSTEM_PROMPT, temperature, max_tokens,
+            question=prompt, context=context, cache=cache
+        )
+        
+        if stream:
+            return StreamingResponse(
+                _stream_llm_events(model, full_prompt, temperature, max_tokens, cached, cache_entry),
+                media_type="text/event-stream"
+            )
+        
+        if cached:
+            result = cached
+        else:
+            result = await complete_llm(model, full_prompt, temperature=temperature, max_tokens=max_tokens)
+            store_response(cache_entry, result)
+        return {
+            "model": model,
+            "response": result["response"],
+            "usage": result["usage"],
+            "cached": result.get("cached")
+        }
+    except LLMNotAvailable as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error calling LLM: {str(e)}")
 
+async def _stream_llm_events(
+    model: str,
+    prompt: str,
+    temperature: float,
+    max_tokens: int,
+    cached: Optional[Dict[str, Any]] = None,
+    cache_entry: Optional[Dict[str, Any]] = None
+):
+    if cached:
+        yield sse_event("token", {"text": cached["response"]})
+        yield sse_event("done", {"model": model, **cached})
+        return
+    
+    usage = {}
+    parts = []
+    try:
+        async for text in stream_llm(model, prompt, temperature=temperature, max_tokens=max_tokens, usage=usage):
+            parts.append(text)
+            yield sse_event("token", {"text": text})
+        result = {"response": "".join(parts), "usage": usage}
+        store_response(cache_entry, result)
+        yield sse_event("done", {"model": model, **result, "cached": None})
+    except Exception as e:
+        yield sse_event("error", {"detail": f"Error calling LLM: {str(e)}"})
+
 @app.post("/web-search/")
 async def web_search(query: str, engine: str = "google"):
     """Perform web search using SerpAPI"""
-    if not SERPAPI_API_KEY:
+    serpapi = await serpapi_resource.aget()
+    if not serpapi:
         raise HTTPException(status_code=500, detail="SerpAPI not configured")
     
     try:
-        search = GoogleSearch({
-            "q": query,
-            "api_key": SERPAPI_API_KEY,
-            "num": 5
-        })
-        results = search.get_dict()
+        with span("serpapi.search", engine=engine, query_bytes=payload_size(query)) as search_span:
+            results = await serpapi_provider.call(
+                serpapi.search,
+                {"q": query, "engine": engine, "num": 5},
+                hedge=True
+            )
+            search_span.set(results=len(results.get("organic_results", [])), response_bytes=payload_size(results))
         
         return {
             "query": query,
@@ -293,166 +773,523 @@ async def web_search(query: str, engine: str = "google"):
 
 @app.post("/execute-workflow/")
 async def execute_workflow(request: WorkflowRequest):
-    """Execute a complete workflow"""
+    """Execute a complete workflow
+
+    With "trace": true the response includes the per-node and external
+    call spans of the run.
+    """
+    plan = _compiled_plan(request.workflow)
+    return await _run_plan(plan, request.query, request.trace, {"workflow": request.workflow, "query": request.query})
+
+@app.post("/execute-workflow/stream")
+async def execute_workflow_stream(request: WorkflowRequest):
+    """Execute a workflow, streaming progress as Server-Sent Events
+
+    Emits a "node" event as each node finishes, "token" events from LLM
+    nodes that feed an output node, and a final "done" (or "error") event.
+    """
+    plan = _compiled_plan(request.workflow)
+    return StreamingResponse(
+        _stream_plan(plan, request.query, request.trace, {"workflow": request.workflow, "query": request.query}),
+        media_type="text/event-stream"
+    )
+
+@app.post("/workflows/")
+async def register_workflow(workflow: Dict[str, Any]):
+    """Compile a workflow once so it can be executed by id with just a query"""
     try:
-        workflow = request.workflow
-        query = request.query
-        
-        # Parse workflow nodes and edges
-        nodes = {node["id"]: node for node in workflow.get("nodes", [])}
-        edges = workflow.get("edges", [])
-        
-        # Build execution graph
-        execution_graph = build_execution_graph(nodes, edges)
-        
-        # Execute workflow
-        result = await execute_workflow_graph(execution_graph, nodes, query)
-        
-        return {
-            "response": result,
-            "workflow_id": workflow.get("id", "unknown"),
-            "execution_time": datetime.now().isoformat()
-        }
+        plan = get_plan(workflow)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid workflow: {str(e)}")
+    await blocking_io_executor.run(save_registered_workflow, plan["hash"], workflow)
+
+    return {
+        "plan_id": plan["hash"],
+        "workflow_id": plan["workflow_id"],
+        "order": list(plan["order"]),
+        "errors": list(plan["errors"])
+    }
+
+@app.post("/workflows/{plan_id}/execute")
+async def execute_registered_workflow(plan_id: str, request: WorkflowQuery):
+    """Execute a previously registered workflow"""
+    plan = _valid_plan(await _registered_plan(plan_id))
+    return await _run_plan(plan, request.query, request.trace, {"plan_id": plan_id, "query": request.query})
+
+@app.post("/workflows/{plan_id}/execute/stream")
+async def execute_registered_workflow_stream(plan_id: str, request: WorkflowQuery):
+    """Execute a previously registered workflow, streaming progress as Server-Sent Events"""
+    plan = _valid_plan(await _registered_plan(plan_id))
+    return StreamingResponse(
+        _stream_plan(plan, request.query, request.trace, {"plan_id": plan_id, "query": request.query}),
+        media_type="text/event-stream"
+    )
+
+async def _registered_plan(plan_id: str) -> Mapping[str, Any]:
+    plan = get_cached_plan(plan_id)
+    if plan is not None:
+        return plan
+    # Evicted from the plan cache or registered by another process
+    workflow = await blocking_io_executor.run(load_registered_workflow, plan_id)
+    if workflow is None:
+        raise HTTPException(status_code=404, detail=f"Workflow {plan_id} is not registered")
+    return get_plan(workflow)
+
+def _compiled_plan(workflow: Dict[str, Any]) -> Mapping[str, Any]:
+    """Plan for workflow, with malformed or invalid workflows rejected as 400"""
+    try:
+        plan = get_plan(workflow)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid workflow: {str(e)}")
+    return _valid_plan(plan)
+
+def _valid_plan(plan: Mapping[str, Any]) -> Mapping[str, Any]:
+    if plan["errors"]:
+        raise HTTPException(status_code=400, detail=f"Invalid workflow: {'; '.join(plan['errors'])}")
+    return plan
+
+async def _execute_traced(
+    plan: Mapping[str, Any],
+    query: str,
+    include_trace: bool = False,
+    payload: Optional[Dict[str, Any]] = None,
+    on_event: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None,
+    raise_errors: bool = False
+) -> Dict[str, Any]:
+    """Execute a plan inside a trace and return the response body with its timings"""
+    with start_trace("workflow", payload=payload, workflow_id=plan["workflow_id"], plan_id=plan["hash"]) as trace:
+        result = await execute_workflow_graph(plan, query, on_event=on_event, raise_errors=raise_errors)
+    
+    body = {
+        "response": result,
+        "workflow_id": plan["workflow_id"],
+        "execution_time": datetime.now().isoformat(),
+        "duration_ms": round(1000 * trace.root.duration, 3),
+        "trace_id": trace.trace_id
+    }
+    if include_trace:
+        body["trace"] = trace.to_dict()
+    return body
+
+async def _run_plan(
+    plan: Mapping[str, Any],
+    query: str,
+    include_trace: bool = False,
+    payload: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    try:
+        return await _execute_traced(plan, query, include_trace, payload)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error executing workflow: {str(e)}")
 
-def build_execution_graph(nodes: Dict, edges: List[Dict]) -> Dict:
-    """Build execution graph from nodes and edges"""
-    graph = {}
+async def _stream_plan(
+    plan: Mapping[str, Any],
+    query: str,
+    include_trace: bool = False,
+    payload: Optional[Dict[str, Any]] = None
+):
+    events = asyncio.Queue()
     
-    # Initialize graph
-    for node_id in nodes:
-        graph[node_id] = {
-            "node": nodes[node_id],
-            "dependencies": [],
-            "dependents": []
-        }
+    async def emit(event: str, data: Dict[str, Any]):
+        await events.put((event, data))
     
-    # Add edges
-    for edge in edges:
-        source = edge["source"]
-        target = edge["target"]
-        
-        if source in graph and target in graph:
-            graph[source]["dependents"].append(target)
-            graph[target]["dependencies"].append(source)
+    async def run():
+        try:
+            await emit("done", await _execute_traced(plan, query, include_trace, payload, on_event=emit))
+        except Exception as e:
+            await emit("error", {"detail": f"Error executing workflow: {str(e)}"})
     
-    return graph
+    task = asyncio.create_task(run())
+    try:
+        while True:
+            event, data = await events.get()
+            yield sse_event(event, data)
+            if event in ("done", "error"):
+                break
+    finally:
+        task.cancel()
+
+# Background jobs: submit returns a job id right away; progress is polled or streamed
+JOB_INGEST_GROUP_SIZE = int(os.getenv("JOB_INGEST_GROUP_SIZE", "16"))
 
-async def execute_workflow_graph(graph: Dict, nodes: Dict, query: str) -> str:
-    """Execute workflow graph"""
-    # Find start node (User Query)
-    start_nodes = [node_id for node_id, data in graph.items() 
-                   if data["node"]["type"] == "userQuery" and not data["dependencies"]]
+async def _process_documents_job(job: JobContext) -> Dict[str, Any]:
+    """Ingest documents a group at a time, skipping chunks an earlier attempt already stored"""
+    vector_store = await vector_store_resource.aget()
+    embedding_model = await embedding_resource.aget()
+    if not vector_store or not embedding_model:
+        raise RuntimeError("Vector store or embedding model not available")
     
-    if not start_nodes:
+    payload = job.payload
+    documents = [DocumentUpload(**doc) for doc in payload["documents"]]
+    collection = vector_store.get_collection(payload.get("collection"), payload.get("hnsw_config"))
+    summary = {"documents": [], "total_chunks": 0, "skipped_chunks": 0}
+    for first in range(0, len(documents), JOB_INGEST_GROUP_SIZE):
+        group = documents[first:first + JOB_INGEST_GROUP_SIZE]
+        result = await ingest_documents(
+            group,
+            embedding_model,
+            EMBEDDING_MODEL_NAME,
+            collection,
+            chunk_tokens=payload.get("chunk_tokens"),
+            overlap_tokens=payload.get("chunk_overlap"),
+            keyword_index=vector_store.get_keyword_index(payload.get("collection")),
+            skip_existing=True
+        )
+        summary["documents"].extend(result["documents"])
+        summary["total_chunks"] += result["total_chunks"]
+        summary["skipped_chunks"] += result["skipped_chunks"]
+        done = first + len(group)
+        await job.progress(done / len(documents), f"Processed {done} of {len(documents)} documents")
+    
+    summary["message"] = f"Processed {len(documents)} documents into {summary['total_chunks']} chunks"
+    return summary
+
+async def _execute_workflow_job(job: JobContext) -> Dict[str, Any]:
+    plan = get_plan(job.payload["workflow"])
+    if plan["errors"]:
+        raise ValueError(f"Invalid workflow: {'; '.join(plan['errors'])}")
+    
+    completed = 0
+    async def on_event(event: str, data: Dict[str, Any]):
+        nonlocal completed
+        if event == "node":
+            completed += 1
+            await job.progress(completed / len(plan["run_order"]), f"Node {data['node_id']} completed", node=data)
+        else:
+            job.event(event, data)
+    
+    return await _execute_traced(
+        plan,
+        job.payload["query"],
+        job.payload.get("trace", False),
+        {"workflow": job.payload["workflow"], "query": job.payload["query"], "job_id": job.id},
+        on_event=on_event,
+        # Failed nodes fail the job so transient provider errors are retried with backoff
+        raise_errors=True
+    )
+
+job_queue.register("process-documents", _process_documents_job)
+job_queue.register("execute-workflow", _execute_workflow_job)
+
+@app.post("/jobs/process-documents/")
+async def submit_process_documents(
+    documents: List[DocumentUpload],
+    chunk_tokens: Optional[int] = None,
+    chunk_overlap: Optional[int] = None,
+    collection: Optional[str] = None,
+    hnsw_m: Optional[int] = None,
+    hnsw_ef_construction: Optional[int] = None,
+    hnsw_ef_search: Optional[int] = None
+):
+    """Queue document ingestion as a background job and return its id"""
+    hnsw_config = {
+        key: value for key, value in (
+            ("hnswM", hnsw_m),
+            ("hnswEfConstruction", hnsw_ef_construction),
+            ("hnswEfSearch", hnsw_ef_search)
+        ) if value is not None
+    }
+    job = await job_queue.submit("process-documents", {
+        "documents": [doc.model_dump() for doc in documents],
+        "chunk_tokens": chunk_tokens,
+        "chunk_overlap": chunk_overlap,
+        "collection": collection,
+        "hnsw_config": hnsw_config
+    })
+    return {"job_id": job["id"], "status": job["status"]}
+
+@app.post("/jobs/execute-workflow/")
+async def submit_execute_workflow(request: WorkflowRequest):
+    """Queue a workflow run as a background job and return its id"""
+    _compiled_plan(request.workflow)
+    job = await job_queue.submit("execute-workflow", {
+        "workflow": request.workflow,
+        "query": request.query,
+        "trace": request.trace
+    })
+    return {"job_id": job["id"], "status": job["status"]}
+
+@app.get("/jobs/")
+async def list_jobs(status: Optional[str] = None, limit: int = 50):
+    return {"jobs": await job_queue.list(status, limit)}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, progress and (once finished) result or error of a job"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Stream a job's status, progress, node and token events as Server-Sent Events"""
+    await get_job(job_id)
+    
+    async def stream():
+        async for event, data in job_queue.events(job_id):
+            yield sse_event(event, data)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = await job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+async def execute_workflow_graph(
+    plan: Mapping[str, Any],
+    query: str,
+    on_event: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None,
+    raise_errors: bool = False
+) -> str:
+    """Execute a compiled workflow plan, running each node as soon as its dependencies finish
+
+    Only nodes that feed an output node are run.
+
+    If on_event is given it receives a "node" event as each node completes
+    and "token" events from LLM nodes whose output goes to an output node.
+    With raise_errors a failing node raises instead of returning its error
+    message as the node output.
+    """
+    graph_nodes = plan["graph"]["nodes"]
+    
+    if not plan["start_nodes"]:
         raise Exception("No start node found")
     
-    # Execute in topological order
-    executed = set()
+    # Nodes that do not feed an output node are never run
+    needed = set(plan["run_order"])
     results = {}
+    remaining = {node_id: len(graph_nodes[node_id]["dependencies"]) for node_id in needed}
+    # Results are dropped once every consumer has run; output results are kept for the response
+    consumers_left = {
+        node_id: sum(1 for dependent in graph_nodes[node_id]["dependents"] if dependent in needed)
+        for node_id in needed
+    }
+    keep = set(plan["output_nodes"])
+    semaphore = asyncio.Semaphore(max(1, plan["max_concurrency"]))
     
     async def execute_node(node_id: str) -> Any:
-        if node_id in executed:
-            return results[node_id]
-        
-        node_data = graph[node_id]
-        node = node_data["node"]
+        async def emit_token(text: str):
+            await on_event("token", {"node_id": node_id, "text": text})
+        streaming = on_event is not None and any(
+            graph_nodes[dependent]["node"]["type"] == "output"
+            for dependent in graph_nodes[node_id]["dependents"]
+        )
+        on_token = emit_token if streaming else None
         
-        # Execute dependencies first
-        for dep in node_data["dependencies"]:
-            await execute_node(dep)
+        inputs = [
+            {**wire, "value": results[wire["source"]]}
+            for wire in plan["inputs"][node_id]
+        ]
+        node_type = graph_nodes[node_id]["node"]["type"]
+        config = plan["configs"][node_id]
         
-        # Execute current node
-        result = await execute_single_node(node, query, results)
-        results[node_id] = result
-        executed.add(node_id)
+        with span(
+            "node",
+            node_id=node_id,
+            node_type=node_type,
+            model=config.get("model", "") if node_type == "llmEngine" else "",
+            input_bytes=sum(payload_size(item["value"]) for item in inputs)
+        ) as node_span:
+            waiting = time.perf_counter()
+            async with semaphore:
+                node_span.add_queue_wait(time.perf_counter() - waiting)
+                result = await execute_single_node(
+                    graph_nodes[node_id]["node"], query, inputs, on_token, config, raise_errors
+                )
+            node_span.set(output_bytes=payload_size(result))
         
+        if on_event:
+            await on_event("node", {
+                "node_id": node_id,
+                "type": node_type,
+                "status": "completed",
+                "duration_ms": round(1000 * node_span.duration, 3)
+            })
         return result
     
-    # Execute all nodes
-    for start_node in start_nodes:
-        await execute_node(start_node)
+    # Seed with every needed node that has no dependencies, in topological order
+    pending = {}
+    for node_id in plan["run_order"]:
+        if remaining[node_id] == 0:
+            pending[asyncio.create_task(execute_node(node_id))] = node_id
     
-    # Find output node
-    output_nodes = [node_id for node_id, data in graph.items() 
-                    if data["node"]["type"] == "output"]
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                node_id = pending.pop(task)
+                results[node_id] = task.result()
+                
+                for dependency in graph_nodes[node_id]["dependencies"]:
+                    consumers_left[dependency] -= 1
+                    if consumers_left[dependency] == 0 and dependency not in keep:
+                        results.pop(dependency, None)
+                
+                # Schedule dependents whose inputs are now all available
+                for dependent in graph_nodes[node_id]["dependents"]:
+                    if dependent not in needed:
+                        continue
+                    remaining[dependent] -= 1
+                    if remaining[dependent] == 0:
+                        pending[asyncio.create_task(execute_node(dependent))] = dependent
+    finally:
+        for task in pending:
+            task.cancel()
     
-    if output_nodes:
-        return results.get(output_nodes[0], "No output generated")
+    # Find output node
+    if plan["output_nodes"]:
+        return results.get(plan["output_nodes"][0], "No output generated")
     else:
         return "Workflow completed but no output node found"
 
-async def execute_single_node(node: Dict, query: str, previous_results: Dict) -> str:
-    """Execute a single node"""
+def select_inputs(inputs: List[Dict[str, Any]], handle: Optional[str], source_type: str) -> List[Any]:
+    """Values wired to the given target handle.
+
+    Edges drawn without a target handle fall back to matching on the type
+    of the node they come from.
+    """
+    wired = [item["value"] for item in inputs if handle and item["target_handle"] == handle]
+    if wired:
+        return wired
+    return [item["value"] for item in inputs if not item["target_handle"] and item["source_type"] == source_type]
+
+async def execute_single_node(
+    node: Dict,
+    query: str,
+    inputs: List[Dict[str, Any]],
+    on_token: Optional[Callable[[str], Awaitable[None]]] = None,
+    config: Optional[Mapping[str, Any]] = None,
+    raise_errors: bool = False
+) -> str:
+    """Execute a single node
+
+    inputs holds one entry per incoming edge with the source node's result
+    under "value". config is the node's resolved config from the compiled
+    plan. LLM nodes stream their completion through on_token when given.
+    Search and LLM failures are returned as text unless raise_errors is set.
+    """
     node_type = node["type"]
-    config = node.get("data", {}).get("config", {})
+    if config is None:
+        config = node.get("data", {}).get("config", {})
     
     if node_type == "userQuery":
         return query
     
     elif node_type == "knowledgeBase":
         # Search documents for relevant context
-        if chroma_client and embedding_model:
+        queries = select_inputs(inputs, "query", "userQuery")
+        search_query = queries[0] if queries else query
+        vector_store = await vector_store_resource.aget()
+        embedding_model = await embedding_resource.aget()
+        if vector_store and embedding_model:
             try:
-                query_embedding = embedding_model.encode(query)
-                results = collection.query(
-                    query_embeddings=[query_embedding.tolist()],
-                    n_results=3
+                hits = await retrieve(
+                    vector_store,
+                    vector_store.get_collection(config.get("collection"), config),
+                    embedding_model,
+                    EMBEDDING_MODEL_NAME,
+                    search_query,
+                    config.get("nResults", 3),
+                    where=config.get("where"),
+                    mode=config.get("retrievalMode"),
+                    candidates=config.get("candidates"),
+                    rerank_model=(config.get("rerankModel") or RERANK_MODEL) if config.get("rerank") else None,
+                    context_tokens=config.get("contextTokens")
                 )
                 
-                if results['documents'][0]:
-                    context = "\n".join(results['documents'][0])
-                    return f"Context from knowledge base:\n{context}"
+                if hits:
+                    context = "\n".join(hit["document"] for hit in hits)
+                    return RetrievedContext(f"Context from knowledge base:\n{context}", hits)
                 else:
                     return "No relevant documents found in knowledge base."
             except Exception as e:
+                if raise_errors:
+                    raise
                 return f"Error searching knowledge base: {str(e)}"
         else:
+            if raise_errors:
+                raise RuntimeError("Knowledge base not available")
             return "Knowledge base not available."
     
     elif node_type == "llmEngine":
-        # Get inputs from previous nodes
-        input_query = query
-        input_context = ""
-        
-        # Find connected nodes
-        for node_id, result in previous_results.items():
-            if nodes[node_id]["type"] == "userQuery":
-                input_query = result
-            elif nodes[node_id]["type"] == "knowledgeBase":
-                input_context = result
+        # Get inputs from connected nodes
+        queries = select_inputs(inputs, "query", "userQuery")
+        input_query = queries[0] if queries else query
         
         # Call LLM
+        model = config.get("model", "gpt-3.5-turbo")
+        temperature = config.get("temperature", 0.7)
+        system_prompt = config.get("customPrompt", DEFAULT_SYSTEM_PROMPT)
+        
         try:
-            model = config.get("model", "gpt-3.5-turbo")
-            temperature = config.get("temperature", 0.7)
+            await check_llm_available(model)
+            # Fit the deduplicated, best-ranked context chunks into the model's token budget
+            assembled = await assemble_context(
+                model,
+                input_query,
+                select_inputs(inputs, "context", "knowledgeBase"),
+                system_prompt,
+                max_tokens=config.get("maxTokens"),
+                max_context_tokens=config.get("maxContextTokens"),
+                embedding_model=await embedding_resource.aget() if config.get("dedupContext", True) else None,
+                embedding_model_name=EMBEDDING_MODEL_NAME,
+                dedup_threshold=config.get("dedupThreshold")
+            )
+            annotate(
+                context_tokens=assembled["context_tokens"],
+                context_chunks=assembled["chunks"],
+                duplicate_chunks=assembled["duplicates"],
+                dropped_chunks=assembled["dropped"],
+                max_tokens=assembled["max_tokens"]
+            )
+            input_context = assembled["context"]
+            max_tokens = assembled["max_tokens"]
+            full_prompt = build_prompt(input_query, input_context)
             
-            if model.startswith("gpt") and openai_client:
-                full_prompt = input_query
-                if input_context:
-                    full_prompt = f"Context: {input_context}\n\nQuestion: {input_query}\n\nAnswer:"
-                
-                response = openai_client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": config.get("customPrompt", "You are a helpful AI assistant.")},
-                        {"role": "user", "content": full_prompt}
-                    ],
-                    temperature=temperature,
-                    max_tokens=1000
-                )
-                return response.choices[0].message.content
+            cached, cache_entry = await lookup_response(
+                model, full_prompt, system_prompt, temperature, max_tokens,
+                question=input_query,
+                context=input_context,
+                cache=config.get("cache"),
+                semantic=config.get("semanticCache"),
+                threshold=config.get("semanticCacheThreshold")
+            )
+            if cached:
+                if on_token:
+                    await on_token(cached["response"])
+                return cached["response"]
+            
+            if on_token:
+                usage = {}
+                parts = []
+                async for text in stream_llm(model, full_prompt, system_prompt, temperature, max_tokens, usage):
+                    parts.append(text)
+                    await on_token(text)
+                result = {"response": "".join(parts), "usage": usage}
             else:
-                return f"LLM model {model} not available."
+                result = await complete_llm(model, full_prompt, system_prompt, temperature, max_tokens)
+            store_response(cache_entry, result)
+            return result["response"]
+        except LLMNotAvailable:
+            if raise_errors:
+                raise
+            return f"LLM model {model} not available."
         except Exception as e:
+            if raise_errors:
+                raise
             return f"Error calling LLM: {str(e)}"
     
     elif node_type == "output":
-        # Return the result from the previous node
-        for node_id, result in previous_results.items():
-            if nodes[node_id]["type"] == "llmEngine":
-                return result
+        # Return the result from the connected LLM node, or any other input
+        for item in inputs:
+            if item["source_type"] == "llmEngine":
+                return item["value"]
+        if inputs:
+            return inputs[0]["value"]
         return "No input received for output node."
     
     else:
@@ -0,0 +1,140 @@
+"""Streaming, page-parallel text extraction from uploaded documents"""
+import asyncio
+import os
+import tempfile
+from collections import deque
+from typing import AsyncIterator, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from executors import blocking_io_executor, pdf_executor
+
+PDF_MAX_UPLOAD_BYTES = int(os.getenv("PDF_MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+# Page batches extracted ahead of the consumer; bounds memory when the client reads slowly
+PDF_BATCHES_AHEAD = int(os.getenv("PDF_BATCHES_AHEAD", "4"))
+UPLOAD_READ_CHUNK = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+async def spool_upload(file, suffix: str, max_bytes: int = PDF_MAX_UPLOAD_BYTES) -> str:
+    """Copy an upload to a named temp file chunk by chunk and return its path"""
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_READ_CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds the {max_bytes} byte limit")
+                await blocking_io_executor.run(out.write, chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+def page_count(path: str) -> int:
+    with fitz.open(path) as pdf:
+        return pdf.page_count
+
+
+def extract_pages(path: str, first: int, last: int) -> List[Tuple[int, str]]:
+    """Text of 0-based pages first..last inclusive; runs in a worker process"""
+    with fitz.open(path) as pdf:
+        return [(number, pdf[number].get_text()) for number in range(first, last + 1)]
+
+
+def resolve_page_range(total: int, start_page: Optional[int], end_page: Optional[int]) -> Tuple[int, int]:
+    """Convert a 1-based inclusive page range to 0-based bounds within the document"""
+    if total == 0:
+        raise ValueError("Document has no pages")
+    first = (start_page or 1) - 1
+    last = min(end_page or total, total) - 1
+    if first < 0 or first >= total or last < first:
+        raise ValueError(f"Invalid page range {start_page}-{end_page} for a {total} page document")
+    return first, last
+
+
+def _page_batches(first: int, last: int, pages_per_task: int) -> List[Tuple[int, int]]:
+    # The first batch is a single page so the caller sees text as early as possible
+    batches = [(first, first)]
+    start = first + 1
+    while start <= last:
+        end = min(start + pages_per_task - 1, last)
+        batches.append((start, end))
+        start = end + 1
+    return batches
+
+
+async def iter_pdf_pages(
+    path: str,
+    start_page: Optional[int] = None,
+    end_page: Optional[int] = None,
+    pages_per_task: int = PDF_PAGES_PER_TASK,
+    batches_ahead: int = PDF_BATCHES_AHEAD
+) -> AsyncIterator[Tuple[int, str]]:
+    """Yield (1-based page number, text) in page order.
+
+    Page batches are extracted in parallel in the PDF process pool; each
+    batch is yielded as soon as it and every batch before it are done.
+    At most batches_ahead batches are running or waiting to be consumed,
+    so a slow reader holds back extraction instead of buffering the text.
+    """
+    total = await pdf_executor.run(page_count, path)
+    first, last = resolve_page_range(total, start_page, end_page)
+
+    batches = deque(_page_batches(first, last, max(1, pages_per_task)))
+    tasks: deque = deque()
+
+    def fill():
+        while batches and len(tasks) < max(1, batches_ahead):
+            batch_first, batch_last = batches.popleft()
+            tasks.append(asyncio.ensure_future(pdf_executor.run(extract_pages, path, batch_first, batch_last)))
+
+    try:
+        fill()
+        while tasks:
+            pages = await tasks.popleft()
+            fill()
+            for number, text in pages:
+                yield number + 1, text
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def read_text_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8")
+
+
+async def iter_upload_pages(
+    path: str,
+    is_pdf: bool,
+    start_page: Optional[int] = None,
+    end_page: Optional[int] = None
+) -> AsyncIterator[Tuple[int, str]]:
+    """Yield the pages of a spooled upload, deleting the temp file when done.
+
+    A text file is a single page.
+    """
+    try:
+        if is_pdf:
+            pages = iter_pdf_pages(path, start_page, end_page)
+            try:
+                async for page in pages:
+                    yield page
+            finally:
+                await pages.aclose()
+        else:
+            yield 1, await blocking_io_executor.run(read_text_file, path)
+    finally:
+        os.unlink(path)
@@ -0,0 +1,294 @@
+"""Connection pooling, rate limits, timeouts and hedging for external providers.
+
+Each provider (OpenAI, Gemini, SerpAPI) gets one pooled keep-alive HTTP
+client, a concurrency limit and request/token buckets sized to its API
+quota. Calls that exceed the limits wait their turn instead of turning a
+burst of traffic into a wave of 429s. Settings are read from
+<PROVIDER>_<SETTING> environment variables, e.g. OPENAI_MAX_CONCURRENCY.
+"""
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from retry import retry_async
+from tracing import annotate
+
+PROVIDER_DEFAULTS = {
+    "openai": {
+        "MAX_CONCURRENCY": 32,
+        "REQUESTS_PER_MINUTE": 500,
+        "TOKENS_PER_MINUTE": 200000,
+        "TIMEOUT": 60,
+        "MAX_CONNECTIONS": 64,
+        "MAX_KEEPALIVE": 32
+    },
+    # google-generativeai manages its own transport, so Gemini has no connection pool settings
+    "gemini": {
+        "MAX_CONCURRENCY": 16,
+        "REQUESTS_PER_MINUTE": 360,
+        "TOKENS_PER_MINUTE": 0,
+        "TIMEOUT": 60
+    },
+    "serpapi": {
+        "MAX_CONCURRENCY": 8,
+        "REQUESTS_PER_MINUTE": 100,
+        "TOKENS_PER_MINUTE": 0,
+        "TIMEOUT": 20,
+        "MAX_CONNECTIONS": 16,
+        "MAX_KEEPALIVE": 8
+    }
+}
+# Shared defaults; 0 disables a rate limit or hedging
+COMMON_DEFAULTS = {
+    "CONNECT_TIMEOUT": 5,
+    "KEEPALIVE_EXPIRY": 30,
+    "BURST_SECONDS": 10,
+    "HEDGE_AFTER_MS": 0
+}
+
+
+def _setting(provider: str, name: str) -> float:
+    default = PROVIDER_DEFAULTS[provider].get(name, COMMON_DEFAULTS.get(name))
+    return float(os.getenv(f"{provider.upper()}_{name}", str(default)))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) for rate limiting"""
+    return len(text or "") // 4 + 1
+
+
+class TokenBucket:
+    """Refills at rate_per_minute, holding at most burst_seconds worth of tokens"""
+
+    def __init__(self, rate_per_minute: float, burst_seconds: float):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        """Take amount tokens, waiting for them if needed; returns seconds waited"""
+        # A request larger than the bucket would never fit; let it drain the bucket instead
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+
+
+class Provider:
+    """Limits, timeouts and the pooled HTTP client for one external API"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.max_concurrency = int(_setting(name, "MAX_CONCURRENCY"))
+        self.timeout = _setting(name, "TIMEOUT")
+        self.connect_timeout = _setting(name, "CONNECT_TIMEOUT")
+        self.pooled = "MAX_CONNECTIONS" in PROVIDER_DEFAULTS[name]
+        self.max_connections = int(_setting(name, "MAX_CONNECTIONS")) if self.pooled else None
+        self.max_keepalive = int(_setting(name, "MAX_KEEPALIVE")) if self.pooled else None
+        self.keepalive_expiry = _setting(name, "KEEPALIVE_EXPIRY") if self.pooled else None
+        self.hedge_after = _setting(name, "HEDGE_AFTER_MS") / 1000
+        burst = _setting(name, "BURST_SECONDS")
+        requests_per_minute = _setting(name, "REQUESTS_PER_MINUTE")
+        tokens_per_minute = _setting(name, "TOKENS_PER_MINUTE")
+        self.requests = TokenBucket(requests_per_minute, burst) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute, burst) if tokens_per_minute > 0 else None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._http_client = None
+        self.calls = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self.timeouts = 0
+        self.rate_limited = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.throttled_seconds = 0.0
+
+    def http_client(self):
+        """The provider's shared keep-alive httpx.AsyncClient"""
+        if not self.pooled:
+            raise RuntimeError(f"{self.name} does not use a pooled HTTP client")
+        if self._http_client is None:
+            import httpx
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.keepalive_expiry
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout)
+            )
+        return self._http_client
+
+    async def close(self):
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0):
+        """Wait for the rate limits and a concurrency slot, then hold the slot"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            if self.requests is not None:
+                await self.requests.acquire(1)
+            if self.tokens is not None and tokens:
+                await self.tokens.acquire(tokens)
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - started
+        self.throttled_seconds += waited
+        if waited >= 0.001:
+            annotate(throttle_wait_ms=round(1000 * waited, 3))
+        self.calls += 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def _attempt(self, fn: Callable[..., Awaitable[Any]], tokens: int, *args, **kwargs) -> Any:
+        async with self.slot(tokens):
+            try:
+                return await asyncio.wait_for(fn(*args, **kwargs), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise
+            except Exception as e:
+                if getattr(e, "status_code", None) == 429 or getattr(getattr(e, "response", None), "status_code", None) == 429:
+                    self.rate_limited += 1
+                raise
+
+    async def _hedged(self, fn: Callable[..., Awaitable[Any]], tokens: int, *args, **kwargs) -> Any:
+        """Start a second copy of a slow call and keep whichever succeeds first"""
+        tasks = [asyncio.ensure_future(self._attempt(fn, tokens, *args, **kwargs))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if not done:
+                self.hedged += 1
+                tasks.append(asyncio.ensure_future(self._attempt(fn, tokens, *args, **kwargs)))
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def call(self, fn: Callable[..., Awaitable[Any]], *args, tokens: int = 0, hedge: bool = False, **kwargs) -> Any:
+        """Await fn(*args, **kwargs) within the limits, with a timeout and retries.
+
+        tokens is the estimated prompt plus completion size for the token
+        bucket. hedge should only be set for idempotent calls; a hedged
+        call is duplicated when it has not finished after HEDGE_AFTER_MS.
+        """
+        attempt = self._hedged if hedge and self.hedge_after > 0 else self._attempt
+        return await retry_async(attempt, fn, tokens, *args, **kwargs)
+
+    async def stream(self, fn: Callable[..., Awaitable[Any]], *args, tokens: int = 0, **kwargs) -> AsyncIterator[Any]:
+        """Open a streamed response and yield its chunks, holding a slot until it ends.
+
+        Opening is retried on transient errors; each chunk must arrive
+        within the provider timeout.
+        """
+        async with self.slot(tokens):
+            async def open_stream():
+                return await asyncio.wait_for(fn(*args, **kwargs), self.timeout)
+            stream = await retry_async(open_stream)
+            iterator = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), self.timeout)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    raise
+                yield chunk
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "requests_per_minute": round(self.requests.rate * 60) if self.requests else None,
+            "tokens_per_minute": round(self.tokens.rate * 60) if self.tokens else None,
+            "calls": self.calls,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "timeouts": self.timeouts,
+            "rate_limited": self.rate_limited,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "throttled_seconds": round(self.throttled_seconds, 3)
+        }
+
+
+PROVIDERS = {name: Provider(name) for name in PROVIDER_DEFAULTS}
+openai_provider = PROVIDERS["openai"]
+gemini_provider = PROVIDERS["gemini"]
+serpapi_provider = PROVIDERS["serpapi"]
+
+
+class SerpApiClient:
+    """SerpAPI search over the provider's pooled HTTP client"""
+
+    URL = "https://serpapi.com/search"
+
+    def __init__(self, api_key: str, provider: Provider = serpapi_provider):
+        self.api_key = api_key
+        self.provider = provider
+
+    async def search(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        response = await self.provider.http_client().get(
+            self.URL,
+            params={"engine": "google", "output": "json", **params, "api_key": self.api_key}
+        )
+        response.raise_for_status()
+        return response.json()
+
+
+_gemini_models: Dict[str, Tuple[Any, Any]] = {}
+
+
+def gemini_model(genai: Any, model_name: str) -> Any:
+    """A GenerativeModel per model name, created once and reused"""
+    cached = _gemini_models.get(model_name)
+    if cached is None or cached[0] is not genai:
+        cached = _gemini_models[model_name] = (genai, genai.GenerativeModel(model_name))
+    return cached[1]
+
+
+def provider_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: provider.stats() for name, provider in PROVIDERS.items()}
+
+
+async def close_providers():
+    for provider in PROVIDERS.values():
+        await provider.close()
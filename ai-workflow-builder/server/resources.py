@@ -0,0 +1,84 @@
+"""Lazily loaded singletons for models and clients"""
+import asyncio
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+
+class LazyResource:
+    """Loads a model or client on first use instead of at import time.
+
+    The loader runs at most once. If it returns None the resource is
+    "disabled" (for example no API key); if it raises, the resource is
+    "failed" and get() returns None, mirroring how the server behaves
+    when an optional library is missing.
+    """
+
+    def __init__(self, name: str, loader: Callable[[], Any]):
+        self.name = name
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._loading = False
+        self._value: Any = None
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+
+    def get(self) -> Any:
+        """Return the resource, loading it in the calling thread if needed"""
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                self._loading = True
+                started = time.perf_counter()
+                try:
+                    self._value = self._loader()
+                except Exception as e:
+                    self.error = str(e)
+                    print(f"Warning: {self.name} not available: {e}")
+                finally:
+                    self.load_seconds = round(time.perf_counter() - started, 3)
+                    self._loading = False
+                    self._loaded = True
+        return self._value
+
+    async def aget(self) -> Any:
+        """Return the resource, loading it in a worker thread so the event loop stays free"""
+        if self._loaded:
+            return self._value
+        return await asyncio.get_running_loop().run_in_executor(None, self.get)
+
+    def set(self, value: Any):
+        """Install an already-built value (used by tests and benchmarks)"""
+        with self._lock:
+            self._value = value
+            self.error = None
+            self._loaded = True
+
+    @property
+    def available(self) -> bool:
+        return self._loaded and self._value is not None
+
+    @property
+    def state(self) -> str:
+        if self._loading:
+            return "loading"
+        if not self._loaded:
+            return "not_loaded"
+        if self.error:
+            return "failed"
+        return "ready" if self._value is not None else "disabled"
+
+    def status(self) -> Dict[str, Any]:
+        return {"state": self.state, "load_seconds": self.load_seconds, "error": self.error}
+
+
+async def warm_up(resources: Iterable[LazyResource]):
+    """Load resources concurrently in background threads"""
+    await asyncio.gather(*(resource.aget() for resource in resources))
+
+
+def is_ready(resources: Iterable[LazyResource]) -> bool:
+    """True once every resource has loaded (or is disabled); a failed load is not ready"""
+    return all(resource.state in ("ready", "disabled") for resource in resources)
@@ -0,0 +1,133 @@
+"""Exact-match and semantic caching of LLM responses"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+from caching import LRUCache
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "false").lower() == "true"
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))
+
+
+def _digest(*parts: Any) -> str:
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def response_key(model: str, system_prompt: str, prompt: str, temperature: float, max_tokens: int) -> str:
+    """Exact-match key for one completion request"""
+    return _digest(model, system_prompt, prompt, float(temperature), int(max_tokens))
+
+
+def semantic_scope(model: str, system_prompt: str, temperature: float, max_tokens: int, context: Optional[str]) -> str:
+    """Requests whose questions may be compared: same model settings and same retrieved context"""
+    return _digest(model, system_prompt, float(temperature), int(max_tokens), context or "")
+
+
+def should_cache(temperature: float, enabled: Optional[bool] = None) -> bool:
+    """Deterministic (temperature 0) calls are cached unless explicitly disabled"""
+    if enabled is not None:
+        return bool(enabled)
+    return float(temperature) == 0.0
+
+
+class _SemanticEntries(LRUCache):
+    """LRU of (scope, unit query vector, value) with a per-scope index"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        super().__init__(max_entries, ttl_seconds)
+        self.scopes: Dict[str, set] = {}
+        self._key_scopes: Dict[Hashable, str] = {}
+
+    def add(self, key: Hashable, scope: str, vector: np.ndarray, value: Any):
+        if key in self._key_scopes:
+            self.pop(key)
+        self._key_scopes[key] = scope
+        self.scopes.setdefault(scope, set()).add(key)
+        self.put(key, (scope, vector, value))
+
+    def _on_evict(self, key: Hashable):
+        scope = self._key_scopes.pop(key, None)
+        keys = self.scopes.get(scope)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.scopes[scope]
+
+
+class ResponseCache:
+    """Exact tier keyed by the full request, optional semantic tier keyed by query similarity"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.exact = LRUCache(max_entries, ttl_seconds)
+        self.semantic = _SemanticEntries(max_entries, ttl_seconds)
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def lookup(
+        self,
+        key: str,
+        scope: Optional[str] = None,
+        vector: Optional[np.ndarray] = None,
+        threshold: float = RESPONSE_CACHE_THRESHOLD
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Return (cached value, "exact" | "semantic") or (None, None)"""
+        value = self.exact.get(key)
+        if value is not None:
+            self.exact_hits += 1
+            return value, "exact"
+
+        if scope is not None and vector is not None:
+            best_value, best_score = None, threshold
+            unit = _unit(vector)
+            for entry_key in list(self.semantic.scopes.get(scope, ())):
+                entry = self.semantic.get(entry_key)
+                if entry is None:
+                    continue
+                score = float(np.dot(unit, entry[1]))
+                if score >= best_score:
+                    best_value, best_score = entry[2], score
+            if best_value is not None:
+                self.semantic_hits += 1
+                return best_value, "semantic"
+
+        self.misses += 1
+        return None, None
+
+    def store(self, key: str, value: Dict[str, Any], scope: Optional[str] = None, vector: Optional[np.ndarray] = None):
+        self.exact.put(key, value)
+        if scope is not None and vector is not None:
+            self.semantic.add(key, scope, _unit(vector), value)
+        self.stores += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "exact_entries": len(self.exact),
+            "semantic_entries": len(self.semantic),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.exact.evictions + self.semantic.evictions,
+            "hit_rate": round((self.exact_hits + self.semantic_hits) / lookups, 4) if lookups else 0.0
+        }
+
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+
+
+def response_cache_stats() -> Dict[str, Any]:
+    return response_cache.stats()
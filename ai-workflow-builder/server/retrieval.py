@@ -0,0 +1,216 @@
+"""Hybrid keyword + vector retrieval with rank fusion and optional reranking"""
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from embeddings import encode_texts
+from executors import embedding_executor, vectorstore_executor
+from ingestion import token_spans
+from resources import LazyResource
+from tracing import payload_size, span
+
+RETRIEVAL_MODES = ("vector", "keyword", "hybrid")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+KEYWORD_BACKFILL_BATCH_SIZE = 1000
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Combine ranked id lists; each list contributes 1 / (k + rank) per id"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def trim_to_budget(hits: List[Dict[str, Any]], max_tokens: Optional[int], tokenizer: Any = None) -> List[Dict[str, Any]]:
+    """Keep hits in rank order while their combined token count fits max_tokens.
+
+    Hits that do not fit are skipped so a shorter, lower-ranked chunk can
+    still use the remaining budget. A top hit longer than the whole budget
+    is cut to fit rather than dropped.
+    """
+    if not max_tokens:
+        return hits
+    kept, used = [], 0
+    for hit in hits:
+        spans = token_spans(hit["document"] or "", tokenizer)
+        if used + len(spans) <= max_tokens:
+            kept.append(hit)
+            used += len(spans)
+        elif not kept:
+            kept.append({**hit, "document": hit["document"][:spans[max_tokens - 1][1]], "truncated": True})
+            used = max_tokens
+    return kept
+
+
+_rerankers: Dict[str, LazyResource] = {}
+
+
+def get_reranker(model_name: str = RERANK_MODEL) -> LazyResource:
+    resource = _rerankers.get(model_name)
+    if resource is None:
+        def load():
+            from sentence_transformers import CrossEncoder
+            return CrossEncoder(model_name, device="cpu")
+        resource = _rerankers[model_name] = LazyResource(f"reranker {model_name}", load)
+    return resource
+
+
+async def rerank(
+    query: str,
+    hits: List[Dict[str, Any]],
+    model_name: str = RERANK_MODEL,
+    batch_size: int = RERANK_BATCH_SIZE
+) -> List[Dict[str, Any]]:
+    """Reorder hits by cross-encoder score, leaving them as they are if the model is unavailable"""
+    model = await get_reranker(model_name).aget()
+    if model is None or not hits:
+        return hits
+    with span("rerank", model=model_name, candidates=len(hits)):
+        scores = await embedding_executor.run(
+            model.predict,
+            [(query, hit["document"]) for hit in hits],
+            batch_size=batch_size,
+            show_progress_bar=False
+        )
+    for hit, score in zip(hits, scores):
+        hit["rerank_score"] = float(score)
+    return sorted(hits, key=lambda hit: hit["rerank_score"], reverse=True)
+
+
+async def backfill_keyword_index(vector_store: Any, collection: Any):
+    """Fill the collection's BM25 index from Chroma once if it predates the index"""
+    index = vector_store.get_keyword_index(collection.name)
+    if index.backfilled:
+        return
+    count = await vectorstore_executor.run(collection.count)
+    for offset in range(0, count, KEYWORD_BACKFILL_BATCH_SIZE):
+        page = await vectorstore_executor.run(
+            collection.get,
+            limit=KEYWORD_BACKFILL_BATCH_SIZE,
+            offset=offset,
+            include=["documents", "metadatas"]
+        )
+        await vectorstore_executor.run(index.upsert, page["ids"], page["documents"], page["metadatas"])
+    await vectorstore_executor.run(index.mark_backfilled)
+
+
+_backfills: Dict[str, asyncio.Task] = {}
+
+
+def _backfill_done(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Warning: Keyword index backfill failed: {task.exception()}")
+
+
+def start_keyword_backfill(vector_store: Any, collection: Any) -> asyncio.Task:
+    """Backfill in the background; concurrent callers for a collection share one task"""
+    task = _backfills.get(collection.name)
+    if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+        task = _backfills[collection.name] = asyncio.ensure_future(backfill_keyword_index(vector_store, collection))
+        task.add_done_callback(_backfill_done)
+    return task
+
+
+def keyword_index_for(vector_store: Any, collection: Any) -> Optional[Any]:
+    """The collection's BM25 index, or None while it is still being backfilled"""
+    index = vector_store.get_keyword_index(collection.name)
+    if index.backfilled:
+        return index
+    start_keyword_backfill(vector_store, collection)
+    return None
+
+
+async def retrieve(
+    vector_store: Any,
+    collection: Any,
+    embedding_model: Any,
+    model_name: str,
+    query: str,
+    n_results: int,
+    where: Optional[Dict[str, Any]] = None,
+    mode: Optional[str] = None,
+    candidates: Optional[int] = None,
+    rerank_model: Optional[str] = None,
+    context_tokens: Optional[int] = None,
+    rrf_k: int = RRF_K
+) -> List[Dict[str, Any]]:
+    """Top n_results chunks for query.
+
+    "vector" is dense search only, "keyword" BM25 only and "hybrid" fuses
+    both rankings with reciprocal rank fusion. Each retriever contributes
+    up to candidates results; with rerank_model the fused candidates are
+    re-scored by that cross-encoder. The final list is trimmed to
+    context_tokens tokens when given. Until a collection's keyword index
+    has been backfilled, keyword and hybrid searches use vector search only.
+    """
+    mode = mode or RETRIEVAL_MODE
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode {mode}; expected one of {', '.join(RETRIEVAL_MODES)}")
+    candidates = max(n_results, candidates or RETRIEVAL_CANDIDATES)
+    with span("retrieval", mode=mode, n_results=n_results, rerank=bool(rerank_model)) as retrieval_span:
+        hits: Dict[str, Dict[str, Any]] = {}
+        rankings = []
+        index = keyword_index_for(vector_store, collection) if mode != "vector" else None
+        if mode != "vector" and index is None:
+            retrieval_span.set(keyword_fallback=True)
+            mode = "vector"
+
+        if mode != "keyword":
+            embedding = (await encode_texts(embedding_model, [query], model_name))[0]
+            results = await vector_store.query(
+                collection,
+                embedding.tolist(),
+                n_results if mode == "vector" and not rerank_model else candidates,
+                where
+            )
+            for doc_id, document, metadata, distance in zip(
+                results["ids"][0], results["documents"][0], results["metadatas"][0], results["distances"][0]
+            ):
+                hits[doc_id] = {"id": doc_id, "document": document, "metadata": metadata, "distance": distance}
+            rankings.append(list(results["ids"][0]))
+
+        if mode != "vector":
+            # Over-fetch when filtering since some keyword hits will not match where
+            keyword_hits = await vectorstore_executor.run(index.search, query, candidates * (3 if where else 1))
+            missing = [doc_id for doc_id, _ in keyword_hits if doc_id not in hits]
+            if missing:
+                found = await vectorstore_executor.run(
+                    collection.get,
+                    ids=missing,
+                    where=where or None,
+                    include=["documents", "metadatas"]
+                )
+                for doc_id, document, metadata in zip(found["ids"], found["documents"], found["metadatas"]):
+                    hits[doc_id] = {"id": doc_id, "document": document, "metadata": metadata, "distance": None}
+            ranking = []
+            for doc_id, score in keyword_hits:
+                if doc_id in hits:
+                    hits[doc_id]["bm25_score"] = score
+                    ranking.append(doc_id)
+            rankings.append(ranking[:candidates])
+
+        ranked = []
+        for doc_id, score in reciprocal_rank_fusion(rankings, rrf_k):
+            hits[doc_id]["score"] = score
+            ranked.append(hits[doc_id])
+
+        if rerank_model:
+            ranked = await rerank(query, ranked[:candidates], rerank_model)
+
+        # Tokenizing can be slow (or a round trip to the embedding service), so keep it off the event loop
+        trimmed = await embedding_executor.run(
+            trim_to_budget, ranked[:n_results], context_tokens, getattr(embedding_model, "tokenizer", None)
+        ) if context_tokens else ranked[:n_results]
+        retrieval_span.set(
+            vector_hits=len(rankings[0]) if mode != "keyword" else 0,
+            keyword_hits=len(rankings[-1]) if mode != "vector" else 0,
+            results=len(trimmed),
+            context_bytes=sum(payload_size(hit["document"]) for hit in trimmed)
+        )
+        return trimmed
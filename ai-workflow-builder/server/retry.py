@@ -0,0 +1,64 @@
+"""Retries with exponential backoff for transient provider failures"""
+import asyncio
+import os
+import random
+from typing import Any, Awaitable, Callable
+
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+# Exception class names used by the OpenAI, Google and requests clients for transient errors
+_RETRYABLE_NAMES = (
+    "Timeout",
+    "Connection",
+    "RateLimit",
+    "TooManyRequests",
+    "ResourceExhausted",
+    "ServiceUnavailable",
+    "DeadlineExceeded",
+    "InternalServerError"
+)
+
+
+def _status_code(exc: BaseException):
+    for source in (exc, getattr(exc, "response", None)):
+        for attr in ("status_code", "code"):
+            try:
+                return int(getattr(source, attr))
+            except (AttributeError, TypeError, ValueError):
+                continue
+    return None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """True for timeouts, connection errors, rate limits and 5xx responses"""
+    if isinstance(exc, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    return any(name in type(exc).__name__ for name in _RETRYABLE_NAMES)
+
+
+def backoff_delay(attempt: int, base_delay: float = RETRY_BASE_DELAY, max_delay: float = RETRY_MAX_DELAY) -> float:
+    """Exponential backoff with full jitter for a 1-based attempt number"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+async def retry_async(
+    fn: Callable[..., Awaitable[Any]],
+    *args,
+    attempts: int = RETRY_ATTEMPTS,
+    retry_if: Callable[[BaseException], bool] = is_retryable,
+    **kwargs
+) -> Any:
+    """Await fn(*args, **kwargs), retrying transient failures with backoff"""
+    for attempt in range(1, max(1, attempts) + 1):
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            if attempt >= attempts or not retry_if(e):
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
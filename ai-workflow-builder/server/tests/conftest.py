@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Tests import the server modules the same way main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep test runs from writing a trace log into the working directory
+os.environ["TRACE_LOG_PATH"] = ""
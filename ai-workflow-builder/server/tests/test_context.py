@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+import context
+from context import RetrievedContext, assemble_context
+
+
+def words(prefix, count):
+    # Short words count as one token each with the regex estimate
+    return " ".join(f"{prefix}{i}" for i in range(count))
+
+
+def ranked(*texts, source="kb"):
+    hits = [{"id": f"{source}-{i}", "document": text} for i, text in enumerate(texts)]
+    return RetrievedContext("\n\n".join(texts), hits)
+
+
+@pytest.fixture(autouse=True)
+def tiny_model(monkeypatch):
+    # 100 token window, at most 40 completion tokens, estimated token counts
+    monkeypatch.setitem(context.MODEL_LIMITS, "tiny-model", (100, 40, None))
+
+
+def assemble(contexts, **kwargs):
+    return asyncio.run(assemble_context("tiny-model", "a b c", contexts, max_context_tokens=0, **kwargs))
+
+
+def test_context_fills_the_window_left_after_prompt_and_completion():
+    # Budget: 100 window - (3 question + 16 overhead) - 40 completion = 41 tokens
+    result = assemble([ranked(*(words(chunk, 10) for chunk in "vwxyz"))])
+
+    # Each chunk is 10 tokens plus a separator, so three fit
+    assert result["chunks"] == 3 and result["dropped"] == 2
+    assert result["context_tokens"] == 33
+    assert result["prompt_tokens"] == 19 + 33
+    assert result["max_tokens"] == 40
+    assert result["context"].startswith(words("v", 10))
+
+
+def test_completion_size_is_limited_by_the_model():
+    assert assemble([], max_tokens=500)["max_tokens"] == 40
+    assert assemble([], max_tokens=10)["max_tokens"] == 10
+
+
+def test_context_cap_applies_below_the_window():
+    result = asyncio.run(assemble_context("tiny-model", "a b c", [ranked(words("x", 10), words("y", 10))], max_context_tokens=12))
+
+    assert result["chunks"] == 1 and result["context_tokens"] == 11
+
+
+def test_oversized_best_chunk_is_truncated():
+    result = assemble([words("long", 60)])
+
+    assert result["truncated"]
+    assert result["context"] == words("long", 40)
+    assert result["context_tokens"] == 41
+
+
+def test_duplicate_chunks_are_dropped():
+    # The same text stored under another id, e.g. from a second knowledge base
+    result = assemble([ranked(words("d", 5), words("e", 5)), ranked(words("d", 5), source="other")])
+
+    assert result["duplicates"] == 1
+    assert result["chunks"] == 2
+
+
+def test_prompt_larger_than_the_window_is_an_error():
+    with pytest.raises(ValueError):
+        asyncio.run(assemble_context("tiny-model", words("q", 90), []))
@@ -0,0 +1,24 @@
+import asyncio
+import gc
+
+from benchmarks.fakes import FakeEmbeddingModel
+from embeddings import EmbeddingBatcher
+
+
+def test_concurrent_requests_share_batches_that_survive_gc():
+    batcher = EmbeddingBatcher(FakeEmbeddingModel(ms_per_text=0), max_items=4, max_wait_ms=1)
+
+    async def run():
+        requests = [batcher.encode([f"k{i}", "shared"], [f"text {i}", "shared text"]) for i in range(6)]
+        pending = asyncio.gather(*requests)
+        await asyncio.sleep(0)
+        # Running batches are referenced by the batcher, not only weakly by the loop
+        gc.collect()
+        return await asyncio.wait_for(pending, 5)
+
+    results = asyncio.run(run())
+
+    assert len(results) == 6 and all(len(vectors) == 2 for vectors in results)
+    assert batcher.coalesced == 5
+    assert batcher.items == 7
+    assert not batcher._tasks
@@ -0,0 +1,65 @@
+import asyncio
+
+import numpy as np
+
+from embeddings import DiskEmbeddingStore, EmbeddingCache
+
+
+def vector(value: float, dim: int = 4) -> np.ndarray:
+    return np.full(dim, value, dtype=np.float32)
+
+
+def test_stores_sharing_a_directory_agree_on_rows(tmp_path):
+    a = DiskEmbeddingStore(str(tmp_path), "model")
+    b = DiskEmbeddingStore(str(tmp_path), "model")
+
+    a.put_many([("ka", vector(1))])
+    b.put_many([("kb", vector(2))])
+    a.put_many([("kc", vector(3))])
+
+    for store in (a, b, DiskEmbeddingStore(str(tmp_path), "model")):
+        assert np.array_equal(store.get("ka"), vector(1))
+        assert np.array_equal(store.get("kb"), vector(2))
+        assert np.array_equal(store.get("kc"), vector(3))
+
+
+def test_duplicate_keys_do_not_shift_later_rows(tmp_path):
+    a = DiskEmbeddingStore(str(tmp_path), "model")
+    b = DiskEmbeddingStore(str(tmp_path), "model")
+    a.put_many([("kx", vector(1))])
+    b.put_many([("kx", vector(9)), ("ky", vector(2))])
+    # A key recorded twice keeps its first row
+    with open(a._index_path, "a") as f:
+        f.write("kx 2\n")
+
+    reopened = DiskEmbeddingStore(str(tmp_path), "model")
+    assert np.array_equal(reopened.get("kx"), vector(1))
+    assert np.array_equal(reopened.get("ky"), vector(2))
+    assert len(reopened) == 2
+
+
+def test_compaction_keeps_newest_vectors(tmp_path):
+    store = DiskEmbeddingStore(str(tmp_path), "model", max_entries=4)
+    other = DiskEmbeddingStore(str(tmp_path), "model", max_entries=4)
+    for i in range(5):
+        store.put_many([(f"k{i}", vector(i))])
+
+    assert store.compactions == 1
+    assert len(store) == 2
+    assert store.get("k0") is None
+    for reader in (store, other):
+        assert np.array_equal(reader.get("k3"), vector(3))
+        assert np.array_equal(reader.get("k4"), vector(4))
+
+
+def test_cache_reads_the_disk_tier_of_another_process(tmp_path):
+    writer = EmbeddingCache(10, 0, str(tmp_path))
+    asyncio.run(writer.put_many("model", [("ka", vector(1))]))
+    reader = EmbeddingCache(10, 0, str(tmp_path))
+
+    found = asyncio.run(reader.get_many("model", ["ka", "kb"]))
+
+    assert np.array_equal(found[0], vector(1)) and found[1] is None
+    assert (reader.disk_hits, reader.misses) == (1, 1)
+    # The disk hit is promoted to the memory tier
+    assert reader.memory.get(("model", "ka")) is not None
@@ -0,0 +1,21 @@
+import asyncio
+from types import SimpleNamespace
+
+from benchmarks.fakes import FakeEmbeddingModel
+from ingestion import ingest_documents
+from vector_store import VectorStore
+
+
+def test_repeated_filename_keeps_the_last_upload(tmp_path):
+    collection = VectorStore(str(tmp_path)).get_collection("docs")
+    documents = [
+        SimpleNamespace(filename="a.txt", content="first version of the pump manual", metadata=None),
+        SimpleNamespace(filename="b.txt", content="valve notes", metadata=None),
+        SimpleNamespace(filename="a.txt", content="second version of the pump manual", metadata=None)
+    ]
+
+    result = asyncio.run(ingest_documents(documents, FakeEmbeddingModel(ms_per_text=0), "fake", collection))
+
+    assert [doc["filename"] for doc in result["documents"]] == ["a.txt", "b.txt"]
+    stored = collection.get(where={"source": "a.txt"})
+    assert stored["documents"] == ["second version of the pump manual"]
@@ -0,0 +1,67 @@
+import threading
+
+from keyword_index import BM25Index
+
+
+def ids(results):
+    return {doc_id for doc_id, _ in results}
+
+
+def test_indexes_sharing_a_file_see_each_others_documents(tmp_path):
+    path = str(tmp_path / "bm25.db")
+    a = BM25Index(path)
+    b = BM25Index(path)
+
+    a.upsert(["a1"], ["pump pressure ERR-4711"], [{"source": "a.txt", "chunk_index": 0}])
+    b.upsert(["b1"], ["valve pressure reading"], [{"source": "b.txt", "chunk_index": 0}])
+
+    for index in (a, b, BM25Index(path)):
+        assert ids(index.search("pressure", 5)) == {"a1", "b1"}
+        assert ids(index.search("ERR-4711", 5)) == {"a1"}
+
+
+def test_stale_chunks_are_removed_in_every_process(tmp_path):
+    path = str(tmp_path / "bm25.db")
+    a = BM25Index(path)
+    b = BM25Index(path)
+    a.upsert(
+        ["d0", "d1"],
+        ["pump manual part one", "pump manual part two"],
+        [{"source": "d.txt", "chunk_index": 0}, {"source": "d.txt", "chunk_index": 1}]
+    )
+    assert ids(b.search("pump", 5)) == {"d0", "d1"}
+
+    b.delete_stale({"d.txt": 1})
+
+    assert ids(a.search("pump", 5)) == {"d0"}
+    assert len(BM25Index(path)) == 1
+
+
+def test_concurrent_upserts_are_all_kept(tmp_path):
+    path = str(tmp_path / "bm25.db")
+    indexes = [BM25Index(path) for _ in range(4)]
+
+    def ingest(worker):
+        for i in range(25):
+            indexes[worker].upsert([f"w{worker}-{i}"], [f"shared term worker{worker}"], [{"source": f"w{worker}", "chunk_index": i}])
+
+    threads = [threading.Thread(target=ingest, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for index in indexes + [BM25Index(path)]:
+        assert len(ids(index.search("shared", 200))) == 100
+
+
+def test_backfilled_marker_is_persisted(tmp_path):
+    path = str(tmp_path / "bm25.db")
+    index = BM25Index(path)
+    index.upsert(["n1"], ["new upload"], [{"source": "n.txt", "chunk_index": 0}])
+    # Documents from a new ingest do not count as a backfill of older chunks
+    assert not index.backfilled
+
+    index.mark_backfilled()
+
+    assert BM25Index(path).backfilled
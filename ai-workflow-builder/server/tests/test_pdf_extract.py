@@ -0,0 +1,52 @@
+import asyncio
+
+import fitz
+
+import pdf_extract
+from pdf_extract import iter_pdf_pages
+
+
+def make_pdf(path, pages):
+    pdf = fitz.open()
+    for number in range(pages):
+        pdf.new_page().insert_text((72, 72), f"page {number + 1}")
+    pdf.save(path)
+    pdf.close()
+
+
+def test_pages_are_yielded_in_order(tmp_path):
+    path = str(tmp_path / "doc.pdf")
+    make_pdf(path, 12)
+
+    async def read():
+        return [(number, text.strip()) async for number, text in iter_pdf_pages(path, 2, 11, pages_per_task=3)]
+
+    pages = asyncio.run(read())
+
+    assert [number for number, _ in pages] == list(range(2, 12))
+    assert pages[0][1] == "page 2"
+
+
+def test_extraction_stays_a_bounded_window_ahead_of_the_reader(tmp_path, monkeypatch):
+    path = str(tmp_path / "doc.pdf")
+    make_pdf(path, 40)
+    started = []
+    extract_pages = pdf_extract.extract_pages
+
+    def counting_extract(path, first, last):
+        started.append(first)
+        return extract_pages(path, first, last)
+    monkeypatch.setattr(pdf_extract, "extract_pages", counting_extract)
+    monkeypatch.setattr(pdf_extract.pdf_executor, "run", lambda fn, *args: asyncio.to_thread(fn, *args))
+
+    async def read_one_page():
+        pages = iter_pdf_pages(path, pages_per_task=2, batches_ahead=3)
+        await pages.__anext__()
+        # Give any unbounded extraction time to run ahead
+        await asyncio.sleep(0.3)
+        await pages.aclose()
+
+    asyncio.run(read_one_page())
+
+    # 21 batches in total; only the window (plus the refill after the first) ever started
+    assert len(started) <= 4
@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+import pytest
+
+from benchmarks.fakes import FakeOpenAI
+from embeddings import embed_openai
+from providers import Provider, TokenBucket, openai_provider
+
+
+def test_token_bucket_waits_for_refill():
+    async def take(count):
+        # 10 tokens per second with room for one
+        bucket = TokenBucket(600, 0.1)
+        started = time.perf_counter()
+        waited = [await bucket.acquire() for _ in range(count)]
+        return time.perf_counter() - started, waited
+
+    elapsed, waited = asyncio.run(take(3))
+
+    assert waited[0] == 0
+    assert 0.15 <= elapsed < 1
+
+
+def test_oversized_request_drains_the_bucket_instead_of_hanging():
+    async def take():
+        bucket = TokenBucket(600, 0.1)
+        await asyncio.wait_for(bucket.acquire(50), 1)
+        return bucket.tokens
+
+    assert asyncio.run(take()) < 1
+
+
+def test_hedged_call_returns_the_faster_copy():
+    provider = Provider("openai")
+    provider.hedge_after = 0.05
+    started = []
+
+    async def slow_then_fast():
+        started.append(time.perf_counter())
+        await asyncio.sleep(1 if len(started) == 1 else 0)
+        return len(started)
+
+    async def run():
+        began = time.perf_counter()
+        result = await provider.call(slow_then_fast, hedge=True)
+        return result, time.perf_counter() - began
+
+    result, elapsed = asyncio.run(run())
+
+    assert result == 2
+    assert elapsed < 0.5
+    assert provider.hedged == 1 and provider.hedge_wins == 1
+    assert provider.in_flight == 0
+
+
+def test_timeouts_are_retried():
+    provider = Provider("serpapi")
+    provider.timeout = 0.05
+    calls = []
+
+    async def hangs_once():
+        calls.append(1)
+        if len(calls) == 1:
+            await asyncio.sleep(1)
+        return "ok"
+
+    assert asyncio.run(provider.call(hangs_once)) == "ok"
+    assert provider.timeouts == 1
+
+
+def test_gemini_has_no_pooled_client():
+    with pytest.raises(RuntimeError):
+        Provider("gemini").http_client()
+
+
+def test_openai_embeddings_go_through_the_provider():
+    calls = openai_provider.calls
+    vectors = asyncio.run(embed_openai(FakeOpenAI(embedding_latency_ms=0), ["provider routed text one", "two"]))
+
+    assert vectors.shape[0] == 2
+    assert openai_provider.calls == calls + 1
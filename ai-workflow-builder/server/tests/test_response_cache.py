@@ -0,0 +1,47 @@
+import numpy as np
+
+from response_cache import ResponseCache, response_key, semantic_scope, should_cache
+
+
+def key(prompt, temperature=0.0):
+    return response_key("gpt-4o-mini", "Be brief.", prompt, temperature, 200)
+
+
+def test_exact_hits_need_the_same_request():
+    cache = ResponseCache(10, 0)
+    cache.store(key("What is RAG?"), {"response": "cached"})
+
+    assert cache.lookup(key("What is RAG?")) == ({"response": "cached"}, "exact")
+    assert cache.lookup(key("What is RAG?", temperature=0.5)) == (None, None)
+    assert cache.lookup(key("What is rag?")) == (None, None)
+    assert cache.stats()["exact_hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_semantic_hits_stay_within_their_scope():
+    cache = ResponseCache(10, 0)
+    scope = semantic_scope("gpt-4o-mini", "Be brief.", 0.0, 200, "context A")
+    other = semantic_scope("gpt-4o-mini", "Be brief.", 0.0, 200, "context B")
+    cache.store(key("What is RAG?"), {"response": "cached"}, scope, np.array([1.0, 0.0]))
+
+    close = np.array([0.99, 0.05])
+    assert cache.lookup(key("Explain RAG"), scope, close) == ({"response": "cached"}, "semantic")
+    # Same question against different retrieved context is not a hit
+    assert cache.lookup(key("Explain RAG"), other, close) == (None, None)
+    assert cache.lookup(key("Unrelated"), scope, np.array([0.0, 1.0])) == (None, None)
+
+
+def test_evicted_entries_leave_the_semantic_index():
+    cache = ResponseCache(1, 0)
+    scope = semantic_scope("gpt-4o-mini", "", 0.0, 200, None)
+    cache.store(key("first"), {"response": "1"}, scope, np.array([1.0, 0.0]))
+    cache.store(key("second"), {"response": "2"}, scope, np.array([0.0, 1.0]))
+
+    assert cache.lookup(key("again"), scope, np.array([1.0, 0.0])) == (None, None)
+    assert cache.semantic.scopes[scope] == {key("second")}
+
+
+def test_only_deterministic_calls_are_cached_by_default():
+    assert should_cache(0)
+    assert not should_cache(0.7)
+    assert should_cache(0.7, enabled=True)
+    assert not should_cache(0, enabled=False)
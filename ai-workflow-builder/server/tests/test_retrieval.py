@@ -0,0 +1,46 @@
+import asyncio
+
+import retrieval
+from benchmarks.fakes import FakeEmbeddingModel
+from retrieval import retrieve
+from vector_store import VectorStore
+
+DOCUMENTS = {
+    "err": "Troubleshooting: error code ERR-4711 means the pump overheated.",
+    "pump": "General notes about pumps and valves.",
+    "valve": "Valve maintenance schedule."
+}
+
+
+def test_keyword_search_falls_back_to_vector_until_backfilled(tmp_path):
+    model = FakeEmbeddingModel(ms_per_text=0)
+    store = VectorStore(str(tmp_path))
+    # Chunks stored before the collection had a keyword index
+    store.client.create_collection("legacy").add(
+        ids=list(DOCUMENTS),
+        documents=list(DOCUMENTS.values()),
+        embeddings=model.encode(list(DOCUMENTS.values())).tolist(),
+        metadatas=[{"source": doc_id} for doc_id in DOCUMENTS]
+    )
+    collection = store.get_collection("legacy")
+
+    async def run():
+        search = retrieve(store, collection, model, "fake", "ERR-4711", 1, mode="keyword")
+        first = await asyncio.gather(search, retrieve(store, collection, model, "fake", "ERR-4711", 1, mode="hybrid"))
+        backfill = retrieval._backfills["legacy"]
+        await backfill
+        return first, backfill, await retrieve(store, collection, model, "fake", "ERR-4711", 1, mode="keyword")
+
+    first, backfill, after = asyncio.run(run())
+
+    # Both first searches were answered by vector search and shared one backfill
+    assert all(hits and "bm25_score" not in hits[0] for hits in first)
+    assert backfill.done() and store.get_keyword_index("legacy").backfilled
+    assert after[0]["id"] == "err" and "bm25_score" in after[0]
+
+
+def test_new_collections_need_no_backfill(tmp_path):
+    store = VectorStore(str(tmp_path))
+    store.get_collection("fresh")
+
+    assert store.get_keyword_index("fresh").backfilled
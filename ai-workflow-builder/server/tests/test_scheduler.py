@@ -0,0 +1,91 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+
+
+def workflow(nodes, edges, **extra):
+    return {
+        "id": "scheduler-test",
+        "nodes": [{"id": node_id, "type": node_type, "data": {}} for node_id, node_type in nodes],
+        "edges": [{"id": f"{source}-{target}", "source": source, "target": target} for source, target in edges],
+        **extra
+    }
+
+
+class FakeNodes:
+    """Stands in for execute_single_node, recording start order and overlap"""
+
+    def __init__(self):
+        self.started = []
+        self.finished = []
+        self.running = 0
+        self.max_running = 0
+
+    async def __call__(self, node, query, inputs, on_token=None, config=None, raise_errors=False):
+        self.started.append(node["id"])
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        self.finished.append(node["id"])
+        return f"{node['id']}({','.join(sorted(str(item['value']) for item in inputs))})"
+
+
+def run(monkeypatch, plan_workflow):
+    nodes = FakeNodes()
+    monkeypatch.setattr(main, "execute_single_node", nodes)
+    plan = main.get_plan(plan_workflow)
+    assert not plan["errors"]
+    result = asyncio.run(main.execute_workflow_graph(plan, "hi"))
+    return result, nodes
+
+
+def test_nodes_run_after_their_dependencies(monkeypatch):
+    result, nodes = run(monkeypatch, workflow(
+        [("q", "userQuery"), ("a", "knowledgeBase"), ("b", "knowledgeBase"), ("l", "llmEngine"), ("o", "output")],
+        [("q", "a"), ("q", "b"), ("a", "l"), ("b", "l"), ("l", "o")]
+    ))
+
+    assert result == "o(l(a(q()),b(q())))"
+    assert nodes.started[0] == "q"
+    # The LLM waits for both branches, which run side by side
+    assert nodes.started.index("l") > max(nodes.finished.index("a"), nodes.finished.index("b"))
+    assert nodes.max_running == 2
+
+
+def test_max_concurrency_limits_parallel_nodes(monkeypatch):
+    branches = [f"k{i}" for i in range(5)]
+    _, nodes = run(monkeypatch, workflow(
+        [("q", "userQuery"), ("o", "output")] + [(branch, "knowledgeBase") for branch in branches],
+        [("q", branch) for branch in branches] + [(branch, "o") for branch in branches],
+        maxConcurrency=2
+    ))
+
+    assert sorted(nodes.started[1:-1]) == branches
+    assert nodes.max_running == 2
+
+
+def test_nodes_not_feeding_an_output_are_skipped(monkeypatch):
+    result, nodes = run(monkeypatch, workflow(
+        [("q", "userQuery"), ("a", "knowledgeBase"), ("stray", "llmEngine"), ("lonely", "llmEngine"), ("o", "output")],
+        [("q", "a"), ("a", "o"), ("q", "stray")]
+    ))
+
+    assert result == "o(a(q()))"
+    assert sorted(nodes.started) == ["a", "o", "q"]
+
+
+def test_cycles_are_rejected_with_400():
+    cyclic = workflow(
+        [("q", "userQuery"), ("a", "knowledgeBase"), ("l", "llmEngine"), ("o", "output")],
+        [("q", "a"), ("a", "l"), ("l", "a"), ("l", "o")]
+    )
+
+    response = client.post("/execute-workflow/", json={"workflow": cyclic, "query": "hi"})
+
+    assert response.status_code == 400
+    assert "cycle" in response.json()["detail"].lower()
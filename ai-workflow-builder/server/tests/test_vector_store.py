@@ -0,0 +1,39 @@
+import asyncio
+import gc
+
+from vector_store import VectorStore
+
+
+def test_hnsw_settings_of_an_existing_collection_are_kept(tmp_path, capsys):
+    store = VectorStore(str(tmp_path))
+    created = store.get_collection("docs", {"hnswM": 32, "hnswEfSearch": 100})
+    assert created.metadata["hnsw:M"] == 32
+    assert capsys.readouterr().out == ""
+
+    collection = VectorStore(str(tmp_path)).get_collection("docs", {"hnswM": 32, "hnswEfSearch": 200})
+
+    assert collection.metadata["hnsw:search_ef"] == 100
+    output = capsys.readouterr().out
+    assert "hnswEfSearch=200 (collection has 100)" in output
+    assert "hnswM" not in output
+
+
+def test_concurrent_queries_are_coalesced_into_one_call(tmp_path):
+    store = VectorStore(str(tmp_path))
+    collection = store.get_collection("docs")
+    collection.add(ids=["a", "b"], embeddings=[[1.0, 0.0], [0.0, 1.0]], documents=["a", "b"])
+
+    async def run():
+        results = asyncio.gather(
+            store.query(collection, [1.0, 0.0], 1),
+            store.query(collection, [0.0, 1.0], 1)
+        )
+        await asyncio.sleep(0)
+        gc.collect()
+        return await asyncio.wait_for(results, 5)
+
+    first, second = asyncio.run(run())
+
+    assert first["ids"] == [["a"]] and second["ids"] == [["b"]]
+    assert store.batched_queries == 1
+    assert not store._flushes
@@ -0,0 +1,21 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+
+MALFORMED = [
+    {"nodes": [{"type": "userQuery"}], "edges": []},
+    {"nodes": [{"id": "q", "type": "userQuery"}], "edges": [{"id": "e", "source": "q"}]},
+    {"nodes": ["not a node"], "edges": []}
+]
+
+
+@pytest.mark.parametrize("workflow", MALFORMED)
+@pytest.mark.parametrize("path", ["/execute-workflow/", "/execute-workflow/stream", "/jobs/execute-workflow/"])
+def test_malformed_workflows_are_rejected_with_400(path, workflow):
+    response = client.post(path, json={"workflow": workflow, "query": "hi"})
+
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Invalid workflow")
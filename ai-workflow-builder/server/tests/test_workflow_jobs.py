@@ -0,0 +1,67 @@
+import asyncio
+
+import main
+from jobs import JobQueue
+
+WORKFLOW = {
+    "id": "job-test",
+    "nodes": [
+        {"id": "q", "type": "userQuery", "data": {}},
+        {"id": "l", "type": "llmEngine", "data": {"config": {"model": "gpt-4o-mini", "dedupContext": False, "cache": False}}},
+        {"id": "o", "type": "output", "data": {}}
+    ],
+    "edges": [
+        {"id": "e1", "source": "q", "target": "l"},
+        {"id": "e2", "source": "l", "target": "o"}
+    ]
+}
+
+
+def run_job(tmp_path):
+    async def run():
+        queue = JobQueue(str(tmp_path / "jobs.db"), workers=0)
+        queue.register("execute-workflow", main._execute_workflow_job)
+        job = await queue.submit("execute-workflow", {"workflow": WORKFLOW, "query": "hello"}, max_attempts=3)
+        await queue._run(queue.store.claim(queue.worker_id, 60))
+        return await queue.get(job["id"]), queue
+    return asyncio.run(run())
+
+
+def test_unavailable_model_fails_the_job(tmp_path, monkeypatch):
+    async def unavailable(model):
+        raise main.LLMNotAvailable(f"Model {model} not available")
+    monkeypatch.setattr(main, "check_llm_available", unavailable)
+
+    job, queue = run_job(tmp_path)
+
+    assert job["status"] == "failed"
+    assert "not available" in job["error"]
+    assert queue.failed == 1
+
+
+def test_transient_llm_error_is_retried(tmp_path, monkeypatch):
+    async def available(model):
+        return object()
+
+    async def times_out(*args, **kwargs):
+        raise TimeoutError("provider timed out")
+        yield
+    monkeypatch.setattr(main, "check_llm_available", available)
+    # Job runs stream LLM nodes that feed an output node
+    monkeypatch.setattr(main, "stream_llm", times_out)
+
+    job, queue = run_job(tmp_path)
+
+    assert job["status"] == "queued"
+    assert "retrying" in job["error"]
+    assert queue.retried == 1
+
+
+def test_interactive_runs_still_return_errors_as_output(monkeypatch):
+    async def unavailable(model):
+        raise main.LLMNotAvailable(f"Model {model} not available")
+    monkeypatch.setattr(main, "check_llm_available", unavailable)
+
+    result = asyncio.run(main.execute_workflow_graph(main.get_plan(WORKFLOW), "hello"))
+
+    assert result == "LLM model gpt-4o-mini not available."
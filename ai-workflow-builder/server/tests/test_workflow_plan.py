@@ -0,0 +1,56 @@
+import workflow_plan
+from workflow_plan import WorkflowRegistry, compile_workflow
+
+
+def workflow(**extra):
+    return {
+        "id": "w",
+        "nodes": [
+            {"id": "q", "type": "userQuery", "data": {}},
+            {"id": "o", "type": "output", "data": {}}
+        ],
+        "edges": [{"id": "e", "source": "q", "target": "o"}],
+        **extra
+    }
+
+
+def test_invalid_max_concurrency_is_a_validation_error():
+    plan = compile_workflow(workflow(maxConcurrency="abc"))
+
+    assert any("maxConcurrency" in error for error in plan["errors"])
+    assert plan["max_concurrency"] == workflow_plan.WORKFLOW_MAX_CONCURRENCY
+    assert compile_workflow(workflow(maxConcurrency="2"))["max_concurrency"] == 2
+
+
+def test_registered_workflows_are_shared_between_processes(tmp_path):
+    path = str(tmp_path / "workflows.db")
+    registry = WorkflowRegistry(path)
+    registry.put("plan-1", workflow())
+
+    # A second process opening the same file sees the workflow
+    assert WorkflowRegistry(path).get("plan-1") == workflow()
+    assert WorkflowRegistry(path).get("missing") is None
+    assert len(registry) == 1
+
+
+def test_llm_max_tokens_is_not_defaulted():
+    plan = compile_workflow({
+        "nodes": [
+            {"id": "q", "type": "userQuery", "data": {}},
+            {"id": "l", "type": "llmEngine", "data": {"config": {"model": "gpt-4o"}}}
+        ],
+        "edges": [{"id": "e", "source": "q", "target": "l"}]
+    })
+
+    # Left unset so the completion size comes from LLM_DEFAULT_MAX_TOKENS
+    assert "maxTokens" not in plan["configs"]["l"]
+
+
+def test_nodes_and_edges_missing_keys_are_validation_errors():
+    plan = compile_workflow({
+        "nodes": [{"type": "userQuery"}, {"id": "o", "type": "output"}],
+        "edges": [{"id": "e", "source": "o"}]
+    })
+
+    assert "Node at position 0 has no id" in plan["errors"]
+    assert "Edge e has no source or target" in plan["errors"]
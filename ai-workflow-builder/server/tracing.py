@@ -0,0 +1,352 @@
+"""Tracing spans, Prometheus metrics and a JSONL trace log.
+
+Wrap work in `with span("name", **attributes):`. Spans nest through
+context variables, so spans opened inside tasks started by a traced
+request attach to that request's trace. Every finished span is observed
+in the span_duration_seconds histogram whether or not a trace is being
+recorded; start_trace() additionally collects the spans of one request
+and appends them to TRACE_LOG_PATH.
+
+Summarise a trace log with:
+
+    python tracing.py traces.jsonl
+"""
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "./traces.jsonl")
+TRACE_LOG_MAX_BYTES = int(os.getenv("TRACE_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+# Include workflow JSON and queries in the log so runs can be replayed
+TRACE_LOG_PAYLOADS = os.getenv("TRACE_LOG_PAYLOADS", "false").lower() == "true"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Prometheus histogram with a fixed label set"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple, List[Any]] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    bucket_labels = _labels(self.labelnames, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+                bucket_labels = _labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Counter:
+    """Prometheus counter with a fixed label set"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str]):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        if not amount:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+def render_gauge(name: str, help_text: str, samples: Iterable[Tuple[Dict[str, Any], float]]) -> List[str]:
+    """Gauge lines for values computed at scrape time"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {value}")
+    return lines
+
+
+span_duration = Histogram(
+    "span_duration_seconds",
+    "Wall time of traced operations by span name, node type and model",
+    ("span", "node_type", "model")
+)
+span_errors = Counter("span_errors_total", "Traced operations that raised", ("span", "node_type", "model"))
+executor_queue_wait = Histogram(
+    "executor_queue_wait_seconds",
+    "Time calls waited for a worker in each executor pool",
+    ("pool",)
+)
+llm_tokens = Counter("llm_tokens_total", "LLM tokens used by model and kind", ("model", "kind"))
+cache_lookups = Counter("cache_lookups_total", "Cache lookups by cache and result", ("cache", "result"))
+
+METRICS = [span_duration, span_errors, executor_queue_wait, llm_tokens, cache_lookups]
+
+
+def render_metrics(extra_lines: Iterable[str] = ()) -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
+
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+
+class Span:
+    """One timed operation; use as a context manager"""
+
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        parent = _current_span.get()
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.trace = _current_trace.get()
+        self.attributes = dict(attributes or {})
+        self.queue_wait = 0.0
+        self.started_at: Optional[float] = None
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add_queue_wait(self, seconds: float):
+        self.queue_wait += seconds
+
+    def __enter__(self) -> "Span":
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._start
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Exited from a different context (e.g. an abandoned async generator)
+            pass
+        labels = {
+            "span": self.name,
+            "node_type": self.attributes.get("node_type", ""),
+            "model": self.attributes.get("model", "")
+        }
+        span_duration.observe(self.duration, **labels)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+            span_errors.inc(**labels)
+        if self.trace is not None:
+            self.trace.spans.append(self)
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "started_at": self.started_at,
+            "duration_ms": round(1000 * self.duration, 3) if self.duration is not None else None,
+            "queue_wait_ms": round(1000 * self.queue_wait, 3),
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+
+def span(name: str, **attributes) -> Span:
+    return Span(name, attributes)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def annotate(**attributes):
+    """Add attributes to the innermost open span, if any"""
+    active = _current_span.get()
+    if active is not None:
+        active.set(**attributes)
+
+
+def record_queue_wait(pool: str, seconds: float):
+    """Called by the executor pools for every call they run"""
+    executor_queue_wait.observe(seconds, pool=pool)
+    active = _current_span.get()
+    if active is not None:
+        active.add_queue_wait(seconds)
+
+
+def record_tokens(model: str, usage: Optional[Dict[str, Any]]):
+    """Count token usage and attach it to the current span"""
+    if not usage:
+        return
+    prompt = usage.get("prompt_tokens") or 0
+    completion = usage.get("completion_tokens") or 0
+    llm_tokens.inc(prompt, model=model, kind="prompt")
+    llm_tokens.inc(completion, model=model, kind="completion")
+    annotate(prompt_tokens=prompt, completion_tokens=completion, total_tokens=usage.get("total_tokens") or prompt + completion)
+
+
+def record_cache(cache: str, hits: int, misses: int = 0):
+    cache_lookups.inc(hits, cache=cache, result="hit")
+    cache_lookups.inc(misses, cache=cache, result="miss")
+
+
+def payload_size(value: Any) -> int:
+    """Approximate payload size in bytes for span attributes"""
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if not isinstance(value, str):
+        value = json.dumps(value, default=str)
+    return len(value.encode("utf-8"))
+
+
+class Trace:
+    """Spans recorded for one request"""
+
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.spans: List[Span] = []
+        self.root: Optional[Span] = None
+        self.payload: Optional[Dict[str, Any]] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.root.started_at if self.root else None,
+            "duration_ms": round(1000 * self.root.duration, 3) if self.root and self.root.duration is not None else None,
+            "spans": [recorded.to_dict() for recorded in sorted(self.spans, key=lambda s: s.started_at or 0)]
+        }
+
+
+@contextmanager
+def start_trace(name: str, payload: Optional[Dict[str, Any]] = None, **attributes) -> Iterator[Trace]:
+    """Record every span opened inside the block and log the trace when it ends"""
+    trace = Trace(name)
+    trace.payload = payload
+    token = _current_trace.set(trace)
+    try:
+        with Span(name, attributes) as root:
+            trace.root = root
+            yield trace
+    finally:
+        _current_trace.reset(token)
+        write_trace(trace)
+
+
+_log_queue: "queue.SimpleQueue[str]" = queue.SimpleQueue()
+_writer: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+
+
+def _write_lines():
+    while True:
+        line = _log_queue.get()
+        try:
+            if os.path.exists(TRACE_LOG_PATH) and os.path.getsize(TRACE_LOG_PATH) > TRACE_LOG_MAX_BYTES:
+                os.replace(TRACE_LOG_PATH, f"{TRACE_LOG_PATH}.1")
+            with open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(line)
+        except Exception as e:
+            print(f"Warning: Could not write trace log: {e}")
+
+
+def write_trace(trace: Trace):
+    """Queue the trace for the background log writer; disabled when TRACE_LOG_PATH is empty"""
+    global _writer
+    if not TRACE_LOG_PATH:
+        return
+    record = trace.to_dict()
+    if TRACE_LOG_PAYLOADS and trace.payload:
+        record["payload"] = trace.payload
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = threading.Thread(target=_write_lines, name="trace-log", daemon=True)
+                _writer.start()
+    _log_queue.put(json.dumps(record, default=str) + "\n")
+
+
+def load_traces(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def summarize(traces: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """Count and p50/p95/max duration per span name (and node type or model)"""
+    durations: Dict[str, List[float]] = {}
+    for trace in traces:
+        for recorded in trace["spans"]:
+            attributes = recorded.get("attributes", {})
+            label = " ".join(filter(None, (recorded["name"], attributes.get("node_type"), attributes.get("model"))))
+            if recorded.get("duration_ms") is not None:
+                durations.setdefault(label, []).append(recorded["duration_ms"])
+    summary = {}
+    for label, values in sorted(durations.items()):
+        values.sort()
+        summary[label] = {
+            "count": len(values),
+            "p50_ms": values[len(values) // 2],
+            "p95_ms": values[min(len(values) - 1, int(len(values) * 0.95))],
+            "max_ms": values[-1]
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else TRACE_LOG_PATH
+    for label, stats in summarize(load_traces(path)).items():
+        print(f"{label:50s} n={stats['count']:<6d} p50={stats['p50_ms']:.1f}ms p95={stats['p95_ms']:.1f}ms max={stats['max_ms']:.1f}ms")
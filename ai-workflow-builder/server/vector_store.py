@@ -0,0 +1,193 @@
+"""Persistent ChromaDB collections with HNSW settings and batched queries"""
+import asyncio
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from executors import vectorstore_executor
+from keyword_index import BM25Index
+from tracing import annotate, span
+
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_db")
+DEFAULT_COLLECTION = os.getenv("CHROMA_COLLECTION", "documents")
+HNSW_SPACE = os.getenv("HNSW_SPACE", "cosine")
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+QUERY_BATCH_WINDOW_MS = float(os.getenv("VECTOR_QUERY_BATCH_WINDOW_MS", "2"))
+
+QUERY_INCLUDE = ["documents", "metadatas", "distances"]
+
+_INVALID_NAME_CHARS = re.compile(r"[^a-zA-Z0-9._-]+")
+# Node/request config key -> Chroma collection metadata key
+HNSW_CONFIG_KEYS = {
+    "hnswSpace": "hnsw:space",
+    "hnswM": "hnsw:M",
+    "hnswEfConstruction": "hnsw:construction_ef",
+    "hnswEfSearch": "hnsw:search_ef"
+}
+
+
+def collection_name(name: Optional[str]) -> str:
+    """Turn a workflow id or label into a valid Chroma collection name"""
+    if not name:
+        return DEFAULT_COLLECTION
+    cleaned = _INVALID_NAME_CHARS.sub("-", name).strip("-._")[:63].rstrip("-._")
+    return cleaned if len(cleaned) >= 3 else f"wf-{cleaned or 'default'}"
+
+
+def hnsw_metadata(config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Chroma collection metadata for the HNSW settings in a node or request config"""
+    config = config or {}
+    return {
+        "hnsw:space": config.get("hnswSpace", HNSW_SPACE),
+        "hnsw:M": int(config.get("hnswM", HNSW_M)),
+        "hnsw:construction_ef": int(config.get("hnswEfConstruction", HNSW_EF_CONSTRUCTION)),
+        "hnsw:search_ef": int(config.get("hnswEfSearch", HNSW_EF_SEARCH))
+    }
+
+
+class VectorStore:
+    """Persistent Chroma client with cached collection handles.
+
+    HNSW settings only take effect when a collection is first created
+    (the default collection is created by the startup warm-up with the
+    env settings); Chroma does not allow changing them afterwards, so
+    differing settings for an existing collection are ignored with a
+    warning.
+    """
+
+    def __init__(self, path: str = CHROMA_PATH):
+        # Imported here so that importing this module does not load chromadb
+        import chromadb
+        self.client = chromadb.PersistentClient(path=path)
+        self.path = path
+        self._collections: Dict[str, Any] = {}
+        self._keyword_indexes: Dict[str, BM25Index] = {}
+        self._pending: Dict[Tuple[str, str], List[Tuple[List[float], int, asyncio.Future]]] = {}
+        self._hnsw_warnings = set()
+        self._flushes: Set[asyncio.Task] = set()
+        self.queries = 0
+        self.batched_queries = 0
+
+    def get_collection(self, name: Optional[str] = None, config: Optional[Dict[str, Any]] = None) -> Any:
+        name = collection_name(name)
+        collection = self._collections.get(name)
+        if collection is None:
+            try:
+                collection = self.client.get_collection(name)
+            except Exception:
+                collection = self.client.get_or_create_collection(name, metadata=hnsw_metadata(config))
+                # A new collection has nothing to backfill into its keyword index
+                if collection.count() == 0:
+                    self.get_keyword_index(name).mark_backfilled()
+            self._collections[name] = collection
+        if config:
+            self._check_hnsw(collection, config)
+        return collection
+
+    def _check_hnsw(self, collection: Any, config: Dict[str, Any]):
+        """Warn when config asks for HNSW settings the existing collection does not have"""
+        requested = hnsw_metadata(config)
+        current = collection.metadata or {}
+        ignored = tuple(
+            f"{key}={requested[metadata_key]} (collection has {current.get(metadata_key)})"
+            for key, metadata_key in HNSW_CONFIG_KEYS.items()
+            if config.get(key) not in (None, "") and current.get(metadata_key) != requested[metadata_key]
+        )
+        if not ignored:
+            return
+        annotate(hnsw_ignored=", ".join(ignored))
+        if (collection.name, ignored) not in self._hnsw_warnings:
+            self._hnsw_warnings.add((collection.name, ignored))
+            print(
+                f"Warning: collection {collection.name} already exists and keeps its HNSW settings; "
+                f"ignoring {', '.join(ignored)}"
+            )
+
+    def get_keyword_index(self, name: Optional[str] = None) -> BM25Index:
+        """BM25 index for a collection, stored under <path>/bm25/"""
+        name = collection_name(name)
+        index = self._keyword_indexes.get(name)
+        if index is None:
+            index = self._keyword_indexes[name] = BM25Index(os.path.join(self.path, "bm25", f"{name}.db"))
+        return index
+
+    async def query_many(
+        self,
+        collection: Any,
+        embeddings: List[List[float]],
+        n_results: int,
+        where: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Run one collection.query for several query embeddings"""
+        self.queries += len(embeddings)
+        self.batched_queries += 1
+        with span("chroma.query_many", collection=collection.name, queries=len(embeddings), n_results=n_results):
+            return await vectorstore_executor.run(
+                collection.query,
+                query_embeddings=embeddings,
+                n_results=n_results,
+                where=where or None,
+                include=QUERY_INCLUDE
+            )
+
+    async def query(
+        self,
+        collection: Any,
+        embedding: List[float],
+        n_results: int,
+        where: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Query one embedding, coalesced with concurrent queries on the same collection and filter.
+
+        Requests arriving within QUERY_BATCH_WINDOW_MS of each other go out
+        as a single multi-embedding collection.query. The result has the
+        same single-query shape as collection.query.
+        """
+        key = (collection.name, json.dumps(where or {}, sort_keys=True))
+        with span("chroma.query", collection=collection.name, n_results=n_results) as query_span:
+            future = asyncio.get_running_loop().create_future()
+            batch = self._pending.get(key)
+            if batch is None:
+                batch = self._pending[key] = []
+                # The loop only holds weak references to tasks, so keep one until the flush is done
+                task = asyncio.ensure_future(self._flush(key, collection, where))
+                self._flushes.add(task)
+                task.add_done_callback(self._flushes.discard)
+            batch.append((embedding, n_results, future))
+            result = await future
+            query_span.set(batch_size=len(batch), results=len(result["ids"][0]))
+            return result
+
+    async def _flush(self, key: Tuple[str, str], collection: Any, where: Optional[Dict[str, Any]]):
+        await asyncio.sleep(QUERY_BATCH_WINDOW_MS / 1000)
+        batch = self._pending.pop(key)
+        try:
+            results = await self.query_many(
+                collection,
+                [embedding for embedding, _, _ in batch],
+                max(n_results for _, n_results, _ in batch),
+                where
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for index, (_, n_results, future) in enumerate(batch):
+            if not future.done():
+                future.set_result({
+                    field: [results[field][index][:n_results]] if results.get(field) else results.get(field)
+                    for field in ("ids", *QUERY_INCLUDE)
+                })
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "collections": len(self._collections),
+            "keyword_indexes": {name: index.stats() for name, index in self._keyword_indexes.items()},
+            "queries": self.queries,
+            "collection_queries": self.batched_queries
+        }
@@ -0,0 +1,299 @@
+"""Compile workflow JSON into cached, immutable execution plans"""
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional
+
+from caching import LRUCache
+
+WORKFLOW_MAX_CONCURRENCY = int(os.getenv("WORKFLOW_MAX_CONCURRENCY", "8"))
+WORKFLOW_PLAN_CACHE_SIZE = int(os.getenv("WORKFLOW_PLAN_CACHE_SIZE", "1000"))
+WORKFLOW_REGISTRY_PATH = os.getenv("WORKFLOW_REGISTRY_PATH", "./workflows.db")
+
+# Defaults applied to each node's data.config at compile time
+NODE_CONFIG_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "userQuery": {},
+    "knowledgeBase": {
+        "nResults": 3
+    },
+    "llmEngine": {
+        "model": "gpt-3.5-turbo",
+        "temperature": 0.7,
+        "customPrompt": "You are a helpful AI assistant."
+        # maxTokens is left unset so LLM_DEFAULT_MAX_TOKENS applies
+    },
+    "output": {}
+}
+
+
+def build_execution_graph(nodes: Dict, edges: List[Dict]) -> Dict:
+    """Build execution graph from nodes and edges.
+
+    Returns the per-node dependency map under "nodes" and a topological
+    order (Kahn's algorithm) under "order". Raises ValueError on cycles.
+    """
+    graph = {}
+
+    # Initialize graph
+    for node_id in nodes:
+        graph[node_id] = {
+            "node": nodes[node_id],
+            "dependencies": [],
+            "dependents": []
+        }
+
+    # Add edges
+    for edge in edges:
+        source = edge["source"]
+        target = edge["target"]
+
+        if source in graph and target in graph:
+            graph[source]["dependents"].append(target)
+            graph[target]["dependencies"].append(source)
+
+    # Topological sort (Kahn's algorithm)
+    in_degree = {node_id: len(data["dependencies"]) for node_id, data in graph.items()}
+    ready = deque(node_id for node_id, degree in in_degree.items() if degree == 0)
+    order = []
+
+    while ready:
+        node_id = ready.popleft()
+        order.append(node_id)
+        for dependent in graph[node_id]["dependents"]:
+            in_degree[dependent] -= 1
+            if in_degree[dependent] == 0:
+                ready.append(dependent)
+
+    if len(order) != len(graph):
+        cyclic = sorted(node_id for node_id, degree in in_degree.items() if degree > 0)
+        raise ValueError(f"Workflow contains a cycle involving nodes: {', '.join(cyclic)}")
+
+    return {"nodes": graph, "order": order}
+
+
+def workflow_hash(workflow: Dict[str, Any]) -> str:
+    """Content hash of everything that affects execution.
+
+    Canvas positions and other UI-only fields are ignored so that dragging
+    nodes around does not invalidate the plan.
+    """
+    canonical = {
+        "id": workflow.get("id"),
+        "nodes": sorted(
+            (
+                {
+                    "id": node.get("id"),
+                    "type": node.get("type"),
+                    "config": node.get("data", {}).get("config", {})
+                }
+                for node in workflow.get("nodes", [])
+            ),
+            key=lambda node: str(node["id"])
+        ),
+        "edges": sorted(
+            [
+                str(edge.get("source")),
+                str(edge.get("target")),
+                edge.get("sourceHandle") or "",
+                edge.get("targetHandle") or ""
+            ]
+            for edge in workflow.get("edges", [])
+        ),
+        "maxConcurrency": workflow.get("maxConcurrency")
+    }
+    encoded = json.dumps(canonical, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def compile_workflow(workflow: Dict[str, Any], plan_hash: Optional[str] = None) -> Mapping[str, Any]:
+    """Turn workflow JSON into an execution plan.
+
+    The plan holds the topological order, the part of it that feeds an
+    output node (run_order), resolved per-node configs, each node's direct
+    inputs, start and output nodes and any validation errors.
+    Validation problems are collected rather than raised so a plan can be
+    registered and inspected.
+    """
+    workflow = copy.deepcopy(workflow)
+    errors = []
+    nodes = {}
+    for position, node in enumerate(workflow.get("nodes", [])):
+        if not node.get("id"):
+            errors.append(f"Node at position {position} has no id")
+        else:
+            nodes[node["id"]] = node
+    edges = []
+    for position, edge in enumerate(workflow.get("edges", [])):
+        if not edge.get("source") or not edge.get("target"):
+            errors.append(f"Edge {edge.get('id', position)} has no source or target")
+        else:
+            edges.append(edge)
+
+    max_concurrency = WORKFLOW_MAX_CONCURRENCY
+    if workflow.get("maxConcurrency") not in (None, ""):
+        try:
+            max_concurrency = int(workflow["maxConcurrency"])
+        except (TypeError, ValueError):
+            errors.append(f"maxConcurrency must be an integer, got {workflow['maxConcurrency']!r}")
+
+    for edge in edges:
+        for end in ("source", "target"):
+            if edge.get(end) not in nodes:
+                errors.append(f"Edge {edge.get('id', '?')} references unknown node {edge.get(end)}")
+
+    configs = {}
+    for node_id, node in nodes.items():
+        node_type = node.get("type")
+        if node_type not in NODE_CONFIG_DEFAULTS:
+            errors.append(f"Node {node_id} has unknown type {node_type}")
+        config = dict(NODE_CONFIG_DEFAULTS.get(node_type, {}))
+        config.update({
+            key: value for key, value in node.get("data", {}).get("config", {}).items()
+            if value not in (None, "")
+        })
+        configs[node_id] = MappingProxyType(config)
+
+    try:
+        graph = build_execution_graph(nodes, edges)
+    except ValueError as e:
+        errors.append(str(e))
+        graph = {"nodes": build_execution_graph(nodes, [])["nodes"], "order": []}
+
+    start_nodes = tuple(
+        node_id for node_id, data in graph["nodes"].items()
+        if data["node"].get("type") == "userQuery" and not data["dependencies"]
+    )
+    if not start_nodes:
+        errors.append("No start node found")
+
+    # Typed input wiring: each node sees only its direct predecessors, labelled by handle
+    wiring = {node_id: [] for node_id in nodes}
+    for edge in edges:
+        if edge.get("source") in nodes and edge.get("target") in nodes:
+            wiring[edge["target"]].append(MappingProxyType({
+                "source": edge["source"],
+                "source_type": nodes[edge["source"]].get("type"),
+                "source_handle": edge.get("sourceHandle"),
+                "target_handle": edge.get("targetHandle")
+            }))
+
+    output_nodes = tuple(
+        node_id for node_id in graph["order"]
+        if graph["nodes"][node_id]["node"].get("type") == "output"
+    )
+
+    # Only nodes that feed an output node run; disconnected nodes would only cost time and API calls
+    needed = set(output_nodes)
+    for node_id in reversed(graph["order"]):
+        if node_id in needed:
+            needed.update(graph["nodes"][node_id]["dependencies"])
+    run_order = tuple(node_id for node_id in graph["order"] if node_id in needed)
+
+    return MappingProxyType({
+        "hash": plan_hash or workflow_hash(workflow),
+        "workflow_id": workflow.get("id", "unknown"),
+        "nodes": MappingProxyType(nodes),
+        "graph": graph,
+        "order": tuple(graph["order"]),
+        "run_order": run_order,
+        "configs": MappingProxyType(configs),
+        "inputs": MappingProxyType({node_id: tuple(edges_in) for node_id, edges_in in wiring.items()}),
+        "start_nodes": start_nodes,
+        "output_nodes": output_nodes,
+        "max_concurrency": max_concurrency or WORKFLOW_MAX_CONCURRENCY,
+        "errors": tuple(errors)
+    })
+
+
+plan_cache = LRUCache(WORKFLOW_PLAN_CACHE_SIZE)
+plan_cache_hits = 0
+plan_cache_misses = 0
+
+
+def get_plan(workflow: Dict[str, Any]) -> Mapping[str, Any]:
+    """Compiled plan for workflow, reusing the cached one when unchanged"""
+    global plan_cache_hits, plan_cache_misses
+    plan_hash = workflow_hash(workflow)
+    plan = plan_cache.get(plan_hash)
+    if plan is not None:
+        plan_cache_hits += 1
+        return plan
+    plan_cache_misses += 1
+    plan = compile_workflow(workflow, plan_hash)
+    plan_cache.put(plan_hash, plan)
+    return plan
+
+
+class WorkflowRegistry:
+    """Registered workflow JSON by plan id, kept in SQLite so every process can run it.
+
+    Entries are never evicted; the compiled plans themselves live in the
+    plan cache and are recompiled from here when they have been evicted.
+    """
+
+    def __init__(self, path: str = WORKFLOW_REGISTRY_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS workflows (plan_id TEXT PRIMARY KEY, workflow TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+
+    def put(self, plan_id: str, workflow: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO workflows (plan_id, workflow, created_at) VALUES (?, ?, ?)",
+                (plan_id, json.dumps(workflow, default=str), time.time())
+            )
+
+    def get(self, plan_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT workflow FROM workflows WHERE plan_id = ?", (plan_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM workflows").fetchone()[0]
+
+
+_registry: Optional[WorkflowRegistry] = None
+
+
+def workflow_registry() -> WorkflowRegistry:
+    # Opened on first use so importing the server does not touch the disk
+    global _registry
+    if _registry is None:
+        _registry = WorkflowRegistry()
+    return _registry
+
+
+def save_registered_workflow(plan_id: str, workflow: Dict[str, Any]):
+    workflow_registry().put(plan_id, workflow)
+
+
+def load_registered_workflow(plan_id: str) -> Optional[Dict[str, Any]]:
+    return workflow_registry().get(plan_id)
+
+
+def get_cached_plan(plan_hash: str) -> Optional[Mapping[str, Any]]:
+    return plan_cache.get(plan_hash)
+
+
+def plan_cache_stats() -> Dict[str, Any]:
+    return {
+        "entries": len(plan_cache),
+        "hits": plan_cache_hits,
+        "misses": plan_cache_misses,
+        "evictions": plan_cache.evictions,
+        "registered": len(_registry) if _registry is not None else None
+    }